@@ -2,14 +2,23 @@
 
 import os
 import re
+import time
+import hashlib
+import threading
 import requests
 from typing import Dict, Any, Optional, Tuple, List
-from gpt4all import GPT4All
 import json
-from datetime import datetime, timedelta
 from dataclasses import dataclass
 from enum import Enum
-from data.firebase_service import get_db_reference
+from collections import OrderedDict
+from data.firebase_service import get_invoice_by_number, get_invoices_by_customer, get_invoice_summary
+from model_manager import ModelManager
+from generation_control import GenerationController, TokenBudgets, MAX_SENTENCES, server_stop_sequences
+from invoice_analysis import IntelligentInvoiceAnalyzer, stored_content_hash, summary_cache
+from invoice_models import process_element
+from invoice_timeline import CustomerTimeline, TimelineIndex
+from knowledge_retrieval import KnowledgeRetriever, EmbeddingIndex, normalize_text
+from session_store import create_session_store
 
 FIREBASE_INVOICES_URL = "https://klarbill-3de73-default-rtdb.europe-west1.firebasedatabase.app/invoices.json"
 
@@ -126,269 +135,18 @@ class GermanEnergyRegulations:
 
 def fetch_invoice_data(customer_number=None, invoice_number=None) -> Tuple[bool, Dict[str, Any]]:
     try:
-        ref = get_db_reference("invoices")
-        data = ref.get()
-        if not isinstance(data, dict):
-            return False, {}
-
         if invoice_number and invoice_number.strip():
-            filtered = {
-                k: v for k, v in data.items()
-                if v.get("Data", {}).get("ProzessDaten", {}).get("ProzessDatenElement", {}).get("invoiceNumber") == invoice_number
-            }
+            filtered = get_invoice_by_number(invoice_number)
             return bool(filtered), filtered
 
         if customer_number and customer_number.strip():
-            filtered = {
-                k: v for k, v in data.items()
-                if v.get("Data", {}).get("ProzessDaten", {}).get("ProzessDatenElement", {})
-                .get("Geschaeftspartner", {}).get("GeschaeftspartnerElement", {}).get("customerNumber") == customer_number
-            }
+            filtered = get_invoices_by_customer(customer_number)
             return bool(filtered), filtered
 
         return False, {}
     except Exception:
         return False, {}
 
-class IntelligentInvoiceAnalyzer:
-    """Advanced invoice analysis with corrected data extraction"""
-    
-    def __init__(self, invoice_data: Dict[str, Any]):
-        self.invoice_data = invoice_data
-        self.process_data = invoice_data.get("ProzessDaten", {}).get("ProzessDatenElement", {})
-        self.consumption_data = invoice_data.get("Abrechnungsmengen", {}).get("AbrechnungsmengenElement", [])
-        self.billing_items = invoice_data.get("Abrechnungspositionen", {}).get("AbrechnungspositionenElement", [])
-        self.partner_data = self.process_data.get("Geschaeftspartner", {}).get("GeschaeftspartnerElement", {})
-        self.cost_breakdown = invoice_data.get("Kostenblock", {}).get("KostenblockElement", [])
-        
-    def get_total_consumption(self) -> Tuple[float, str, str]:
-        """Get total consumption from AbrechnungsmengenElement - CORRECTED"""
-        total = 0
-        period_from = ""
-        period_to = ""
-        
-        if self.consumption_data:
-            # Sum all consumption periods from meter readings
-            total = sum(float(item.get("consumption", 0)) for item in self.consumption_data)
-            
-            # Get period from first and last entries
-            if len(self.consumption_data) > 0:
-                period_from = self.consumption_data[0].get("dateFrom", "")
-                period_to = self.consumption_data[-1].get("dateTo", "")
-        
-        # Fallback to process data if no consumption elements
-        if total == 0:
-            period_from = self.process_data.get("invoicePeriodFrom", "")
-            period_to = self.process_data.get("invoicePeriodTo", "")
-            total = float(self.process_data.get("consumption", 0))
-        
-        return total, period_from, period_to
-    
-    def get_invoice_amount(self) -> float:
-        """Get total invoice amount"""
-        return float(self.process_data.get("invoiceAmount", 0))
-    
-    def get_bonus_amount(self) -> float:
-        """Get bonus amount applied"""
-        return float(self.process_data.get("bonus", 0))
-    
-    def get_tax_amount(self) -> float:
-        """Get tax amount"""
-        return float(self.process_data.get("taxAmount", 0))
-    
-    def get_net_amount(self) -> float:
-        """Get net invoice amount"""
-        return float(self.process_data.get("netInvoiceAmount", 0))
-    
-    def get_invoice_date(self) -> str:
-        """Get invoice date"""
-        return self.process_data.get("invoiceDate", "")
-    
-    def get_invoice_number(self) -> str:
-        """Get invoice number"""
-        return self.process_data.get("invoiceNumber", "")
-    
-    def get_working_price_details(self) -> Dict[str, Any]:
-        """Get working price information from actual billing - SIMPLIFIED"""
-        working_prices = []
-        current_tariff_price = float(self.process_data.get("currentWorkPrice", 0)) / 100  # Convert ct to €
-        
-        # Extract actual billed working prices from billing items
-        for item in self.billing_items:
-            if item.get("priceType") == "USAGE_RATE" and item.get("name") == "Arbeit":
-                price_ct = float(item.get("price", 0))  # This is in ct/kWh
-                date_from = item.get("dateFrom", "")
-                date_to = item.get("dateTo", "")
-                
-                working_prices.append({
-                    "period": f"{date_from} - {date_to}",
-                    "price_ct_per_kwh": price_ct,
-                    "price_euro_per_kwh": price_ct / 100,
-                    "date_from": date_from,
-                    "date_to": date_to
-                })
-        
-        # If only one price period, use that as the main price
-        main_price_ct = working_prices[0]["price_ct_per_kwh"] if working_prices else current_tariff_price * 100
-        has_multiple_periods = len(working_prices) > 1
-        
-        return {
-            "current_tariff_ct_per_kwh": current_tariff_price * 100,
-            "main_price_ct_per_kwh": main_price_ct,
-            "billed_periods": working_prices,
-            "has_multiple_periods": has_multiple_periods
-        }
-    
-    def get_base_price(self) -> Tuple[float, float]:
-        """Get base price (Grundpreis) - CORRECTED"""
-        base_price_net = 0
-        
-        # Get from billing items
-        for item in self.billing_items:
-            if item.get("priceType") == "BASIC_RATE" and item.get("name") == "Grundkosten":
-                base_price_net = float(item.get("amount", 0))
-                break
-        
-        # Get gross base price from process data
-        base_price_gross = float(self.process_data.get("currentBasePrice", 0))
-        
-        return base_price_net, base_price_gross
-    
-    def get_specific_levy_amounts(self) -> Dict[str, float]:
-        """Calculate actual levy amounts - CORRECTED"""
-        levies = {
-            "KWKG-Umlage": 0,
-            "Offshore-Netzumlage": 0,
-            "Konzessionsabgabe": 0,
-            "NEV-Umlage": 0,
-            "Stromsteuer": 0,
-            "Netznutzung": 0,
-            "Messstellenbetrieb": 0
-        }
-        
-        total_consumption, _, _ = self.get_total_consumption()
-        
-        # Extract from detailed billing items
-        for item in self.billing_items:
-            if item.get("Abrechnungspositionen-Detailliert"):
-                details = item["Abrechnungspositionen-Detailliert"]["Abrechnungspositionen-DetailliertElement"]
-                for detail in details:
-                    name = detail.get("name", "")
-                    price_ct = float(detail.get("price", 0))
-                    detail_type = detail.get("type", "")
-                    
-                    # For usage-based charges
-                    if detail.get("priceType") == "USAGE_RATE" and total_consumption > 0:
-                        amount = (price_ct / 100) * total_consumption
-                        
-                        if "KWKG" in name:
-                            levies["KWKG-Umlage"] += amount
-                        elif "Offshore" in name:
-                            levies["Offshore-Netzumlage"] += amount
-                        elif "Konzessionsabgabe" in name:
-                            levies["Konzessionsabgabe"] += amount
-                        elif "NEV" in name:
-                            levies["NEV-Umlage"] += amount
-                        elif "Stromsteuer" in name:
-                            levies["Stromsteuer"] += amount
-                        elif detail_type == "GRID_USAGE":
-                            levies["Netznutzung"] += amount
-                    
-                    # For basic charges
-                    elif detail.get("priceType") == "BASIC_RATE":
-                        amount = price_ct
-                        if detail_type == "GRID_USAGE":
-                            levies["Netznutzung"] += amount
-                        elif detail_type == "METERING_POINT_OPERATION":
-                            levies["Messstellenbetrieb"] += amount
-        
-        return levies
-    
-    def is_zero_consumption_bill(self) -> bool:
-        """Check if this is a zero consumption bill"""
-        total_consumption, _, _ = self.get_total_consumption()
-        return total_consumption == 0
-    
-    def get_detailed_cost_breakdown(self) -> Dict[str, Any]:
-        """Get cost breakdown - CORRECTED"""
-        breakdown = {
-            "grid_and_metering": {"amount": 0, "percentage": 0, "components": []},
-            "taxes_and_levies": {"amount": 0, "percentage": 0, "components": []}, 
-            "energy_supply": {"amount": 0, "percentage": 0, "components": []},
-            "bonuses": {"amount": 0, "components": []}
-        }
-        
-        total_gross = self.get_invoice_amount()
-        
-        # Try Kostenblock first
-        if self.cost_breakdown:
-            for cost_block in self.cost_breakdown:
-                name = cost_block.get("printItemName", "")
-                amount = float(cost_block.get("amount", 0))
-                percentage = float(cost_block.get("percentageAmount", 0))
-                
-                if "Netz" in name or "Messung" in name:
-                    breakdown["grid_and_metering"]["amount"] = amount
-                    breakdown["grid_and_metering"]["percentage"] = percentage
-                elif "Steuer" in name or "Umlage" in name:
-                    breakdown["taxes_and_levies"]["amount"] = amount  
-                    breakdown["taxes_and_levies"]["percentage"] = percentage
-                elif "Beschaffung" in name or "Vertrieb" in name:
-                    breakdown["energy_supply"]["amount"] = amount
-                    breakdown["energy_supply"]["percentage"] = percentage
-        
-        # Calculate from components if Kostenblock not available
-        else:
-            levies = self.get_specific_levy_amounts()
-            
-            grid_amount = levies["Netznutzung"] + levies["Messstellenbetrieb"]
-            levy_amount = (levies["KWKG-Umlage"] + levies["Offshore-Netzumlage"] + 
-                          levies["Konzessionsabgabe"] + levies["NEV-Umlage"] + 
-                          levies["Stromsteuer"] + self.get_tax_amount())
-            
-            net_amount = self.get_net_amount()
-            supply_amount = net_amount - grid_amount - (levy_amount - self.get_tax_amount())
-            
-            breakdown["grid_and_metering"]["amount"] = grid_amount
-            breakdown["grid_and_metering"]["percentage"] = (grid_amount / total_gross * 100) if total_gross > 0 else 0
-            
-            breakdown["taxes_and_levies"]["amount"] = levy_amount
-            breakdown["taxes_and_levies"]["percentage"] = (levy_amount / total_gross * 100) if total_gross > 0 else 0
-            
-            breakdown["energy_supply"]["amount"] = supply_amount
-            breakdown["energy_supply"]["percentage"] = (supply_amount / total_gross * 100) if total_gross > 0 else 0
-        
-        # Add bonus information
-        bonus_amount = self.get_bonus_amount()
-        if bonus_amount != 0:
-            breakdown["bonuses"]["amount"] = bonus_amount
-        
-        return breakdown
-    
-    def analyze_unusual_charges(self) -> List[Dict[str, Any]]:
-        """Identify unusual charges - keeping original logic"""
-        unusual_items = []
-        
-        # Check for high basic charges
-        for item in self.billing_items:
-            if item.get("priceType") == "BASIC_RATE":
-                amount = float(item.get("amount", 0))
-                if amount > 100:
-                    unusual_items.append({
-                        "type": "high_basic_charge",
-                        "amount": amount,
-                        "explanation": "Higher than typical basic charge"
-                    })
-        
-        # Check for zero consumption
-        if self.is_zero_consumption_bill():
-            unusual_items.append({
-                "type": "zero_consumption_bill",
-                "explanation": "This is a setup/initial bill with zero consumption"
-            })
-            
-        return unusual_items
-
 class ContextualQueryAnalyzer:
     """Analyzes user queries for intent and determines appropriate response strategy"""
     
@@ -433,41 +191,76 @@ class ContextualQueryAnalyzer:
         r"definition|bedeutung"
     ]
     
+    BRIEF_KEYWORDS = ['how much', 'total', 'amount', 'consumption', 'wieviel']
+    DETAILED_KEYWORDS = ['explain', 'detail', 'breakdown', 'why', 'understand', 'erkläre', 'aufschlüsseln']
+
+    # Checked in this order; the first category that matches wins
+    CATEGORY_ORDER = [
+        ("greeting", QueryType.GREETING),
+        ("explanation", QueryType.EXPLANATION),
+        ("navigation", QueryType.NAVIGATION),
+        ("simple_fact", QueryType.SIMPLE_FACT),
+        ("calculation", QueryType.CALCULATION),
+        ("comparison", QueryType.COMPARISON)
+    ]
+
+    @classmethod
+    def _compile_classifier(cls) -> Dict[str, "re.Pattern"]:
+        """Compile each pattern list into a single alternation, once per process.
+
+        Searching one compiled alternation is equivalent to ``any(re.search(p)
+        for p in patterns)`` but runs entirely inside the regex engine. (A single
+        pattern of per-category lookaheads was measured slower: lookaheads stop
+        sre from skipping ahead on the literal prefix, so every category rescans
+        the whole query.)
+        """
+        def alternatives(patterns):
+            return re.compile("|".join(f"(?:{pattern})" for pattern in patterns))
+
+        def keywords(words):
+            return re.compile("|".join(re.escape(word) for word in sorted(words, key=len, reverse=True)))
+
+        return {
+            "greeting": keywords(cls.GREETINGS),
+            "explanation": alternatives(cls.EXPLANATION_PATTERNS),
+            "navigation": alternatives(cls.NAVIGATION_PATTERNS),
+            "simple_fact": alternatives(cls.SIMPLE_FACT_PATTERNS),
+            "calculation": alternatives(cls.CALCULATION_PATTERNS),
+            "comparison": alternatives(cls.COMPARISON_PATTERNS),
+            "brief": keywords(cls.BRIEF_KEYWORDS),
+            "detailed": keywords(cls.DETAILED_KEYWORDS)
+        }
+
     def __init__(self, conversation_history: List[str] = None):
         self.conversation_history = conversation_history or []
         
     def analyze_query(self, query: str) -> Tuple[QueryType, ResponseFormat]:
         """Analyze query and determine response strategy with conciseness"""
         query_lower = query.lower()
-        query_length = len(query.split())
-        
-        # Determine conciseness level based on query
-        if query_length <= 5 or any(word in query_lower for word in ['how much', 'total', 'amount', 'consumption', 'wieviel']):
-            conciseness_level = "brief"
-        elif any(word in query_lower for word in ['explain', 'detail', 'breakdown', 'why', 'understand', 'erkläre', 'aufschlüsseln']):
-            conciseness_level = "detailed"
-        else:
-            conciseness_level = "moderate"
+        patterns = _QUERY_PATTERNS
+
+        # First matching category wins
+        query_type = next((qtype for name, qtype in self.CATEGORY_ORDER if patterns[name].search(query_lower)), None)
+        
+        # Determine conciseness level based on query (only simple facts and the default use it)
+        if query_type in (QueryType.SIMPLE_FACT, None):
+            if len(query_lower.split()) <= 5 or patterns["brief"].search(query_lower):
+                conciseness_level = "brief"
+            elif patterns["detailed"].search(query_lower):
+                conciseness_level = "detailed"
+            else:
+                conciseness_level = "moderate"
         
         # Check for greetings
-        if any(greet in query_lower for greet in self.GREETINGS):
+        if query_type == QueryType.GREETING:
             return QueryType.GREETING, ResponseFormat(
                 concise=True, 
                 personalized=True, 
                 conciseness_level="brief"
             )
         
-        # Check for explanations/definitions
-        if any(re.search(pattern, query_lower) for pattern in self.EXPLANATION_PATTERNS):
-            return QueryType.EXPLANATION, ResponseFormat(
-                concise=False,
-                include_regulatory_context=True,
-                personalized=True,
-                conciseness_level="moderate"
-            )
-        
         # Check for navigation queries
-        if any(re.search(pattern, query_lower) for pattern in self.NAVIGATION_PATTERNS):
+        if query_type == QueryType.NAVIGATION:
             return QueryType.NAVIGATION, ResponseFormat(
                 concise=False, 
                 personalized=True,
@@ -475,7 +268,7 @@ class ContextualQueryAnalyzer:
             )
         
         # Check for simple facts
-        if any(re.search(pattern, query_lower) for pattern in self.SIMPLE_FACT_PATTERNS):
+        if query_type == QueryType.SIMPLE_FACT:
             return QueryType.SIMPLE_FACT, ResponseFormat(
                 concise=True, 
                 personalized=True,
@@ -483,7 +276,7 @@ class ContextualQueryAnalyzer:
             )
         
         # Check for calculation requests
-        if any(re.search(pattern, query_lower) for pattern in self.CALCULATION_PATTERNS):
+        if query_type == QueryType.CALCULATION:
             return QueryType.CALCULATION, ResponseFormat(
                 detailed_calculation=True, 
                 include_regulatory_context=False,
@@ -492,13 +285,22 @@ class ContextualQueryAnalyzer:
             )
         
         # Check for comparisons
-        if any(re.search(pattern, query_lower) for pattern in self.COMPARISON_PATTERNS):
+        if query_type == QueryType.COMPARISON:
             return QueryType.COMPARISON, ResponseFormat(
                 detailed_calculation=False,
                 personalized=True,
                 conciseness_level="moderate"
             )
         
+        # Check for explanations/definitions
+        if query_type == QueryType.EXPLANATION:
+            return QueryType.EXPLANATION, ResponseFormat(
+                concise=False,
+                include_regulatory_context=True,
+                personalized=True,
+                conciseness_level="moderate"
+            )
+        
         # Default to explanation
         return QueryType.EXPLANATION, ResponseFormat(
             include_regulatory_context=False,
@@ -506,12 +308,44 @@ class ContextualQueryAnalyzer:
             conciseness_level=conciseness_level
         )
 
+_QUERY_PATTERNS = ContextualQueryAnalyzer._compile_classifier()
+
 class KnowledgeBaseIntegrator:
     """Enhanced integrator that leverages category structure"""
-    
+
+    # Category keywords mapping
+    CATEGORY_KEYWORDS = {
+        'invoice_structure': ['where', 'find', 'section', 'invoice structure', 'malo-id', 'obis', 'locate'],
+        'consumption': ['consumption', 'usage', 'kwh', 'meter reading', 'estimate', 'verbrauch'],
+        'pricing_components': ['price', 'cost', 'charge', 'fee', 'component', 'breakdown', 'tariff', 'konzessionsabgabe', 'netzentgelt', 'stromsteuer'],
+        'payments_advances': ['payment', 'advance', 'installment', 'abschlag', 'prepayment', 'verpasse', 'miss'],
+        'payments_credits': ['credit', 'balance', 'refund', 'guthaben'],
+        'late_billing': ['late', 'delayed', 'overdue', 'verspätet'],
+        'regulatory_changes': ['regulation', 'law', 'changes', 'eeg', 'reform'],
+        'contract_terms': ['contract', 'term', 'agreement', 'vertrag'],
+        'disputes_complaints': ['dispute', 'complaint', 'wrong', 'error', 'fehler'],
+        'calculations_examples': ['calculate', 'formula', 'example', 'berechnung'],
+        'bonuses_discounts': ['bonus', 'discount', 'neukunden', 'cashback', 'rabatt'],
+        'meter_operations': ['meter', 'reading', 'zähler', 'ablesung'],
+        'energy_efficiency': ['efficiency', 'save', 'reduce', 'sparen'],
+        'green_energy_options': ['green', 'renewable', 'ökostrom', 'solar'],
+        'taxes_and_vat': ['tax', 'vat', 'mwst', 'steuer'],
+        'special_customer_situations': ['move', 'umzug', 'special', 'hardship'],
+        'consumer_rights': ['rights', 'protection', 'verbraucherschutz'],
+        'dispute_resolution': ['resolution', 'mediation', 'schlichtung'],
+        'energy_transition': ['transition', 'energiewende', 'future'],
+        'comparisons_graphs': ['graph', 'chart', 'compare', 'vergleich'],
+        'energy_price_brake': ['price brake', 'preisbremse', 'cap', 'relief']
+    }
+
+    # Terms whose presence in both query and item marks the item as highly relevant
+    BOOST_TERMS = ('konzessionsabgabe',)
+
     def __init__(self, knowledge_base_path: str = None):
         self.knowledge_base = {}
         self.categories = {}
+        self.retriever = KnowledgeRetriever({}, self.CATEGORY_KEYWORDS)
+        self.embeddings = None
         if knowledge_base_path:
             self.load_knowledge_base(knowledge_base_path)
         else:
@@ -522,138 +356,408 @@ class KnowledgeBaseIntegrator:
     
     def load_knowledge_base(self, path: str):
         """Load and organize knowledge base by categories"""
+        kb_hash = ""
         try:
-            with open(path, 'r', encoding='utf-8') as f:
-                self.knowledge_base = json.load(f)
-                self.categories = self.knowledge_base.get("utility_invoice_queries", {})
-                print(f"✅ Loaded {len(self.categories)} knowledge base categories")
+            with open(path, 'rb') as f:
+                raw = f.read()
+            kb_hash = hashlib.sha256(raw).hexdigest()
+            self.knowledge_base = json.loads(raw.decode('utf-8'))
+            self.categories = self.knowledge_base.get("utility_invoice_queries", {})
+            print(f"✅ Loaded {len(self.categories)} knowledge base categories")
         except Exception as e:
             print(f"Error loading knowledge base: {e}")
             self.knowledge_base = {}
             self.categories = {}
+
+        started = time.perf_counter()
+        self.retriever = KnowledgeRetriever(self.categories, self.CATEGORY_KEYWORDS)
+        print(f"✅ Knowledge base index built: {len(self.retriever.items)} items in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+        self.embeddings = None
+        if os.getenv("KB_RETRIEVAL_BACKEND", "bm25") == "embedding" and kb_hash:
+            try:
+                started = time.perf_counter()
+                self.embeddings = EmbeddingIndex(self.retriever, kb_hash)
+                print(f"✅ Knowledge base embeddings ready ({self.embeddings.model_name}) in {time.perf_counter() - started:.1f}s")
+            except ImportError as e:
+                print(f"Embedding retrieval unavailable ({e}), using BM25")
+            except Exception as e:
+                print(f"Error building knowledge base embeddings: {e}, using BM25")
     
     def get_category_for_query(self, query: str) -> str:
         """Determine the most relevant category based on query"""
-        query_lower = query.lower()
-        
-        # Category keywords mapping
-        category_keywords = {
-            'invoice_structure': ['where', 'find', 'section', 'invoice structure', 'malo-id', 'obis', 'locate'],
-            'consumption': ['consumption', 'usage', 'kwh', 'meter reading', 'estimate', 'verbrauch'],
-            'pricing_components': ['price', 'cost', 'charge', 'fee', 'component', 'breakdown', 'tariff', 'konzessionsabgabe', 'netzentgelt', 'stromsteuer'],
-            'payments_advances': ['payment', 'advance', 'installment', 'abschlag', 'prepayment', 'verpasse', 'miss'],
-            'payments_credits': ['credit', 'balance', 'refund', 'guthaben'],
-            'late_billing': ['late', 'delayed', 'overdue', 'verspätet'],
-            'regulatory_changes': ['regulation', 'law', 'changes', 'eeg', 'reform'],
-            'contract_terms': ['contract', 'term', 'agreement', 'vertrag'],
-            'disputes_complaints': ['dispute', 'complaint', 'wrong', 'error', 'fehler'],
-            'calculations_examples': ['calculate', 'formula', 'example', 'berechnung'],
-            'bonuses_discounts': ['bonus', 'discount', 'neukunden', 'cashback', 'rabatt'],
-            'meter_operations': ['meter', 'reading', 'zähler', 'ablesung'],
-            'energy_efficiency': ['efficiency', 'save', 'reduce', 'sparen'],
-            'green_energy_options': ['green', 'renewable', 'ökostrom', 'solar'],
-            'taxes_and_vat': ['tax', 'vat', 'mwst', 'steuer'],
-            'special_customer_situations': ['move', 'umzug', 'special', 'hardship'],
-            'consumer_rights': ['rights', 'protection', 'verbraucherschutz'],
-            'dispute_resolution': ['resolution', 'mediation', 'schlichtung'],
-            'energy_transition': ['transition', 'energiewende', 'future'],
-            'comparisons_graphs': ['graph', 'chart', 'compare', 'vergleich'],
-            'energy_price_brake': ['price brake', 'preisbremse', 'cap', 'relief']
-        }
-        
-        # Score each category
-        scores = {}
-        for category, keywords in category_keywords.items():
-            score = sum(2 if keyword in query_lower else 0 for keyword in keywords)
-            # Boost score for exact phrase matches
-            if category.replace('_', ' ') in query_lower:
-                score += 5
-            if score > 0:
-                scores[category] = score
-        
-        # Return highest scoring category
-        if scores:
-            return max(scores, key=scores.get)
-        return 'miscellaneous'
+        return self.retriever.category_for_query(query)
     
     def find_relevant_context(self, query: str, language: str = 'en', max_items: int = 5) -> List[Dict[str, str]]:
         """Enhanced context finding with category awareness"""
+        if self.embeddings is not None:
+            return self.find_similar_context(query, language, max_items)
+
         relevant_items = []
-        query_lower = query.lower()
-        query_words = set(query_lower.split())
-        
-        # First, check the most relevant category
+        query_normalized = normalize_text(query)
+        boost_terms = [term for term in self.BOOST_TERMS if term in query_normalized]
+        input_key = f"input_{language}"
+
+        # Items in the most relevant category are accepted on a weaker match
         primary_category = self.get_category_for_query(query)
-        
-        # Search in primary category first
-        if primary_category in self.categories:
-            items = self.categories.get(primary_category, [])
-            for item in items:
-                input_key = f"input_{language}"
-                if input_key in item:
-                    item_text_lower = item[input_key].lower()
-                    item_words = set(item_text_lower.split())
-                    
-                    # Calculate overlap score
-                    overlap = len(query_words.intersection(item_words))
-                    
-                    # Check for specific term matches
-                    if "konzessionsabgabe" in query_lower and "konzessionsabgabe" in item_text_lower:
-                        overlap += 10  # High boost for exact term match
-                    
-                    # Check for phrase matches
-                    if overlap > 2 or any(phrase in query_lower for phrase in item_text_lower.split('?')[0:1]):
-                        relevant_items.append({
-                            "query": item[input_key],
-                            "response": item.get(f"response_{language}", ""),
-                            "category": primary_category,
-                            "relevance": "high" if overlap > 3 else "medium",
-                            "score": overlap
-                        })
-        
-        # Then search other categories if needed
-        if len(relevant_items) < max_items:
-            for category, items in self.categories.items():
-                if category == primary_category:
+
+        for category, item, item_normalized, score, overlap in self.retriever.search(query, language):
+            if category == primary_category:
+                if any(term in item_normalized for term in boost_terms):
+                    overlap += 10  # High boost for exact term match
+                # Check for phrase matches
+                if overlap > 2 or item_normalized.split('?')[0] in query_normalized:
+                    relevance = "high" if overlap > 3 else "medium"
+                else:
                     continue
-                for item in items:
-                    input_key = f"input_{language}"
-                    if input_key in item:
-                        item_text_lower = item[input_key].lower()
-                        item_words = set(item_text_lower.split())
-                        overlap = len(query_words.intersection(item_words))
-                        
-                        if overlap > 1:
-                            relevant_items.append({
-                                "query": item[input_key],
-                                "response": item.get(f"response_{language}", ""),
-                                "category": category,
-                                "relevance": "medium" if overlap > 2 else "low",
-                                "score": overlap
-                            })
+            elif overlap > 1:
+                relevance = "medium" if overlap > 2 else "low"
+            else:
+                continue
+            relevant_items.append({
+                "query": item[input_key],
+                "response": item.get(f"response_{language}", ""),
+                "category": category,
+                "relevance": relevance,
+                "score": round(score, 3)
+            })
         
-        # Sort by relevance score and return top items
+        # Sort by BM25 score and return top items
+        relevant_items.sort(key=lambda x: x['score'], reverse=True)
+        return relevant_items[:max_items]
+
+    def find_similar_context(self, query: str, language: str = 'en', max_items: int = 5) -> List[Dict[str, str]]:
+        """Context finding by embedding similarity (KB_RETRIEVAL_BACKEND=embedding)"""
+        min_similarity = float(os.getenv("KB_EMBEDDING_MIN_SIMILARITY", "0.5"))
+        primary_category = self.get_category_for_query(query)
+        relevant_items = []
+
+        for category, item, similarity in self.embeddings.search(query, language, top_k=max_items * 2):
+            if similarity < min_similarity:
+                continue
+            relevant_items.append({
+                "query": item[f"input_{language}"],
+                "response": item.get(f"response_{language}", ""),
+                "category": category,
+                "relevance": "high" if similarity >= 0.75 else "medium" if similarity >= 0.6 else "low",
+                # Small nudge for the keyword category, like the primary-category pass of BM25
+                "score": round(similarity + (0.05 if category == primary_category else 0.0), 3)
+            })
+
         relevant_items.sort(key=lambda x: x['score'], reverse=True)
         return relevant_items[:max_items]
 
+class FastPathResponder:
+    """Template answers for SIMPLE_FACT and GREETING queries that need no model call"""
+
+    FACT_KEYWORDS = {
+        "consumption": r"consumption|consumed?|usage|used?|kwh|verbrauch|stromverbrauch|gasverbrauch|verbraucht",
+        "amount": r"amount|total|pay|owe|rechnungsbetrag|gesamtrechnung|gesamtbetrag|betrag|zahlen|"
+                  r"how much is (?:my|the|this) (?:bill|invoice)|wie hoch ist (?:meine|die|diese) rechnung",
+        "customer_number": r"customer number|customer no|kundennummer",
+        "breakdown": r"breakdown|break down|aufschlüsselung|aufschlüsseln|aufgeschlüsselt|kostenaufschlüsselung"
+    }
+    FACT_PATTERNS = {name: re.compile(rf"\b(?:{keywords})\b") for name, keywords in FACT_KEYWORDS.items()}
+    # Words that may surround the keywords of a plain fact question; any other word means more is asked
+    FACT_WORDS = (r"what|what's|whats|is|was|my|the|please|can|could|you|show|me|tell|how|much|high|did|do|i|have|to|in|"
+                  r"this|for|of|on|current|electricity|energy|invoice|bill|period|wie|viel|hoch|ist|war|mein|meine|"
+                  r"meinen|der|die|das|den|gesamt|gesamte|gesamten|insgesamt|bitte|zeig|zeige|mir|habe|ich|"
+                  r"muss|dieser|diese|rechnung|im|zeitraum|strom|gas")
+    FACT_QUERY = re.compile(rf"^(?:(?:{FACT_WORDS}|{'|'.join(FACT_KEYWORDS.values())})\b[\s,]*)+[?.!]*$")
+
+    # Anything that asks for reasons, history, advice or explanation needs the model
+    OPEN_ENDED = re.compile(r"why|warum|wieso|explain|erklär|compar|vergleich|previous|last|letzte|vorherig|chang|änder|higher|lower|höher|niedriger|wrong|falsch|fehler|"
+                            r"wie kann|how can|kann ich|can i|senken|reduce|raten|co2")
+    GREETING_WORDS = re.compile(r"^(hi|hello|hey|hallo|servus|moin|good (morning|afternoon|evening)|guten (morgen|tag|abend)|grüß gott)\b[\s!.,]*(there|klarbill)?[\s!.,]*$")
+
+    def __init__(self, enabled: bool = None, min_confidence: float = None):
+        self.enabled = enabled if enabled is not None else os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+        self.min_confidence = min_confidence if min_confidence is not None else float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.8"))
+
+    def classify(self, query: str, query_type: QueryType) -> Tuple[Optional[str], float]:
+        """Return the templated intent for a query and how sure we are about it"""
+        query_lower = query.lower().strip()
+
+        if query_type == QueryType.GREETING:
+            return ("greeting", 1.0) if self.GREETING_WORDS.match(query_lower) else (None, 0.0)
+
+        if query_type != QueryType.SIMPLE_FACT:
+            return None, 0.0
+
+        # Only a query that is nothing but a fact question gets a template
+        if not self.FACT_QUERY.match(query_lower):
+            return None, 0.0
+        facts = [name for name, pattern in self.FACT_PATTERNS.items() if pattern.search(query_lower)]
+        if not facts:
+            return None, 0.0
+
+        # A breakdown request mentions amounts too; it is still one question
+        if "breakdown" in facts:
+            facts = ["breakdown"]
+
+        confidence = 0.95 if len(facts) == 1 else 0.5
+        if self.OPEN_ENDED.search(query_lower):
+            confidence -= 0.5
+        if len(query_lower.split()) > 12:
+            confidence -= 0.2
+        return facts[0], confidence
+
+    def respond(self, query: str, query_type: QueryType, analyzer: "IntelligentInvoiceAnalyzer", language: str = 'en') -> Optional[str]:
+        """Templated answer, or None when the model should answer instead"""
+        if not self.enabled:
+            return None
+        intent, confidence = self.classify(query, query_type)
+        if intent is None or confidence < self.min_confidence:
+            return None
+        language = language if language in ("de", "en") else "en"
+        return getattr(self, f"_{intent}")(analyzer, language)
+
+    @staticmethod
+    def _euro(value: float, language: str) -> str:
+        if language == "de":
+            return f"{value:,.2f} €".replace(",", "X").replace(".", ",").replace("X", ".")
+        return f"€{value:,.2f}"
+
+    @staticmethod
+    def _kwh(value: float, language: str) -> str:
+        formatted = f"{value:,.0f}"
+        return (formatted.replace(",", ".") if language == "de" else formatted) + " kWh"
+
+    def _greeting(self, analyzer, language):
+        raw_salutation = analyzer.partner.salutation
+        name = analyzer.partner.name
+        if language == "de":
+            addressee = f"{raw_salutation} {name}".strip()
+            return f"Hallo {addressee}! Ich helfe Ihnen gerne bei Ihrer Rechnung {analyzer.get_invoice_number()}. Was möchten Sie wissen?"
+        salutation = {"frau": "Ms.", "herr": "Mr."}.get(raw_salutation.lower(), "")
+        addressee = f"{salutation} {name}".strip()
+        return f"Hello {addressee}! I'm happy to help with your invoice {analyzer.get_invoice_number()}. What would you like to know?"
+
+    def _consumption(self, analyzer, language):
+        total, period_from, period_to = analyzer.get_total_consumption()
+        if analyzer.is_zero_consumption_bill():
+            if language == "de":
+                return (f"Diese Rechnung zeigt 0 kWh Verbrauch für den Zeitraum {period_from} bis {period_to}. "
+                        "Das ist typisch für eine Einrichtungs- bzw. Startabrechnung, es fallen nur Grundkosten an.")
+            return (f"This invoice shows 0 kWh consumption for {period_from} to {period_to}. "
+                    "That is typical for a setup or initial bill, so only base fees apply.")
+        if language == "de":
+            return f"Ihr Gesamtverbrauch im Zeitraum {period_from} bis {period_to} beträgt {self._kwh(total, language)}."
+        return f"Your total consumption for the period {period_from} to {period_to} is {self._kwh(total, language)}."
+
+    def _amount(self, analyzer, language):
+        amount = self._euro(analyzer.get_invoice_amount(), language)
+        net = self._euro(analyzer.get_net_amount(), language)
+        tax = self._euro(analyzer.get_tax_amount(), language)
+        bonus = analyzer.get_bonus_amount()
+        if language == "de":
+            text = f"Ihr Rechnungsbetrag für Rechnung {analyzer.get_invoice_number()} beträgt {amount} ({net} netto zzgl. {tax} Mehrwertsteuer)."
+            if bonus:
+                text += f" Dabei wurde ein Bonus von {self._euro(abs(bonus), language)} berücksichtigt."
+            return text
+        text = f"Your invoice amount for invoice {analyzer.get_invoice_number()} is {amount} ({net} net plus {tax} VAT)."
+        if bonus:
+            text += f" A bonus of {self._euro(abs(bonus), language)} has been applied."
+        return text
+
+    def _customer_number(self, analyzer, language):
+        customer_number = analyzer.partner.customer_number
+        if language == "de":
+            return f"Ihre Kundennummer lautet {customer_number}."
+        return f"Your customer number is {customer_number}."
+
+    def _breakdown(self, analyzer, language):
+        net = self._euro(analyzer.get_net_amount(), language)
+        tax = self._euro(analyzer.get_tax_amount(), language)
+        bonus = self._euro(analyzer.get_bonus_amount(), language)
+        total = self._euro(analyzer.get_invoice_amount(), language)
+        if language == "de":
+            return (f"So setzt sich Ihre Rechnung zusammen:\n"
+                    f"- Grundgebühr + Verbrauchskosten: {net} (netto)\n"
+                    f"- Mehrwertsteuer (19%): {tax}\n"
+                    f"- Bonus/Rabatt: {bonus}\n"
+                    f"- Gesamt: {total}")
+        return (f"Here is how your invoice adds up:\n"
+                f"- Base fee + usage charges: {net} (net)\n"
+                f"- VAT (19%): {tax}\n"
+                f"- Bonus/discount: {bonus}\n"
+                f"- Total: {total}")
+
+class ResponseCache:
+    """LRU/TTL cache of generated answers keyed on (invoice, normalized query, language).
+
+    Exact hits match on the normalized query; near-duplicates are found by
+    character-trigram similarity against the cached queries of the same
+    invoice version and language. Entries are tied to the invoice content
+    hash, so a changed invoice never serves a stale answer.
+    """
+
+    STOPWORDS = {
+        "a", "an", "the", "i", "me", "my", "is", "are", "was", "be", "do", "did", "does", "what", "how",
+        "much", "many", "of", "for", "on", "in", "to", "please", "can", "could", "would", "you", "tell",
+        "show", "about", "this", "that", "it", "there", "have", "has", "s",
+        "ich", "mein", "meine", "meinen", "meiner", "mir", "mich", "ist", "sind", "war", "wie", "viel",
+        "was", "der", "die", "das", "den", "dem", "des", "ein", "eine", "einen", "bitte", "kannst",
+        "können", "sie", "du", "habe", "hat", "zu", "für", "auf", "im", "von", "mal"
+    }
+    SYNONYMS = {
+        "use": "consumption", "used": "consumption", "usage": "consumption", "consume": "consumption",
+        "consumed": "consumption", "verbraucht": "verbrauch", "verbrauchs": "verbrauch",
+        "bill": "invoice", "billing": "invoice", "rechnungsbetrag": "rechnung betrag",
+        "total": "amount", "sum": "amount", "gesamt": "betrag", "gesamtbetrag": "betrag",
+        "costs": "cost", "charges": "charge"
+    }
+
+    def __init__(self, max_entries: int = None, ttl_seconds: float = None, similarity_threshold: float = None):
+        self.max_entries = max_entries or int(os.getenv("RESPONSE_CACHE_SIZE", "2048"))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400"))
+        self.similarity_threshold = similarity_threshold or float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.8"))
+        self.enabled = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+        self._entries: "OrderedDict[Tuple, Tuple[float, str, str]]" = OrderedDict()
+        self._buckets: Dict[Tuple, Dict[str, set]] = {}
+        self._invoice_versions: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def normalize(self, query: str) -> str:
+        words = re.findall(r"\w+", query.lower())
+        tokens = set()
+        for word in words:
+            if word in self.STOPWORDS:
+                continue
+            tokens.update(self.SYNONYMS.get(word, word).split())
+        return " ".join(sorted(tokens))
+
+    @staticmethod
+    def _trigrams(text: str) -> set:
+        padded = f"  {text} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def _drop(self, key: Tuple):
+        self._entries.pop(key, None)
+        bucket = self._buckets.get(key[:3])
+        if bucket is not None:
+            bucket.pop(key[3], None)
+            if not bucket:
+                del self._buckets[key[:3]]
+
+    def _check_version(self, invoice_number: str, version: str):
+        # A new content hash for an invoice means it changed: forget its old answers
+        previous = self._invoice_versions.get(invoice_number)
+        if previous is not None and previous != version:
+            self._invalidate(invoice_number)
+        self._invoice_versions[invoice_number] = version
+
+    def _invalidate(self, invoice_number: str):
+        for key in [k for k in self._entries if k[0] == invoice_number]:
+            self._drop(key)
+        self._invoice_versions.pop(invoice_number, None)
+        self.invalidations += 1
+
+    def invalidate_invoice(self, invoice_number: str):
+        with self._lock:
+            self._invalidate(invoice_number)
+
+    def get(self, invoice_number: str, version: str, language: str, query: str, query_type: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        normalized = self.normalize(query)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(invoice_number, version)
+            key = (invoice_number, version, language, normalized)
+            entry = self._entries.get(key)
+            if entry is None:
+                # Near-duplicate search within the same invoice version and language
+                best_key, best_score = None, 0.0
+                query_grams = self._trigrams(normalized)
+                for cached_query, grams in self._buckets.get(key[:3], {}).items():
+                    score = len(query_grams & grams) / (len(query_grams | grams) or 1)
+                    if score > best_score:
+                        best_key, best_score = key[:3] + (cached_query,), score
+                if best_key is not None and best_score >= self.similarity_threshold \
+                        and self._entries[best_key][2] == query_type:
+                    key, entry = best_key, self._entries[best_key]
+                    self.near_hits += 1
+                else:
+                    self.misses += 1
+                    return None
+            else:
+                self.hits += 1
+
+            created, text, _ = entry
+            if now - created > self.ttl_seconds:
+                self._drop(key)
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            return text
+
+    def put(self, invoice_number: str, version: str, language: str, query: str, query_type: str, text: str):
+        if not self.enabled or not text:
+            return
+        normalized = self.normalize(query)
+        key = (invoice_number, version, language, normalized)
+        with self._lock:
+            self._check_version(invoice_number, version)
+            self._entries[key] = (time.monotonic(), text, query_type)
+            self._entries.move_to_end(key)
+            self._buckets.setdefault(key[:3], {})[normalized] = self._trigrams(normalized)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.near_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.near_hits) / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
 class AgenticUtilityBillLLM:
     """Intelligent, contextual utility bill assistant with sophisticated reasoning"""
     
-    def __init__(self, model_name="mistral-7b-instruct-v0.1.Q4_0.gguf"):
+    def __init__(self, model_name="mistral-7b-instruct-v0.1.Q4_0.gguf", load_model: bool = True):
         base_dir = os.path.dirname(os.path.abspath(__file__))
         self.model_path = os.path.join(base_dir, "models")
-        self.model = GPT4All(model_name, model_path=self.model_path)
+        self.model_name = model_name
+        # Weights load on first use (or via load_model) and are memory-mapped
+        self.models = ModelManager(self.model_path, model_name)
+        if load_model:
+            self.load_model()
         
         self.regulations = GermanEnergyRegulations()
+        self._prompt_prefixes = {}
         self.knowledge_base = KnowledgeBaseIntegrator()
-        self.conversation_context = {
-            'queries': [],
-            'language': 'en',
-            'customer_data': {},
-            'current_invoice': {},
-            'previous_invoices': []
-        }
-        
+        self.fast_path = FastPathResponder()
+        self.response_cache = ResponseCache()
+        self.sessions = create_session_store()
+        self.timelines = TimelineIndex(get_invoices_by_customer)
+        self.token_budgets = TokenBudgets()
+
+        # compute: summarize invoices locally (default), materialized: read the invoice_summaries/ documents
+        if os.getenv("INVOICE_SUMMARY_SOURCE", "compute") == "materialized":
+            summary_cache.loader = get_invoice_summary
+        
+    @property
+    def model(self):
+        """The model pool; the first access loads it"""
+        return self.models.get()
+
+    def load_model(self):
+        """Load the model instances now instead of on the first generation"""
+        return self.models.preload()
+
     def validate_identifier(self, identifier: str) -> Tuple[bool, str, Dict]:
         """Validate if identifier is customer number or invoice number"""
         # Try as invoice number first
@@ -668,38 +772,61 @@ class AgenticUtilityBillLLM:
         
         return False, "none", {}
     
-    def compare_with_previous_invoice(self, current_invoice: Dict, all_invoices: Dict) -> Dict[str, Any]:
+    def previous_invoice_analyzer(self, current_key: Optional[str], all_invoices: Dict) -> Optional[IntelligentInvoiceAnalyzer]:
+        """Follow the previous-invoice pointer of the materialized summary, if there is one"""
+        if not current_key or summary_cache.loader is None:
+            return None
+        try:
+            document = summary_cache.loader(current_key) or {}
+            previous = document.get("previous_invoice")
+            if not previous:
+                return None
+            previous_key = previous["key"]
+            if previous_key in all_invoices:
+                return IntelligentInvoiceAnalyzer(all_invoices[previous_key].get("Data", {}), previous_key)
+            return IntelligentInvoiceAnalyzer.from_summary_document(summary_cache.loader(previous_key))
+        except Exception as e:
+            print(f"Error following previous invoice pointer: {e}")
+            return None
+
+    def customer_timeline(self, analyzer: IntelligentInvoiceAnalyzer, current_key: Optional[str],
+                          all_invoices: Dict) -> CustomerTimeline:
+        """Timeline holding the current invoice: the customer's cached timeline, else one built from all_invoices"""
+        timeline_key = current_key or "current"
+        customer_number = analyzer.partner.customer_number
+        if customer_number:
+            try:
+                # An invoice without a key can never show up in a fetch, so it must not force one
+                timeline = self.timelines.get(customer_number, required_key=current_key)
+                if timeline_key in timeline:
+                    return timeline
+            except Exception as e:
+                print(f"Error loading invoice timeline: {e}")
+
+        timeline = CustomerTimeline.from_invoices(customer_number, all_invoices)
+        timeline.add(timeline_key, analyzer.summary)
+        return timeline
+
+    def compare_with_previous_invoice(self, current_invoice: Dict, all_invoices: Dict,
+                                      current_key: Optional[str] = None) -> Dict[str, Any]:
         """Compare current invoice with previous invoice"""
-        current_analyzer = IntelligentInvoiceAnalyzer(current_invoice)
-        current_date = datetime.strptime(current_analyzer.get_invoice_date(), "%d.%m.%Y")
-        
-        # Find previous invoice
-        previous_invoice = None
-        previous_date = None
-        
-        for invoice_data in all_invoices.values():
-            invoice = invoice_data.get("Data", {})
-            analyzer = IntelligentInvoiceAnalyzer(invoice)
-            invoice_date = datetime.strptime(analyzer.get_invoice_date(), "%d.%m.%Y")
-            
-            if invoice_date < current_date:
-                if previous_date is None or invoice_date > previous_date:
-                    previous_date = invoice_date
-                    previous_invoice = invoice
-        
-        if not previous_invoice:
-            return {"found": False}
-        
-        previous_analyzer = IntelligentInvoiceAnalyzer(previous_invoice)
-        
+        current_analyzer = IntelligentInvoiceAnalyzer(current_invoice, current_key)
+        timeline_key = current_key or "current"
+        timeline = self.customer_timeline(current_analyzer, current_key, all_invoices)
+
+        previous_entry = timeline.previous(timeline_key)
+        if previous_entry is not None:
+            previous = previous_entry.summary
+        else:
+            previous_analyzer = self.previous_invoice_analyzer(current_key, all_invoices)
+            if previous_analyzer is None:
+                return {"found": False}
+            previous = previous_analyzer.summary
+        current = current_analyzer.summary
+
         # Compare key metrics
-        current_amount = current_analyzer.get_invoice_amount()
-        previous_amount = previous_analyzer.get_invoice_amount()
-        amount_difference = current_amount - previous_amount
-        
-        current_consumption = current_analyzer.get_total_consumption()[0]
-        previous_consumption = previous_analyzer.get_total_consumption()[0]
-        consumption_difference = current_consumption - previous_consumption
+        amount_difference = current.invoice_amount - previous.invoice_amount
+        consumption_difference = current.total_consumption - previous.total_consumption
         
         # Analyze reasons for differences
         reasons = []
@@ -714,20 +841,30 @@ class AgenticUtilityBillLLM:
             reasons.append("Price increase despite similar or lower consumption - likely due to tariff changes")
         
         # Check bonus differences
-        current_bonus = current_analyzer.get_bonus_amount()
-        previous_bonus = previous_analyzer.get_bonus_amount()
-        if current_bonus != previous_bonus:
-            reasons.append(f"Bonus difference: €{current_bonus - previous_bonus:.2f}")
+        if current.bonus_amount != previous.bonus_amount:
+            reasons.append(f"Bonus difference: €{current.bonus_amount - previous.bonus_amount:.2f}")
         
-        return {
+        comparison = {
             "found": True,
-            "previous_amount": previous_amount,
-            "current_amount": current_amount,
+            "previous_amount": previous.invoice_amount,
+            "current_amount": current.invoice_amount,
             "difference": amount_difference,
             "consumption_difference": consumption_difference,
             "reasons": reasons,
-            "previous_period": previous_analyzer.get_total_consumption()[1] + " to " + previous_analyzer.get_total_consumption()[2]
+            "previous_period": previous.period_from + " to " + previous.period_to,
+            "trend": timeline.trend(timeline_key, int(os.getenv("TIMELINE_TREND_PERIODS", "6")))
         }
+
+        year_before = timeline.year_over_year(timeline_key)
+        if year_before is not None:
+            comparison["year_over_year"] = {
+                "invoice_number": year_before.summary.invoice_number,
+                "invoice_date": year_before.summary.invoice_date,
+                "amount": year_before.summary.invoice_amount,
+                "difference": current.invoice_amount - year_before.summary.invoice_amount,
+                "consumption_difference": current.total_consumption - year_before.summary.total_consumption
+            }
+        return comparison
     
     def build_contextual_prompt(self, query: str, analyzer: IntelligentInvoiceAnalyzer, 
                                query_type: QueryType, response_format: ResponseFormat,
@@ -735,8 +872,8 @@ class AgenticUtilityBillLLM:
         """Build sophisticated, context-aware prompt with CORRECTED data extraction"""
         
         # Customer information
-        partner = analyzer.partner_data
-        raw_salutation = partner.get("salutation", "")
+        partner = analyzer.partner
+        raw_salutation = partner.salutation
         if language == "en":
             if raw_salutation.lower() == "frau":
                 salutation = "Ms."
@@ -746,8 +883,8 @@ class AgenticUtilityBillLLM:
                 salutation = "Dear"
         else:
             salutation = raw_salutation
-        first_name = partner.get("firstName", "")
-        last_name = partner.get("name", "")
+        first_name = partner.first_name
+        last_name = partner.name
         customer_name = f"{first_name} {last_name}".strip()
         
         # CORRECTED data extraction
@@ -761,12 +898,6 @@ class AgenticUtilityBillLLM:
         # Get relevant knowledge base context
         kb_context = self.knowledge_base.find_relevant_context(query, language, max_items=3)
         
-        # Language-specific instructions
-        language_instruction = {
-            "de": "WICHTIG: Antworte IMMER auf Deutsch. Verwende deutsche Begriffe und Formulierungen.",
-            "en": "IMPORTANT: Always respond in English. Use English terms and phrases."
-        }
-        
         # Conciseness instructions
         conciseness_instructions = {
             "brief": {
@@ -783,11 +914,8 @@ class AgenticUtilityBillLLM:
             }
         }
         
-        # Build the corrected system instruction
-        system_instruction = f"""You are KlarBill, an intelligent energy billing assistant.
-
-{language_instruction[language]}
-
+        # Invoice-specific part; the static instructions live in build_prompt_prefix
+        system_instruction = f"""
 CUSTOMER: {salutation} {customer_name}
 INVOICE: #{analyzer.get_invoice_number()}
 PERIOD: {period_from} - {period_to}
@@ -798,7 +926,7 @@ TARIFF RATES:
 - Working Price: {working_price_details['main_price_ct_per_kwh']:.2f} ct/kWh
 - Base Price: €{base_price_net:.2f}/year (net), €{base_price_gross:.2f}/year (gross)
 """
-        
+
         # Add multiple periods only if they exist
         if working_price_details['has_multiple_periods']:
             system_instruction += "\nWORKING PRICE PERIODS:\n"
@@ -822,13 +950,10 @@ COST CATEGORIES (Distribution of costs, NOT tariff rates):
 
 RESPONSE STYLE: {conciseness_instructions[response_format.conciseness_level][language]}
 
-CRITICAL RULES:
-1. ALWAYS use actual invoice data - NEVER use placeholder values
-2. {"Antworte auf DEUTSCH" if language == "de" else "Respond in ENGLISH"}
-3. Working price: {working_price_details['main_price_ct_per_kwh']:.2f} ct/kWh
-4. Base price: €{base_price_net:.2f}/year (annual fee)
-5. Use customer's actual name: {customer_name}
-6. Answer the specific question directly
+KEY FACTS:
+- Working price: {working_price_details['main_price_ct_per_kwh']:.2f} ct/kWh
+- Base price: €{base_price_net:.2f}/year (annual fee)
+- Customer's actual name: {customer_name}
 """
 
         # Add invoice-specific breakdown
@@ -922,6 +1047,13 @@ COMPARISON WITH PREVIOUS INVOICE:
 - Difference: €{comparison_data['difference']:.2f} ({'+' if comparison_data['difference'] > 0 else ''}{(comparison_data['difference'] / comparison_data['previous_amount'] * 100):.1f}%)
 - Main Reason: {comparison_data['reasons'][0] if comparison_data['reasons'] else 'Similar billing period'}
 """
+            trend = comparison_data.get("trend") or {}
+            if trend.get("periods", 0) > 2:
+                amounts = " -> ".join(f"€{bill['amount']:.2f}" for bill in trend["bills"])
+                system_instruction += f"- Last {trend['periods']} bills: {amounts} (average €{trend['average_amount']:.2f})\n"
+            year_before = comparison_data.get("year_over_year")
+            if year_before:
+                system_instruction += f"- Same period last year ({year_before['invoice_date']}): €{year_before['amount']:.2f}, difference €{year_before['difference']:.2f}\n"
 
         # Final query instruction
         query_context = f"\nQUERY: {query}\n"
@@ -932,17 +1064,111 @@ COMPARISON WITH PREVIOUS INVOICE:
         else:
             query_context += "Respond in ENGLISH with correct tariff data and actual amounts!\n"
         
-        return system_instruction + query_context + f"\n{'Antwort' if language == 'de' else 'Response'}:"
+        return self.build_prompt_prefix(language) + system_instruction + query_context + f"\n{'Antwort' if language == 'de' else 'Response'}:"
+
+    def build_prompt_prefix(self, language: str = 'en') -> str:
+        """Invoice-independent start of every prompt; prefix-caching runtimes evaluate it only once"""
+        # The regulation glossary is only worth its tokens when its KV state is reused
+        include_regulations = self.models.supports_prefix_cache
+        key = (language, include_regulations)
+        if key in self._prompt_prefixes:
+            return self._prompt_prefixes[key]
+
+        # Language-specific instructions
+        language_instruction = {
+            "de": "WICHTIG: Antworte IMMER auf Deutsch. Verwende deutsche Begriffe und Formulierungen.",
+            "en": "IMPORTANT: Always respond in English. Use English terms and phrases."
+        }
+
+        prefix = f"""You are KlarBill, an intelligent energy billing assistant.
+
+{language_instruction[language]}
+
+CRITICAL RULES:
+1. ALWAYS use actual invoice data - NEVER use placeholder values
+2. {"Antworte auf DEUTSCH" if language == "de" else "Respond in ENGLISH"}
+3. Working price is the tariff in ct/kWh listed under TARIFF RATES - NOT the cost categories
+4. Base price is the annual fee in €/year listed under TARIFF RATES - NOT per kWh
+5. Address the customer by the name listed under CUSTOMER
+6. SPECIFIC LEVY AMOUNTS are the actual € amounts charged; COST CATEGORIES show how costs are distributed
+7. Answer the specific question directly
+"""
+
+        if include_regulations:
+            prefix += f"\n{'ABRECHNUNGSBESTANDTEILE' if language == 'de' else 'BILLING COMPONENTS'}:\n"
+            for component in self.regulations.ENERGY_COMPONENTS.values():
+                prefix += f"- {component[f'name_{language}']}: {component[f'explanation_{language}']}\n"
+            prefix += "\nREGULATORY CHANGES 2025:\n"
+            for change in self.regulations.RECENT_CHANGES_2025.values():
+                prefix += f"- {change}\n"
+
+        self._prompt_prefixes[key] = prefix
+        return prefix
 
     def get_response(self, query: str, bill_context: Optional[Dict[str, Any]] = None,
                     language: str = 'en', customer_number: Optional[str] = None,
-                    invoice_number: Optional[str] = None) -> Dict[str, Any]:
+                    invoice_number: Optional[str] = None, session_id: Optional[str] = None) -> Dict[str, Any]:
+        prepared = self.prepare_response(query, bill_context, language, customer_number, invoice_number, session_id)
+        if prepared.get("prompt") is None:
+            return prepared
+
+        controller = self.generation_controller(prepared)
+        text = self.model.generate(prepared.pop("prompt"), prefix=prepared.pop("prompt_prefix", None),
+                                   max_tokens=prepared.pop("max_tokens"), temp=0.1,  # Very low temp for consistency
+                                   callback=controller, stop=server_stop_sequences())
+        response = controller.finish(text)
+        self.observe_generation(prepared.pop("generation"), controller)
+        prepared["text"] = response
+        self.remember_response(prepared, response)
+        return prepared
+
+    def generation_controller(self, prepared: Dict[str, Any]) -> GenerationController:
+        """Stops the generation once the answer is complete; appends the footer"""
+        generation = prepared["generation"]
+        return GenerationController(prepared["max_tokens"], MAX_SENTENCES.get(generation["level"]),
+                                    generation["language"])
+
+    def observe_generation(self, generation: Dict[str, str], controller: GenerationController):
+        """Feed the answer length back into the per-query-type token budgets"""
+        self.token_budgets.observe(generation["query_type"], generation["level"], controller.tokens, controller.truncated)
+
+    def remember_response(self, prepared: Dict[str, Any], text: str):
+        """Store a generated answer in the response cache"""
+        cache_key = prepared.pop("cache_key", None)
+        if cache_key:
+            self.response_cache.put(*cache_key, text)
+
+    def stream_response(self, prepared: Dict[str, Any], callback=None):
+        """Yield response tokens for a prompt produced by prepare_response"""
+        controller = self.generation_controller(prepared)
+
+        def keep_going(token_id: int, token: str) -> bool:
+            return not controller.done and (callback is None or callback(token_id, token) is not False)
+
+        tokens = self.model.stream(prepared["prompt"], prefix=prepared.get("prompt_prefix"),
+                                   max_tokens=prepared["max_tokens"], temp=0.1, callback=keep_going,
+                                   stop=server_stop_sequences())
+        completed = False
+        try:
+            yield from controller.stream(tokens)
+            completed = True
+        finally:
+            # Ends the model's stream (and frees its instance) when the answer stopped early
+            tokens.close()
+            if completed:
+                self.observe_generation(prepared["generation"], controller)
+
+    def prepare_response(self, query: str, bill_context: Optional[Dict[str, Any]] = None,
+                         language: str = 'en', customer_number: Optional[str] = None,
+                         invoice_number: Optional[str] = None, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """Do everything except generation: returns the prompt and the structured payload,
+        or a final answer (``prompt`` is None) when no generation is needed"""
         
-        # Update conversation context
-        self.conversation_context['queries'].append(query)
-        self.conversation_context['language'] = language
+        # Update this session's conversation history (requests without a session keep none)
+        history = self.sessions.append_query(session_id, query) if session_id else [query]
         
         # Fetch invoice data if not provided
+        from_store = not bill_context
         if not bill_context:
             is_valid, bill_context = self.validate_number(customer_number, invoice_number)
             if not is_valid:
@@ -959,7 +1185,7 @@ COMPARISON WITH PREVIOUS INVOICE:
         # Handle multiple invoices
         if customer_number and not invoice_number and len(bill_context) > 1:
             invoice_suggestions = [
-                v["Data"]["ProzessDaten"]["ProzessDatenElement"]["invoiceNumber"]
+                process_element(v).get("invoiceNumber")
                 for v in bill_context.values()
             ]
             msg = {
@@ -974,7 +1200,9 @@ COMPARISON WITH PREVIOUS INVOICE:
             }
 
         # Get the invoice data
-        invoice = next(iter(bill_context.values()), {}).get("Data", {})
+        invoice_key = next(iter(bill_context), None)
+        entry = next(iter(bill_context.values()), {})
+        invoice = entry.get("Data", {})
         if not invoice:
             error_msg = {
                 "de": "Ich konnte nicht auf Ihre Rechnungsdetails zugreifen. Bitte versuchen Sie es erneut.",
@@ -987,8 +1215,9 @@ COMPARISON WITH PREVIOUS INVOICE:
             }
 
         # Initialize analyzers
-        analyzer = IntelligentInvoiceAnalyzer(invoice)
-        query_analyzer = ContextualQueryAnalyzer(self.conversation_context['queries'])
+        # The hash recorded at ingestion saves hashing the invoice; a client-sent context is hashed
+        analyzer = IntelligentInvoiceAnalyzer(invoice, invoice_key, stored_content_hash(entry) if from_store else None)
+        query_analyzer = ContextualQueryAnalyzer(history)
         
         # Analyze query and determine response strategy
         query_type, response_format = query_analyzer.analyze_query(query)
@@ -996,48 +1225,12 @@ COMPARISON WITH PREVIOUS INVOICE:
         # Check if this is a comparison query
         comparison_data = None
         if query_type == QueryType.COMPARISON:
-            # Get all invoices for comparison
-            all_invoices = bill_context
-            if customer_number and not invoice_number:
-                # Fetch all invoices for the customer
-                _, all_invoices = fetch_invoice_data(customer_number=customer_number)
-            
-            comparison_data = self.compare_with_previous_invoice(invoice, all_invoices)
-        
-        # Build contextual prompt with proper language support
-        prompt = self.build_contextual_prompt(query, analyzer, query_type, response_format, language, comparison_data)
-        
-        # Generate response with appropriate parameters
-        max_tokens = 300 if response_format.conciseness_level == "brief" else 600 if response_format.conciseness_level == "moderate" else 1200
-        response = self.model.generate(prompt, max_tokens=max_tokens, temp=0.1).strip()  # Very low temp for consistency
-        
-        # Prepare structured data with correct information
-        total_consumption, period_from, period_to = analyzer.get_total_consumption()
-        cost_breakdown = analyzer.get_detailed_cost_breakdown()
-        working_price_details = analyzer.get_working_price_details()
-        base_price_net, base_price_gross = analyzer.get_base_price()
-        specific_levies = analyzer.get_specific_levy_amounts()
+            # The customer's other invoices come from the cached timeline
+            comparison_data = self.compare_with_previous_invoice(invoice, bill_context, invoice_key)
         
+        # Invoice-level data (also served by GET /invoice/{number}) plus what depends on this question
         structured_data = {
-            "customer_name": analyzer.partner_data.get("firstName", "") + " " + analyzer.partner_data.get("name", ""),
-            "salutation": analyzer.partner_data.get("salutation", ""),
-            "consumption": total_consumption,
-            "consumption_period": f"{period_from} to {period_to}",
-            "invoice_amount": analyzer.get_invoice_amount(),
-            "net_amount": analyzer.get_net_amount(), 
-            "tax_amount": analyzer.get_tax_amount(),
-            "bonus": analyzer.get_bonus_amount(),
-            "invoice_number": analyzer.get_invoice_number(),
-            "cost_breakdown": cost_breakdown,
-            "tariff_info": {
-                "working_price_ct_per_kwh": working_price_details['main_price_ct_per_kwh'],
-                "working_price_periods": working_price_details['billed_periods'] if working_price_details['has_multiple_periods'] else None,
-                "base_price_net_per_year": base_price_net,
-                "base_price_gross_per_year": base_price_gross
-            },
-            "specific_levies": specific_levies,
-            "is_zero_consumption": analyzer.is_zero_consumption_bill(),
-            "unusual_charges": analyzer.analyze_unusual_charges(),
+            **analyzer.invoice_details(),
             "query_type": query_type.value,
             "response_format": {
                 "concise": response_format.concise,
@@ -1053,8 +1246,45 @@ COMPARISON WITH PREVIOUS INVOICE:
         if comparison_data:
             structured_data["comparison"] = comparison_data
         
+        # Simple facts and greetings are fully determined by the invoice data
+        fast_answer = self.fast_path.respond(query, query_type, analyzer, language)
+        if fast_answer is not None:
+            structured_data["response_source"] = "template"
+            return {
+                "text": fast_answer,
+                "structured": structured_data,
+                "needs_invoice_number": False
+            }
+
+        # Reuse an earlier answer to the same (or a near-identical) question on this invoice.
+        # Comparisons depend on other invoices, so they are always generated.
+        cache_key = None
+        if query_type != QueryType.COMPARISON:
+            cache_key = (analyzer.get_invoice_number(), analyzer.content_hash,
+                         language, query, query_type.value)
+            cached = self.response_cache.get(*cache_key)
+            if cached is not None:
+                structured_data["response_source"] = "cache"
+                return {
+                    "text": cached,
+                    "structured": structured_data,
+                    "needs_invoice_number": False
+                }
+        structured_data["response_source"] = "model"
+
+        # Build contextual prompt with proper language support
+        prompt = self.build_contextual_prompt(query, analyzer, query_type, response_format, language, comparison_data)
+        
+        # Generation parameters: 300/600/1200 tokens by conciseness, lowered to what this kind of answer needs
+        max_tokens = self.token_budgets.budget(query_type.value, response_format.conciseness_level)
+        
         return {
-            "text": response,
+            "text": None,
+            "prompt": prompt,
+            "prompt_prefix": self.build_prompt_prefix(language),
+            "max_tokens": max_tokens,
+            "generation": {"query_type": query_type.value, "level": response_format.conciseness_level, "language": language},
+            "cache_key": cache_key,
             "structured": structured_data,
             "needs_invoice_number": False
         }
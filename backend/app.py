@@ -1,23 +1,97 @@
 # app.py
-from fastapi import FastAPI, HTTPException
+import time
+
+BOOT_STARTED = time.perf_counter()
+
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from agentic_llm_service import AgenticUtilityBillLLM  # Updated import
+from inference_pool import InferencePool, InferenceSaturatedError, InferenceTimeoutError
 from data.upload_invoices import upload_invoices_once
 import uvicorn
 import requests
 from fastapi.middleware.cors import CORSMiddleware
-import time
-import re
-from data.firebase_service import get_invoice_by_number, get_invoices_by_customer, get_db_reference
+import asyncio
+import orjson
+from data.firebase_service import get_invoice_by_number, get_invoices_by_customer, get_db_reference, get_invoice_index, firebase_client, \
+    get_invoice_store, invoice_store_backend
+from invoice_analysis import (IntelligentInvoiceAnalyzer, SUMMARY_SCHEMA_VERSION, invoice_content_hash,
+                              stored_content_hash, summary_cache)
+from invoice_models import BusinessPartner, partner_element, process_element
+from startup import StartupPhases, LockFile
+from message_log import MessageLogger, message_log_path
 
 # Ensure .env config and environment variables are loaded at startup
 from config import ensure_config
 
-ensure_config()
-upload_invoices_once()
-
-app = FastAPI(title="KlarBill Agentic AI API", version="2.0.0")
+# Boot only does cheap work; the model, indexes and invoice ingestion warm up in the background.
+# LLM_LOADING: warmup (load the model right after boot, default), lazy (on the first chat request) or
+# preload (at import, so a `gunicorn --preload` master shares the loaded weights with forked workers)
+MODEL_LOADING = os.getenv("LLM_LOADING", "warmup")
+startup = StartupPhases(required=("knowledge_base", "model", "invoice_index"), started=BOOT_STARTED)
+
+with startup.phase("config"):
+    ensure_config()
+
+# Set once the knowledge base is loaded; the model follows in the same warmup thread
+llm: Optional[AgenticUtilityBillLLM] = None
+
+def warm_up_llm():
+    global llm
+    with startup.phase("knowledge_base"):
+        instance = AgenticUtilityBillLLM(load_model=False)
+    llm = instance
+    if MODEL_LOADING == "lazy":
+        startup.skip("model", "loaded on first use")
+        return
+    with startup.phase("model"):
+        instance.load_model()
+
+if MODEL_LOADING == "preload":
+    warm_up_llm()
+
+def warm_up_invoice_index():
+    if invoice_store_backend() == "sqlite":
+        startup.skip("invoice_index", "INVOICE_STORE is sqlite")
+        return
+    if os.getenv("INVOICE_LOOKUP_MODE", "index") != "index":
+        startup.skip("invoice_index", "INVOICE_LOOKUP_MODE is not index")
+        return
+    with startup.phase("invoice_index"):
+        get_invoice_index()
+
+def ingest_bundled_invoices():
+    if os.getenv("STARTUP_INGESTION", "true").lower() != "true":
+        startup.skip("ingestion", "STARTUP_INGESTION is disabled")
+        return
+    default_lock = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", ".ingest.lock")
+    # With several uvicorn workers only the one holding the lock ingests
+    with LockFile(os.getenv("STARTUP_LOCK_PATH", default_lock)) as acquired:
+        if not acquired:
+            startup.skip("ingestion", "another worker holds the ingestion lock")
+            return
+        with startup.phase("ingestion"):
+            upload_invoices_once()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if llm is None:
+        startup.run_in_background("llm", warm_up_llm)
+    startup.run_in_background("invoice_index", warm_up_invoice_index)
+    startup.run_in_background("ingestion", ingest_bundled_invoices)
+    message_logger.start()
+    startup.mark_booted()
+    yield
+    # Write out the queued chat logs before the process exits
+    await asyncio.to_thread(message_logger.close)
+    if llm is not None:
+        llm.token_budgets.close()
+
+app = FastAPI(title="KlarBill Agentic AI API", version="2.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,8 +101,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize the Agentic AI LLM
-llm = AgenticUtilityBillLLM()
+# Blocking model calls run here so they never stall the event loop
+inference_pool = InferencePool()
+
+# Chat logs are queued and written to the database in batches, off the request path
+message_logger = MessageLogger(lambda updates: get_db_reference("/").update(updates))
+
+def require_llm(model: bool = False) -> AgenticUtilityBillLLM:
+    """The warmed-up assistant, or 503 while startup is still loading it"""
+    if llm is None or (model and startup.status("model") not in ("done", "skipped")):
+        raise HTTPException(status_code=503, detail="KlarBill is starting up. Please try again in a moment.",
+                            headers={"Retry-After": "5"})
+    return llm
 
 class QueryRequest(BaseModel):
     message: str
@@ -36,6 +120,11 @@ class QueryRequest(BaseModel):
     language: str = 'en'
     customer_number: Optional[str] = None
     invoice_number: Optional[str] = None
+    session_id: Optional[str] = None
+    # slim: leave out the structured invoice data (fetch it once from GET /invoice/{number});
+    # fields: return only these keys, e.g. ["response", "structured.comparison"]
+    slim: bool = False
+    fields: Optional[List[str]] = None
 
 class LogMessageRequest(BaseModel):
     customer_number: Optional[str] = None
@@ -46,6 +135,9 @@ class LogMessageRequest(BaseModel):
     topic: Optional[str] = None
     session_id: Optional[str] = None
 
+class LogMessagesRequest(BaseModel):
+    messages: List[LogMessageRequest]
+
 class ValidateIdentifierRequest(BaseModel):
     identifier: str
     language: str = 'en'
@@ -53,9 +145,10 @@ class ValidateIdentifierRequest(BaseModel):
 @app.post("/validate_identifier")
 async def validate_identifier(request: ValidateIdentifierRequest):
     """Validate identifier and return customer/invoice information"""
+    require_llm()
     try:
-        # Use the LLM's validate_identifier method
-        is_valid, id_type, data = llm.validate_identifier(request.identifier)
+        # Use the LLM's validate_identifier method; lookups may block while the invoice index builds
+        is_valid, id_type, data = await asyncio.to_thread(llm.validate_identifier, request.identifier)
         
         if not is_valid:
             return {
@@ -66,29 +159,20 @@ async def validate_identifier(request: ValidateIdentifierRequest):
         
         # Get customer information
         if data:
-            first_invoice = next(iter(data.values()))
-            invoice_data = first_invoice.get("Data", {})
-            process_data = invoice_data.get("ProzessDaten", {}).get("ProzessDatenElement", {})
-            partner_data = process_data.get("Geschaeftspartner", {}).get("GeschaeftspartnerElement", {})
-            
-            # Get date of birth
-            date_of_birth = partner_data.get("dateOfBirth", "")
+            partner = BusinessPartner.from_dict(partner_element(next(iter(data.values()))))
             
             # Get all invoice numbers if multiple
             invoice_numbers = []
             if id_type == "customer" and len(data) > 1:
-                invoice_numbers = [
-                    v["Data"]["ProzessDaten"]["ProzessDatenElement"]["invoiceNumber"]
-                    for v in data.values()
-                ]
+                invoice_numbers = [process_element(v).get("invoiceNumber") for v in data.values()]
             
             return {
                 "valid": True,
                 "type": id_type,
-                "customer_number": partner_data.get("customerNumber", ""),
-                "customer_name": f"{partner_data.get('firstName', '')} {partner_data.get('name', '')}".strip(),
-                "salutation": partner_data.get("salutation", ""),
-                "date_of_birth": date_of_birth,  # Add DOB to response
+                "customer_number": partner.customer_number,
+                "customer_name": partner.full_name,
+                "salutation": partner.salutation,
+                "date_of_birth": partner.date_of_birth,  # Add DOB to response
                 "multiple_invoices": len(invoice_numbers) > 0,
                 "invoice_numbers": invoice_numbers,
                 "language": request.language
@@ -108,53 +192,107 @@ async def validate_identifier(request: ValidateIdentifierRequest):
             "message": "Error validating identifier"
         }
 
+def build_chat_response(result: Dict[str, Any], request: QueryRequest) -> Dict[str, Any]:
+    """Shape an LLM result into the /chat payload the frontend expects"""
+    # Build comprehensive response
+    response = {
+        "response": result["text"],
+        "structured": result.get("structured", {}),
+        "needs_invoice_number": result.get("needs_invoice_number", False),
+        "invoice_suggestions": result.get("invoice_suggestions", []),
+        "query_type": result.get("structured", {}).get("query_type", "unknown"),
+        "response_format": result.get("structured", {}).get("response_format", {})
+    }
+
+    # Extract key information for frontend
+    structured = result.get("structured", {})
+
+    # Customer identification
+    if structured.get("customer_name"):
+        response["customer_name"] = structured["customer_name"]
+    if structured.get("salutation"):
+        response["customer_greeting"] = structured["salutation"]
+    
+    # Invoice details
+    if structured.get("invoice_number"):
+        response["invoice_number"] = structured["invoice_number"]
+    if structured.get("consumption"):
+        response["consumption"] = structured["consumption"]
+    if structured.get("invoice_amount"):
+        response["invoice_amount"] = structured["invoice_amount"]
+        
+    # Set customer/invoice number for session persistence
+    if request.customer_number:
+        response["session_customer_number"] = request.customer_number
+    if request.invoice_number or structured.get("invoice_number"):
+        response["session_invoice_number"] = request.invoice_number or structured.get("invoice_number")
+    if structured.get("invoice_number"):
+        response["invoice_url"] = f"/invoice/{structured['invoice_number']}"
+
+    return select_fields(response, request)
+
+# Per-turn keys that repeat the invoice-level data or matter only for debugging
+SLIM_OMITTED = ("structured", "response_format")
+
+def select_fields(response: Dict[str, Any], request: QueryRequest) -> Dict[str, Any]:
+    """Trim a /chat payload to the ``fields`` the client asked for, or to the slim form"""
+    if request.fields:
+        selected = {}
+        for field in request.fields:
+            name, _, key = field.partition(".")
+            value = response.get(name)
+            if not key:
+                if name in response:
+                    selected[name] = value
+            elif isinstance(value, dict) and key in value:
+                selected.setdefault(name, {})[key] = value[key]
+        return selected
+    if request.slim:
+        return {name: value for name, value in response.items() if name not in SLIM_OMITTED}
+    return response
+
+class FastJSONResponse(JSONResponse):
+    """JSON rendered by orjson. Returned directly, so FastAPI skips its generic jsonable_encoder pass"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+def backpressure_response(e: Exception) -> JSONResponse:
+    """503 when the inference queue is full, 504 when a generation timed out"""
+    print(f"Chat backpressure: {e}")
+    overloaded = isinstance(e, InferenceSaturatedError)
+    return JSONResponse(
+        status_code=503 if overloaded else 504,
+        headers={"Retry-After": "5"} if overloaded else None,
+        content={
+            "response": "KlarBill is handling many requests right now. Please try again in a moment."
+                        if overloaded else "The response took too long. Please try again.",
+            "structured": {},
+            "error": True,
+            "error_type": "overloaded" if overloaded else "timeout"
+        }
+    )
+
 @app.post("/chat")
 async def chat_route(request: QueryRequest):
     """Enhanced chat endpoint with Agentic AI capabilities"""
+    require_llm(model=True)
     try:
         # Handle the request with the Agentic AI
-        result = llm.get_response(
+        result = await inference_pool.run(
+            llm.get_response,
             query=request.message,
             bill_context=request.context,
             language=request.language,
             customer_number=request.customer_number,
-            invoice_number=request.invoice_number
+            invoice_number=request.invoice_number,
+            session_id=request.session_id
         )
 
-        # Build comprehensive response
-        response = {
-            "response": result["text"],
-            "structured": result.get("structured", {}),
-            "needs_invoice_number": result.get("needs_invoice_number", False),
-            "invoice_suggestions": result.get("invoice_suggestions", []),
-            "query_type": result.get("structured", {}).get("query_type", "unknown"),
-            "response_format": result.get("structured", {}).get("response_format", {})
-        }
-
-        # Extract key information for frontend
-        structured = result.get("structured", {})
-
-        # Customer identification
-        if structured.get("customer_name"):
-            response["customer_name"] = structured["customer_name"]
-        if structured.get("salutation"):
-            response["customer_greeting"] = structured["salutation"]
-        
-        # Invoice details
-        if structured.get("invoice_number"):
-            response["invoice_number"] = structured["invoice_number"]
-        if structured.get("consumption"):
-            response["consumption"] = structured["consumption"]
-        if structured.get("invoice_amount"):
-            response["invoice_amount"] = structured["invoice_amount"]
-            
-        # Set customer/invoice number for session persistence
-        if request.customer_number:
-            response["session_customer_number"] = request.customer_number
-        if request.invoice_number or structured.get("invoice_number"):
-            response["session_invoice_number"] = request.invoice_number or structured.get("invoice_number")
+        return FastJSONResponse(build_chat_response(result, request))
 
-        return response
+    except (InferenceSaturatedError, InferenceTimeoutError) as e:
+        return backpressure_response(e)
 
     except Exception as e:
          # Enhanced error handling with detailed logging
@@ -179,35 +317,140 @@ async def chat_route(request: QueryRequest):
         }
 
 
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_route(request: QueryRequest):
+    """Stream the answer as Server-Sent Events: one ``structured`` event with the
+    deterministic invoice data, then ``token`` events, then ``done``"""
+    require_llm(model=True)
+    try:
+        prepared = await asyncio.to_thread(
+            llm.prepare_response,
+            query=request.message,
+            bill_context=request.context,
+            language=request.language,
+            customer_number=request.customer_number,
+            invoice_number=request.invoice_number,
+            session_id=request.session_id
+        )
+        tokens = inference_pool.stream(llm.stream_response, prepared) if prepared.get("prompt") is not None else None
+    except (InferenceSaturatedError, InferenceTimeoutError) as e:
+        return backpressure_response(e)
+    except Exception as e:
+        print(f"Chat stream error: {type(e).__name__}: {str(e)}")
+        return {
+            "response": "I encountered an issue processing your request. Please try again.",
+            "structured": {},
+            "error": True,
+            "error_type": "processing_error"
+        }
+
+    async def events():
+        header = build_chat_response({**prepared, "text": prepared.get("text") or ""}, request)
+        yield sse_event("structured", header)
+
+        if tokens is None:
+            yield sse_event("token", {"text": prepared["text"]})
+            yield sse_event("done", {"response": prepared["text"]})
+            return
+
+        parts = []
+        try:
+            async for token in tokens:
+                parts.append(token)
+                yield sse_event("token", {"text": token})
+        except Exception as e:
+            print(f"Chat stream error: {type(e).__name__}: {str(e)}")
+            yield sse_event("error", {"error_type": "timeout" if isinstance(e, InferenceTimeoutError) else "processing_error"})
+        else:
+            llm.remember_response(prepared, "".join(parts).strip())
+        yield sse_event("done", {"response": "".join(parts).strip()})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    tags = [tag.strip() for tag in (if_none_match or "").split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+@app.get("/invoice/{invoice_number}")
+async def invoice_details(invoice_number: str, request: Request):
+    """Invoice-level structured data, fetched once per session instead of with every chat turn.
+
+    The ETag is the invoice's content hash, so a client revalidating with
+    If-None-Match gets a bodyless 304 until the invoice changes. The hash
+    recorded at ingestion is used when there is one, so a 304 skips the
+    analysis altogether.
+    """
+    entries = await asyncio.to_thread(get_invoice_by_number, invoice_number)
+    if not entries:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    key, entry = next(iter(entries.items()))
+    invoice_data = (entry or {}).get("Data", {})
+    content_hash = stored_content_hash(entry) or summary_cache.known_hash(invoice_data, key)
+    if content_hash is None:
+        content_hash = await asyncio.to_thread(invoice_content_hash, invoice_data)
+    etag = f'"{SUMMARY_SCHEMA_VERSION}-{content_hash}"'
+    # Browsers keep the response but revalidate it on every use
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    analyzer = await asyncio.to_thread(IntelligentInvoiceAnalyzer, invoice_data, key, content_hash)
+    return FastJSONResponse(analyzer.invoice_details(), headers=headers)
+
+def log_entry(request: LogMessageRequest) -> Dict[str, Any]:
+    return {
+        'customer_number': request.customer_number,
+        'invoice_number': request.invoice_number,
+        'message': request.message,
+        'role': request.role,
+        'timestamp': request.timestamp,
+        'topic': request.topic or 'general',
+        'session_id': request.session_id
+    }
+
 @app.post("/log_message")
 async def log_message(request: LogMessageRequest):
     """Log messages directly under invoice or customer path"""
     try:
-        if request.customer_number:
-            path = f"messages/customers/{re.sub(r'[^a-zA-Z0-9_-]', '_', request.customer_number)}"
-        elif request.invoice_number:
-            path = f"messages/invoices/{re.sub(r'[^a-zA-Z0-9_-]', '_', request.invoice_number)}"
-        else:
+        path = message_log_path(request.customer_number, request.invoice_number)
+        if path is None:
             return {"status": "error", "logged": False, "message": "Missing invoice_number or customer_number."}
 
-        log_data = {
-            'customer_number': request.customer_number,
-            'invoice_number': request.invoice_number,
-            'message': request.message,
-            'role': request.role,
-            'timestamp': request.timestamp,
-            'topic': request.topic or 'general',
-            'session_id': request.session_id
-        }
-
-        ref = get_db_reference(path)
-        ref.push(log_data)
+        # Queued only; the database write happens in the background
+        message_logger.log(path, log_entry(request))
         return {"status": "success", "logged": True}
 
     except Exception as e:
         print(f"Logging error: {e}")
         return {"status": "partial_success", "logged": False, "message": "Message processed but logging failed"}
 
+@app.post("/log_messages")
+async def log_messages(request: LogMessagesRequest):
+    """Log several messages at once, e.g. the question and the answer of a chat turn"""
+    try:
+        entries = []
+        for message in request.messages:
+            path = message_log_path(message.customer_number, message.invoice_number)
+            if path is not None:
+                entries.append((path, log_entry(message)))
+        message_logger.log_many(entries)
+        rejected = len(request.messages) - len(entries)
+        return {
+            "status": "success" if not rejected else "partial_success",
+            "logged": len(entries),
+            "rejected": rejected
+        }
+
+    except Exception as e:
+        print(f"Logging error: {e}")
+        return {"status": "partial_success", "logged": 0, "message": "Messages processed but logging failed"}
+
 class NameRequest(BaseModel):
     customer_number: Optional[str] = None
     invoice_number: Optional[str] = None
@@ -222,13 +465,13 @@ async def customer_name(request: NameRequest):
 
         # 1. Try invoice_number first
         if request.invoice_number:
-            invoice_entry = get_invoice_by_number(request.invoice_number)
+            invoice_entry = await asyncio.to_thread(get_invoice_by_number, request.invoice_number)
             if invoice_entry:
                 invoice = list(invoice_entry.values())[0]
                 match_type = "invoice"
         # 2. If not found, try customer_number
         if not invoice and request.customer_number:
-            invoice_entries = get_invoices_by_customer(request.customer_number)
+            invoice_entries = await asyncio.to_thread(get_invoices_by_customer, request.customer_number)
             if invoice_entries:
                 invoice = list(invoice_entries.values())[0]
                 match_type = "customer"
@@ -236,18 +479,9 @@ async def customer_name(request: NameRequest):
         if not invoice:
             return {"customer_greeting": "", "type": ""}
 
-        data = invoice.get("Data", {})
-        pro_daten = data.get("ProzessDaten", {})
-        prozess_element = pro_daten.get("ProzessDatenElement", {})
-
-        if isinstance(prozess_element, list):
-            process_data = prozess_element[0] if prozess_element else {}
-        else:
-            process_data = prozess_element
-
-        business_partner = process_data.get("Geschaeftspartner", {}).get("GeschaeftspartnerElement", {})
-        name = business_partner.get("name", "")
-        salutation = business_partner.get("salutation", "")
+        business_partner = BusinessPartner.from_dict(partner_element(invoice))
+        name = business_partner.name
+        salutation = business_partner.salutation
 
         if not name:
             return {"customer_greeting": "", "type": ""}
@@ -274,14 +508,17 @@ async def health_check():
     """Enhanced health check with system information"""
     try:
         # Test LLM availability
-        llm_status = "healthy" if llm.model else "unavailable"
+        if llm is not None and llm.models.loaded:
+            llm_status = "healthy"
+        else:
+            llm_status = "not_loaded" if MODEL_LOADING == "lazy" else "loading"
         
         # Test Firebase connectivity
         firebase_status = "unknown"
         try:
             try:
                 test_ref = get_db_reference("/health_test_check")
-                _ = test_ref.get()
+                _ = await asyncio.to_thread(test_ref.get)
                 firebase_status = "healthy"
             except:
                 firebase_status = "unavailable"
@@ -292,6 +529,16 @@ async def health_check():
             "status": "healthy",
             "llm_status": llm_status,
             "firebase_status": firebase_status,
+            "startup": startup.report(),
+            "model": llm.models.stats() if llm else None,
+            "inference": inference_pool.stats(),
+            "response_cache": llm.response_cache.stats() if llm else None,
+            "sessions": llm.sessions.stats() if llm else None,
+            "timelines": llm.timelines.stats() if llm else None,
+            "token_budgets": llm.token_budgets.stats() if llm else None,
+            "message_log": message_logger.stats(),
+            "firebase": firebase_client.stats(),
+            "invoice_store": await asyncio.to_thread(get_invoice_store().stats),
             "version": "2.0.0",
             "features": [
                 "agentic_ai",
@@ -308,6 +555,12 @@ async def health_check():
             "version": "2.0.0"
         }
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 once the model and indexes are warmed up, 503 before (liveness is /health)"""
+    report = startup.report()
+    return JSONResponse(status_code=200 if report["ready"] else 503, content=report)
+
 @app.get("/")
 async def root():
     """API information endpoint"""
@@ -317,8 +570,10 @@ async def root():
         "description": "Intelligent utility bill assistant with contextual understanding",
         "endpoints": {
             "chat": "/chat",
+            "chat_stream": "/chat/stream",
             "log": "/log_message", 
             "health": "/health",
+            "ready": "/ready",
             "validate_identifier": "/validate_identifier"
         }
     }
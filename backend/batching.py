@@ -0,0 +1,150 @@
+# batching.py
+
+import bisect
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence
+
+from generation_control import budget_level
+
+class Histogram:
+    """Fixed-bucket histogram: counts of observations up to each upper bound, plus count and sum"""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.count += 1
+            self.total += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            labels = [f"<={bound:g}" for bound in self.bounds] + [f">{self.bounds[-1]:g}"]
+            return {
+                "count": self.count,
+                "mean": round(self.total / self.count, 3) if self.count else 0.0,
+                "buckets": dict(zip(labels, self.counts))
+            }
+
+class _Request:
+    __slots__ = ("prompt", "max_tokens", "submitted", "future")
+
+    def __init__(self, prompt: str, max_tokens: int):
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.submitted = time.perf_counter()
+        self.future = Future()
+
+class MicroBatcher:
+    """Collects concurrent generations and submits them as one batched request.
+
+    Wraps a backend with ``generate_batch(prompts, max_tokens, temp, stop)``
+    and exposes the usual ``generate``. Requests are grouped by (conciseness
+    level, temperature, stop strings), the level being the brief/moderate/
+    detailed limit their learned token budget falls under, so a batch never
+    waits for a longer class of answer than its own; it is sent with the
+    largest budget among its requests. At most
+    ``concurrency`` batches are in flight. While none is, a request is sent at
+    once; otherwise requests queue until a slot frees up and then wait up to
+    ``max_wait_ms`` for companions or until ``max_batch_size`` is reached.
+    Streaming requests bypass the batcher.
+    """
+
+    def __init__(self, backend, max_batch_size: int = None, max_wait_ms: float = None, concurrency: int = None):
+        self.backend = backend
+        self.supports_prefix_cache = getattr(backend, "supports_prefix_cache", False)
+        self.supports_stop_sequences = getattr(backend, "supports_stop_sequences", False)
+        self.max_batch_size = max_batch_size or int(os.getenv("INFERENCE_BATCH_MAX_SIZE", "8"))
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else float(os.getenv("INFERENCE_BATCH_WAIT_MS", "10"))) / 1000
+        self.concurrency = concurrency or int(os.getenv("INFERENCE_BATCH_CONCURRENCY", "2"))
+        self._pending: "OrderedDict[tuple, List[_Request]]" = OrderedDict()
+        self._cond = threading.Condition()
+        self._running = 0
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch")
+        self.queue_depth = Histogram((0, 1, 2, 4, 8, 16, 32, 64))
+        self.batch_size = Histogram((1, 2, 4, 8, 16, 32))
+        self.wait_ms = Histogram((1, 2, 5, 10, 20, 50, 100, 250))
+        threading.Thread(target=self._dispatch, name="batch-dispatcher", daemon=True).start()
+
+    def generate(self, prompt: str, max_tokens: int = 200, temp: float = 0.7, streaming: bool = False,
+                 callback: Optional[Callable[[int, str], bool]] = None, prefix: str = None,
+                 stop: Optional[List[str]] = None):
+        if streaming:
+            return self.backend.generate(prompt, max_tokens=max_tokens, temp=temp, streaming=True, callback=callback,
+                                         stop=stop)
+
+        request = _Request(prompt, max_tokens)
+        with self._cond:
+            self.queue_depth.observe(sum(len(requests) for requests in self._pending.values()))
+            self._pending.setdefault((budget_level(max_tokens), temp, tuple(stop or ())), []).append(request)
+            self._cond.notify_all()
+        return request.future.result()
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                # A batch is only cut once it can be sent, so requests keep joining while all slots are busy
+                while not self._pending or self._running >= self.concurrency:
+                    self._cond.wait()
+                # Serve the bucket whose oldest request has waited longest
+                bucket, requests = min(self._pending.items(), key=lambda item: item[1][0].submitted)
+                if self._running:
+                    deadline = requests[0].submitted + self.max_wait
+                    while len(requests) < self.max_batch_size:
+                        remaining = deadline - time.perf_counter()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                batch, rest = requests[:self.max_batch_size], requests[self.max_batch_size:]
+                if rest:
+                    self._pending[bucket] = rest
+                else:
+                    del self._pending[bucket]
+                self._running += 1
+            self._executor.submit(self._execute, bucket, batch)
+
+    def _execute(self, bucket: tuple, batch: List[_Request]):
+        started = time.perf_counter()
+        self.batch_size.observe(len(batch))
+        for request in batch:
+            self.wait_ms.observe((started - request.submitted) * 1000)
+        try:
+            _, temp, stop = bucket
+            texts = self.backend.generate_batch([request.prompt for request in batch],
+                                                max_tokens=max(request.max_tokens for request in batch), temp=temp,
+                                                stop=list(stop) or None)
+            for request, text in zip(batch, texts):
+                request.future.set_result(text)
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        stats = self.backend.stats() if hasattr(self.backend, "stats") else {}
+        with self._cond:
+            pending = sum(len(requests) for requests in self._pending.values())
+            running = self._running
+        stats["batching"] = {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "concurrency": self.concurrency,
+            "pending": pending,
+            "running_batches": running,
+            "queue_depth": self.queue_depth.snapshot(),
+            "batch_size": self.batch_size.snapshot(),
+            "wait_ms": self.wait_ms.snapshot()
+        }
+        return stats
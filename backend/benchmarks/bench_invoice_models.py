@@ -0,0 +1,71 @@
+# bench_invoice_models.py
+"""Compare decoding invoices into json.loads dicts with the typed models of
+invoice_models: decode time and memory retained per invoice.
+
+Run from backend/:  python benchmarks/bench_invoice_models.py [invoice JSON files]
+"""
+
+import glob
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from invoice_analysis import summarize_invoice
+from invoice_models import Invoice, decode_invoice, loads
+
+ROUNDS = 200
+
+def decode_time_us(decode, raws) -> float:
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        for raw in raws:
+            decode(raw)
+    return (time.perf_counter() - started) / (ROUNDS * len(raws)) * 1e6
+
+def retained_bytes(decode, raws) -> float:
+    """Memory still allocated after decoding every invoice ROUNDS times and keeping the results"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [decode(raw) for _ in range(ROUNDS) for raw in raws]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del kept
+    return size / (ROUNDS * len(raws))
+
+def main(paths):
+    paths = paths or sorted(glob.glob(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                   "data", "invoice*.json")))
+    raws = []
+    for path in paths:
+        with open(path, "rb") as f:
+            raws.append(f.read())
+    print(f"{len(raws)} invoices, {sum(map(len, raws)) / len(raws) / 1024:.1f} KB of JSON each on average")
+    print(f"decoder: {'orjson' if loads is not json.loads else 'json (pip install orjson for the fast decoder)'}\n")
+
+    candidates = [
+        ("json.loads dict", json.loads),
+        ("loads dict", loads),
+        ("typed Invoice", decode_invoice),
+    ]
+    print(f"{'':<18}{'decode µs':>12}{'retained KB':>14}")
+    for label, decode in candidates:
+        print(f"{label:<18}{decode_time_us(decode, raws):>12.1f}{retained_bytes(decode, raws) / 1024:>14.1f}")
+
+    # Summaries from the decoded model must match those from the raw dicts
+    for raw in raws:
+        assert summarize_invoice(decode_invoice(raw)) == summarize_invoice(json.loads(raw)["Data"])
+    invoices = [Invoice.from_entry(json.loads(raw)) for raw in raws]
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        for invoice in invoices:
+            summarize_invoice(invoice)
+    print(f"\nsummarize_invoice from a decoded model: "
+          f"{(time.perf_counter() - started) / (ROUNDS * len(invoices)) * 1e6:.1f} µs")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,86 @@
+# bench_prompt_prefix.py
+"""Measure prompt-eval time with and without the cached static prompt prefix
+(LLM_RUNTIME=llama_cpp). Each prompt is evaluated with max_tokens=1, so the
+timings are dominated by prompt evaluation.
+
+Needs llama-cpp-python and the GGUF model in backend/models/.
+Run from backend/:  python benchmarks/bench_prompt_prefix.py
+"""
+
+import glob
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["LLM_RUNTIME"] = "llama_cpp"
+os.environ["LLM_INSTANCES"] = "1"
+# Every query must reach the model
+os.environ["FAST_PATH_ENABLED"] = "false"
+os.environ["RESPONSE_CACHE_ENABLED"] = "false"
+
+from agentic_llm_service import AgenticUtilityBillLLM
+
+QUERIES = [
+    ("en", "Can you explain my electricity charges?"),
+    ("en", "What is the Konzessionsabgabe and why do I pay it?"),
+    ("de", "Erkläre mir die Netznutzung bitte genauer"),
+    ("de", "Was bedeutet der Grundpreis auf meiner Rechnung?"),
+]
+
+def load_invoices():
+    data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+    invoices = []
+    for path in sorted(glob.glob(os.path.join(data_dir, "invoice*.json"))):
+        with open(path, encoding="utf-8") as f:
+            invoices.append(json.load(f))
+    return invoices
+
+def build_prompts(llm):
+    prompts = []
+    for invoice in load_invoices():
+        for language, query in QUERIES:
+            prepared = llm.prepare_response(query, bill_context={"bench": invoice}, language=language)
+            if prepared.get("prompt") is not None:
+                prompts.append((prepared["prompt_prefix"], prepared["prompt"]))
+    return prompts
+
+def main():
+    llm = AgenticUtilityBillLLM()
+    model = llm.model.instances[0]
+    prompts = build_prompts(llm)
+    if not prompts:
+        print("No prompts built (are the invoice files present?)")
+        return False
+
+    # Baseline: empty context, the whole prompt is evaluated every time
+    cold = []
+    for _, prompt in prompts:
+        model.llm.reset()
+        started = time.perf_counter()
+        model.llm.create_completion(prompt, max_tokens=1, temperature=0.0)
+        cold.append(time.perf_counter() - started)
+
+    # Prefix cache: snapshots are taken on first use of each language prefix
+    warm = []
+    for prefix, prompt in prompts:
+        started = time.perf_counter()
+        model.generate(prompt, max_tokens=1, temp=0.0, prefix=prefix)
+        warm.append(time.perf_counter() - started)
+
+    prefix_tokens = {len(model.llm.tokenize(prefix.encode("utf-8"))) for prefix, _ in prompts}
+    prompt_tokens = [len(model.llm.tokenize(prompt.encode("utf-8"))) for _, prompt in prompts]
+    cold_ms = sum(cold) / len(cold) * 1000
+    warm_ms = sum(warm) / len(warm) * 1000
+
+    print(f"Prompts: {len(prompts)}, avg {sum(prompt_tokens) / len(prompt_tokens):.0f} tokens, "
+          f"prefix {'/'.join(str(n) for n in sorted(prefix_tokens))} tokens")
+    print(f"Without prefix cache: {cold_ms:8.1f} ms/prompt")
+    print(f"With prefix cache:    {warm_ms:8.1f} ms/prompt ({cold_ms / warm_ms:.1f}x)")
+    print(f"Prefix cache: {model.stats()}")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
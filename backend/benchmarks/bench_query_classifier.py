@@ -0,0 +1,118 @@
+# bench_query_classifier.py
+"""Compare the compiled ContextualQueryAnalyzer with the original per-pattern
+implementation: classification agreement on a labelled corpus and per-query latency.
+
+Run from backend/:  python benchmarks/bench_query_classifier.py
+"""
+
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agentic_llm_service import ContextualQueryAnalyzer, QueryType
+
+# (query, expected query type, expected conciseness level). Labels record the current
+# behaviour, quirks included: greetings match as substrings, so "hi" in "this" or
+# "which" classifies as a greeting.
+LABELLED_QUERIES = [
+    ("Hello", "greeting", "brief"),
+    ("Guten Morgen!", "greeting", "brief"),
+    ("Hi, what is my invoice amount?", "greeting", "brief"),
+    ("What is the Konzessionsabgabe?", "explanation", "moderate"),
+    ("Was ist die Konzessionsabgabe?", "explanation", "moderate"),
+    ("What does Grundpreis mean?", "explanation", "moderate"),
+    ("Erkläre mir die Netznutzung bitte genauer", "explanation", "moderate"),
+    ("Where can I find my consumption on the invoice?", "navigation", "moderate"),
+    ("Wo finde ich meinen Verbrauch auf der Rechnung?", "navigation", "moderate"),
+    ("In which section of the invoice are the levies listed?", "greeting", "brief"),
+    ("How much did I consume this year?", "greeting", "brief"),
+    ("Wieviel habe ich verbraucht?", "simple_fact", "brief"),
+    ("Wie hoch ist mein Rechnungsbetrag?", "simple_fact", "brief"),
+    ("Kannst du meine Kosten aufschlüsseln?", "simple_fact", "brief"),
+    ("Total consumption for the whole period, please", "simple_fact", "brief"),
+    ("Please give me my customer number for the contract", "simple_fact", "moderate"),
+    ("Can you break down my charges?", "explanation", "moderate"),
+    ("How was the working price calculated for my contract?", "calculation", "moderate"),
+    ("Why does electricity cost so much for me this year?", "greeting", "brief"),
+    ("Show me the details of the grid usage charges please", "calculation", "moderate"),
+    ("Warum kostet mein Strom dieses Jahr so viel mehr?", "calculation", "moderate"),
+    ("Compared to my previous invoice, what changed overall?", "comparison", "moderate"),
+    ("Is my bill higher than the average household bill?", "greeting", "brief"),
+    ("Why did my bill increase so much since last time?", "comparison", "moderate"),
+    ("Warum ist meine Rechnung gestiegen seit dem letzten Jahr?", "comparison", "moderate"),
+    ("Unterschied zur letzten Rechnung bitte genau nennen", "greeting", "brief"),
+    ("My bill is 50 euro higher than last time, can you check?", "greeting", "brief"),
+    ("When is my next advance payment due to be collected?", "explanation", "moderate"),
+    ("I want to change my tariff to green electricity next month", "explanation", "moderate"),
+    ("Can I pay by bank transfer instead?", "explanation", "moderate"),
+    ("this invoice looks wrong to me", "greeting", "brief"),
+    ("Bonus", "explanation", "brief"),
+    ("Why is the base price so high and how can I understand it?", "greeting", "brief"),
+    ("Please explain in detail why my bill went up\nand what I can do", "explanation", "moderate"),
+    ("Meine Abschlagszahlung erscheint mir zu hoch, stimmt das so?", "explanation", "moderate"),
+    ("What is my total consumption?", "explanation", "moderate"),
+]
+
+class LegacyQueryAnalyzer(ContextualQueryAnalyzer):
+    """The original implementation: one re.search per pattern, re-lowercased per check"""
+
+    def analyze_query(self, query):
+        query_lower = query.lower()
+        query_length = len(query.split())
+
+        if query_length <= 5 or any(word in query_lower for word in ['how much', 'total', 'amount', 'consumption', 'wieviel']):
+            conciseness_level = "brief"
+        elif any(word in query_lower for word in ['explain', 'detail', 'breakdown', 'why', 'understand', 'erkläre', 'aufschlüsseln']):
+            conciseness_level = "detailed"
+        else:
+            conciseness_level = "moderate"
+
+        if any(greet in query_lower for greet in self.GREETINGS):
+            return QueryType.GREETING, "brief"
+        if any(re.search(pattern, query_lower) for pattern in self.EXPLANATION_PATTERNS):
+            return QueryType.EXPLANATION, "moderate"
+        if any(re.search(pattern, query_lower) for pattern in self.NAVIGATION_PATTERNS):
+            return QueryType.NAVIGATION, "moderate"
+        if any(re.search(pattern, query_lower) for pattern in self.SIMPLE_FACT_PATTERNS):
+            return QueryType.SIMPLE_FACT, conciseness_level
+        if any(re.search(pattern, query_lower) for pattern in self.CALCULATION_PATTERNS):
+            return QueryType.CALCULATION, "moderate"
+        if any(re.search(pattern, query_lower) for pattern in self.COMPARISON_PATTERNS):
+            return QueryType.COMPARISON, "moderate"
+        return QueryType.EXPLANATION, conciseness_level
+
+def time_per_query(analyze, queries, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for query in queries:
+            analyze(query)
+    return (time.perf_counter() - started) / (rounds * len(queries)) * 1e6
+
+def main(rounds=2000):
+    compiled = ContextualQueryAnalyzer()
+    legacy = LegacyQueryAnalyzer()
+
+    mismatches = 0
+    for query, expected_type, expected_level in LABELLED_QUERIES:
+        query_type, response_format = compiled.analyze_query(query)
+        legacy_type, legacy_level = legacy.analyze_query(query)
+        got = (query_type.value, response_format.conciseness_level)
+        if got != (expected_type, expected_level) or got != (legacy_type.value, legacy_level):
+            mismatches += 1
+            print(f"MISMATCH {query!r}: compiled={got} legacy={(legacy_type.value, legacy_level)} "
+                  f"label={(expected_type, expected_level)}")
+
+    queries = [query for query, _, _ in LABELLED_QUERIES]
+    compiled_us = time_per_query(compiled.analyze_query, queries, rounds)
+    legacy_us = time_per_query(legacy.analyze_query, queries, rounds)
+
+    print(f"Labelled queries: {len(LABELLED_QUERIES)}, mismatches: {mismatches}")
+    print(f"Legacy classifier:   {legacy_us:8.2f} µs/query")
+    print(f"Compiled classifier: {compiled_us:8.2f} µs/query ({legacy_us / compiled_us:.1f}x)")
+    return mismatches == 0
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
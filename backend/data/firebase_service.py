@@ -1,40 +1,489 @@
 import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Protocol
 import firebase_admin
 from firebase_admin import credentials, db
-from functools import lru_cache
+from invoice_models import partner_element, process_element
+
+DEFAULT_DATABASE_URL = 'https://klarbill-3de73-default-rtdb.europe-west1.firebasedatabase.app/'
+
+class FirebaseClient:
+    """Process-wide Realtime Database access.
+
+    Initializes the Firebase app once (under a lock, so concurrent first
+    requests cannot race), keeps the SDK's single authenticated HTTP session
+    with a keep-alive pool of ``pool_size`` connections, and derives
+    references from one root reference. Recently used references are kept
+    in a bounded LRU; per-customer paths just cycle through it.
+    """
+
+    def __init__(self, database_url: str = None, credentials_path: str = None, pool_size: int = None,
+                 max_references: int = None):
+        self.database_url = database_url or os.getenv("FIREBASE_DATABASE_URL") or DEFAULT_DATABASE_URL
+        self.credentials_path = credentials_path or os.getenv("FIREBASE_CREDENTIALS_PATH") or \
+            os.path.join(os.path.dirname(__file__), "klarbill_admin_key.json")
+        self.pool_size = pool_size or int(os.getenv("FIREBASE_POOL_SIZE", "32"))
+        self.max_references = max_references or int(os.getenv("FIREBASE_REFERENCE_CACHE_SIZE", "256"))
+        self._lock = threading.Lock()
+        self._root = None
+        self._pid = None
+        self._adapter = None
+        self._references = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _initialize(self):
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(credentials.Certificate(self.credentials_path), {
+                'databaseURL': self.database_url
+            })
+        self._root = db.reference("/")
+        self._references.clear()
+        self._pid = os.getpid()
+        self._mount_pool()
+
+    def _mount_pool(self):
+        """Replace the SDK's default 10-connection pool, keeping its retry policy"""
+        session = getattr(getattr(self._root, "_client", None), "session", None)
+        if session is None:
+            return
+        from requests.adapters import HTTPAdapter
+        retries = session.get_adapter("https://").max_retries
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retries)
+        session.mount("https://", self._adapter)
+        session.mount("http://", self._adapter)
+
+    def reference(self, path: str = "/"):
+        """Reference to ``path``, built as a child of the root reference"""
+        segments = [segment for segment in path.split("/") if segment]
+        normalized = "/".join(segments)
+        with self._lock:
+            # A forked worker must not share its parent's pooled sockets
+            if self._root is None or self._pid != os.getpid():
+                self._initialize()
+            reference = self._references.get(normalized)
+            if reference is not None:
+                self._references.move_to_end(normalized)
+                self.hits += 1
+                return reference
+            self.misses += 1
+            reference = self._root.child(normalized) if normalized else self._root
+            self._references[normalized] = reference
+            while len(self._references) > self.max_references:
+                self._references.popitem(last=False)
+            return reference
+
+    def pool_stats(self) -> dict:
+        """Connections of the keep-alive pool: in use, idle, opened so far"""
+        if self._adapter is None:
+            return {}
+        stats = {"max_size": self.pool_size, "in_use": 0, "idle": 0, "opened": 0, "requests": 0}
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None or pool.pool is None:
+                continue
+            # The pool queue holds idle connections and None placeholders; the rest are checked out
+            idle = sum(1 for connection in list(pool.pool.queue) if connection is not None)
+            stats["in_use"] += pool.pool.maxsize - pool.pool.qsize()
+            stats["idle"] += idle
+            stats["opened"] += pool.num_connections
+            stats["requests"] += pool.num_requests
+        return stats
+
+    def stats(self) -> dict:
+        with self._lock:
+            cached = len(self._references)
+            lookups = self.hits + self.misses
+            hit_rate = round(self.hits / lookups, 3) if lookups else 0.0
+        return {
+            "initialized": self._root is not None,
+            "references_cached": cached,
+            "max_references": self.max_references,
+            "reference_hit_rate": hit_rate,
+            "pool": self.pool_stats()
+        }
+
+firebase_client = FirebaseClient()
 
-@lru_cache()
 def get_db_reference(path="/"):
-    if not firebase_admin._apps:
-        cred_path = os.path.join(os.path.dirname(__file__), "klarbill_admin_key.json")
-        cred = credentials.Certificate(cred_path)
-        firebase_admin.initialize_app(cred, {
-            'databaseURL': 'https://klarbill-3de73-default-rtdb.europe-west1.firebasedatabase.app/'
-        })
-    return db.reference(path)
+    return firebase_client.reference(path)
 
-def get_invoice_by_number(invoice_number):
-    """Retrieve a single invoice by invoice number."""
-    ref = get_db_reference("invoices")
-    all_invoices = ref.get() or {}
+INVOICE_NUMBER_PATH = "Data/ProzessDaten/ProzessDatenElement/invoiceNumber"
+CUSTOMER_NUMBER_PATH = "Data/ProzessDaten/ProzessDatenElement/Geschaeftspartner/GeschaeftspartnerElement/customerNumber"
+INVOICE_BY_NUMBER_PATH = "invoice_by_number"
+INVOICES_BY_CUSTOMER_PATH = "invoices_by_customer"
+INVOICE_SUMMARIES_PATH = "invoice_summaries"
+INVOICE_VERSIONS_PATH = "invoice_versions"
+
+def _node_key(value):
+    """Make an invoice/customer number safe to use as a database key"""
+    return re.sub(r'[.$#\[\]/]', '_', str(value))
+
+def _child_of(node, part):
+    if isinstance(node, list):
+        return node[int(part)] if part.isdigit() and int(part) < len(node) else None
+    return node.get(part) if isinstance(node, dict) else None
+
+def _with_child(node, part, value):
+    """Copy of a dict or list node with ``part`` set to ``value``; None removes it, as in the database"""
+    if isinstance(node, list) and part.isdigit():
+        copy = list(node)
+        index = int(part)
+        copy.extend([None] * (index + 1 - len(copy)))
+        copy[index] = value
+        while copy and copy[-1] is None:
+            copy.pop()
+        return copy
+    copy = dict(node) if isinstance(node, dict) else {}
+    if value is None:
+        copy.pop(part, None)
+    else:
+        copy[part] = value
+    return copy
+
+def _patched(node, path, event_type, data):
+    """Copy of ``node`` with a listener event's ``data`` put or patched at ``path``; only the changed branch is copied"""
+    if path:
+        return _with_child(node, path[0], _patched(_child_of(node, path[0]), path[1:], event_type, data))
+    if event_type != "patch":
+        return data
+    # Patch keys may be paths themselves ("Data/ProzessDaten/...")
+    for child_path, value in (data or {}).items():
+        node = _patched(node, [p for p in child_path.split("/") if p], "put", value)
+    return node
+
+class InvoiceIndex:
+    """In-process hash index from invoice/customer number to invoice keys.
+
+    The index is built once from the ``invoices`` node and then kept current
+    either by a Realtime Database listener (``listen``) or by a periodic
+    delta sync (``poll``), so lookups never hit the network. The delta sync
+    compares the per-invoice versions in ``invoice_versions/`` and reloads
+    the whole node every ``full_sync_interval`` seconds, for invoices edited
+    without a version.
+    """
+
+    def __init__(self, path="invoices", sync_mode=None, poll_interval=None, full_sync_interval=None):
+        self.path = path
+        self.sync_mode = sync_mode or os.getenv("INVOICE_INDEX_SYNC", "listen")
+        self.poll_interval = poll_interval or float(os.getenv("INVOICE_INDEX_POLL_SECONDS", "60"))
+        self.full_sync_interval = full_sync_interval if full_sync_interval is not None else \
+            float(os.getenv("INVOICE_INDEX_FULL_SYNC_SECONDS", "3600"))
+        self._built_at = 0.0
+        self._lock = threading.RLock()
+        self._invoices = {}
+        self._by_number = {}
+        self._by_customer = {}
+        self._built = threading.Event()
+        self._listener = None
+        self._poll_thread = None
+        self._stop = threading.Event()
+        self.version = 0
+
+    # ----- maintenance -----
+
+    def _index_entry(self, key, entry):
+        invoice_number = process_element(entry).get("invoiceNumber")
+        customer_number = partner_element(entry).get("customerNumber")
+        if invoice_number:
+            self._by_number.setdefault(invoice_number, key)
+        if customer_number:
+            self._by_customer.setdefault(customer_number, set()).add(key)
+
+    def _unindex_entry(self, key):
+        entry = self._invoices.pop(key, None)
+        if entry is None:
+            return
+        invoice_number = process_element(entry).get("invoiceNumber")
+        customer_number = partner_element(entry).get("customerNumber")
+        if invoice_number and self._by_number.get(invoice_number) == key:
+            del self._by_number[invoice_number]
+            # Another key may carry the same invoice number
+            for other_key, other_entry in self._invoices.items():
+                if process_element(other_entry).get("invoiceNumber") == invoice_number:
+                    self._by_number[invoice_number] = other_key
+                    break
+        keys = self._by_customer.get(customer_number)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_customer[customer_number]
+
+    def upsert(self, key, entry):
+        """Add, replace or (with ``entry=None``) remove a single invoice"""
+        with self._lock:
+            self._unindex_entry(key)
+            if isinstance(entry, dict):
+                self._invoices[key] = entry
+                self._index_entry(key, entry)
+            self.version += 1
+
+    def load(self, all_invoices):
+        """Replace the whole index with a full snapshot of the invoices node"""
+        with self._lock:
+            self._invoices = {}
+            self._by_number = {}
+            self._by_customer = {}
+            for key, entry in (all_invoices or {}).items():
+                if isinstance(entry, dict):
+                    self._invoices[key] = entry
+                    self._index_entry(key, entry)
+            self.version += 1
+        self._built.set()
+
+    def build(self):
+        """Full load of the invoices node (one network round trip)"""
+        started = time.perf_counter()
+        self.load(get_db_reference(self.path).get() or {})
+        self._built_at = time.monotonic()
+        print(f"✅ Invoice index built: {len(self._invoices)} invoices in {time.perf_counter() - started:.2f}s")
+
+    def _apply(self, parts, event_type, data):
+        # Nested changes patch a copy of the invoice (lists stay lists), which is then re-indexed
+        with self._lock:
+            entry = _patched(self._invoices.get(parts[0]), parts[1:], event_type, data)
+            if parts[1:]:
+                rewrites_hash = parts[1] == "content_hash"
+            else:
+                rewrites_hash = event_type != "patch" or "content_hash" in (data or {})
+            if not rewrites_hash and isinstance(entry, dict):
+                # Edited in place: the hash recorded at ingestion no longer matches
+                entry.pop("content_hash", None)
+            self.upsert(parts[0], entry)
+
+    def apply_event(self, event):
+        """Apply a Realtime Database ``put``/``patch`` event to the index"""
+        parts = [p for p in (event.path or "/").split("/") if p]
+        if parts:
+            self._apply(parts, event.event_type, event.data)
+        elif event.event_type == "put":
+            self.load(event.data or {})
+        else:
+            for path, value in (event.data or {}).items():
+                self._apply([p for p in path.split("/") if p], "put", value)
+
+    def delta_sync(self):
+        """Fetch the invoices added or re-ingested since the last sync and drop deleted ones"""
+        ref = get_db_reference(self.path)
+        remote_keys = set((ref.get(shallow=True) or {}).keys())
+        remote_versions = get_db_reference(INVOICE_VERSIONS_PATH).get() or {}
+        with self._lock:
+            local_versions = {key: entry.get("content_hash") for key, entry in self._invoices.items()}
+        for key in local_versions.keys() - remote_keys:
+            self.upsert(key, None)
+        for key in remote_keys:
+            if key not in local_versions or remote_versions.get(key, local_versions[key]) != local_versions[key]:
+                self.upsert(key, ref.child(key).get())
+
+    def _poll_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                if self.full_sync_interval > 0 and time.monotonic() - self._built_at >= self.full_sync_interval:
+                    self.build()
+                else:
+                    self.delta_sync()
+            except Exception as e:
+                print(f"Invoice index delta sync failed: {e}")
+
+    def start(self):
+        """Build the index and start keeping it in sync"""
+        if self.sync_mode == "listen":
+            try:
+                # The first listener event is a full snapshot of the node
+                self._listener = get_db_reference(self.path).listen(self.apply_event)
+                if self._built.wait(timeout=30):
+                    print(f"✅ Invoice index built: {len(self._invoices)} invoices (live updates enabled)")
+                    return self
+                print("Invoice index listener timed out, falling back to polling")
+                self.close()
+                self._stop.clear()
+            except Exception as e:
+                print(f"Invoice index listener unavailable ({e}), falling back to polling")
+            self.sync_mode = "poll"
+
+        self.build()
+        if self.sync_mode == "poll" and self.poll_interval > 0:
+            self._poll_thread = threading.Thread(target=self._poll_loop, name="invoice-index-sync", daemon=True)
+            self._poll_thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
 
+    # ----- lookups -----
+
+    def get_by_number(self, invoice_number):
+        with self._lock:
+            key = self._by_number.get(invoice_number)
+            return {key: self._invoices[key]} if key is not None else {}
+
+    def get_by_customer(self, customer_number):
+        with self._lock:
+            return {key: self._invoices[key] for key in self._by_customer.get(customer_number, ())}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "invoices": len(self._invoices),
+                "invoice_numbers": len(self._by_number),
+                "customers": len(self._by_customer),
+                "sync_mode": self.sync_mode,
+                "version": self.version
+            }
+
+_invoice_index = None
+_invoice_index_lock = threading.Lock()
+
+def get_invoice_index():
+    """Return the process-wide invoice index, building it on first use"""
+    global _invoice_index
+    if _invoice_index is None:
+        with _invoice_index_lock:
+            if _invoice_index is None:
+                _invoice_index = InvoiceIndex().start()
+    return _invoice_index
+
+def build_lookup_updates(key, entry):
+    """Multi-path update that (re)writes the denormalized lookup nodes and the version of one invoice"""
+    invoice_number = process_element(entry).get("invoiceNumber")
+    customer_number = partner_element(entry).get("customerNumber")
+    updates = {}
+    if invoice_number:
+        updates[f"{INVOICE_BY_NUMBER_PATH}/{_node_key(invoice_number)}"] = key
+    if customer_number:
+        updates[f"{INVOICES_BY_CUSTOMER_PATH}/{_node_key(customer_number)}/{key}"] = True
+    if entry.get("content_hash"):
+        # Lets a polling invoice index find re-ingested invoices without downloading them
+        updates[f"{INVOICE_VERSIONS_PATH}/{key}"] = entry["content_hash"]
+    return updates
+
+def rebuild_lookup_nodes():
+    """Backfill invoice_by_number/ and invoices_by_customer/ for every stored invoice"""
+    all_invoices = get_db_reference("invoices").get() or {}
+    updates = {}
     for key, entry in all_invoices.items():
-        invoice_data = entry.get("Data", {}).get("ProzessDaten", {}).get("ProzessDatenElement", {})
-        if invoice_data.get("invoiceNumber") == invoice_number:
-            return {key: entry}
+        updates.update(build_lookup_updates(key, entry))
+    if updates:
+        get_db_reference("/").update(updates)
+    print(f"✅ Rebuilt lookup nodes for {len(all_invoices)} invoices")
+    return len(all_invoices)
+
+def _query_by_child(child_path, value):
+    """Indexed server-side query; needs the .indexOn rules in database.rules.json"""
+    return get_db_reference("invoices").order_by_child(child_path).equal_to(value).get() or {}
+
+def _fetch_by_keys(keys):
+    invoices = get_db_reference("invoices")
+    result = {}
+    for key in keys:
+        entry = invoices.child(key).get()
+        if entry:
+            result[key] = entry
+    return result
+
+def _lookup_mode():
+    # index: in-process InvoiceIndex, query: orderByChild/equalTo, lookup: denormalized nodes
+    return os.getenv("INVOICE_LOOKUP_MODE", "index")
+
+class InvoiceStore(Protocol):
+    """Where invoices are read from and ingested into, selected by INVOICE_STORE.
+
+    Implemented by ``FirebaseInvoiceStore`` below and ``data.invoice_store.SQLiteInvoiceStore``.
+    Lookups return raw invoice entries keyed by database key.
+    """
+
+    def get_by_number(self, invoice_number) -> Dict[str, Dict[str, Any]]: ...
+
+    def get_by_customer(self, customer_number) -> Dict[str, Dict[str, Any]]: ...
+
+    def get_summary(self, key: str) -> Optional[Dict[str, Any]]: ...
+
+    def load(self, source: str, pattern: str = "*.json") -> Dict[str, int]: ...
 
-    return {}
+    def stats(self) -> dict: ...
+
+class FirebaseInvoiceStore:
+    """Invoices in the Realtime Database, looked up as INVOICE_LOOKUP_MODE says"""
+
+    def get_by_number(self, invoice_number):
+        mode = _lookup_mode()
+        if mode == "query":
+            matches = _query_by_child(INVOICE_NUMBER_PATH, invoice_number)
+            if not matches:
+                return {}
+            key = next(iter(matches))
+            return {key: matches[key]}
+        if mode == "lookup":
+            key = get_db_reference(f"{INVOICE_BY_NUMBER_PATH}/{_node_key(invoice_number)}").get()
+            return _fetch_by_keys([key]) if key else {}
+        return get_invoice_index().get_by_number(invoice_number)
+
+    def get_by_customer(self, customer_number):
+        mode = _lookup_mode()
+        if mode == "query":
+            return _query_by_child(CUSTOMER_NUMBER_PATH, customer_number)
+        if mode == "lookup":
+            keys = get_db_reference(f"{INVOICES_BY_CUSTOMER_PATH}/{_node_key(customer_number)}").get(shallow=True) or {}
+            return _fetch_by_keys(keys)
+        return get_invoice_index().get_by_customer(customer_number)
+
+    def get_summary(self, key):
+        return get_db_reference(f"{INVOICE_SUMMARIES_PATH}/{key}").get()
+
+    def load(self, source, pattern="*.json"):
+        """Ingest invoice files with their summary documents (see data.ingest_invoices)"""
+        from data.ingest_invoices import ingest_invoices
+        return ingest_invoices(source, pattern=pattern)
+
+    def stats(self):
+        stats = {"backend": "firebase", "lookup_mode": _lookup_mode()}
+        # Only reported once built; stats never trigger the full download
+        if _invoice_index is not None:
+            stats["index"] = _invoice_index.stats()
+        return stats
+
+_invoice_store = None
+_invoice_store_lock = threading.Lock()
+
+def invoice_store_backend():
+    # firebase: Realtime Database (default), sqlite: local SQLite file loaded from the invoice JSON
+    return os.getenv("INVOICE_STORE", "firebase")
+
+def create_invoice_store(backend: Optional[str] = None) -> InvoiceStore:
+    """Build the invoice store selected by INVOICE_STORE (firebase or sqlite)"""
+    backend = backend or invoice_store_backend()
+    if backend == "sqlite":
+        from data.invoice_store import SQLiteInvoiceStore
+        return SQLiteInvoiceStore()
+    return FirebaseInvoiceStore()
+
+def get_invoice_store() -> InvoiceStore:
+    """Return the process-wide invoice store, opening it on first use"""
+    global _invoice_store
+    if _invoice_store is None:
+        with _invoice_store_lock:
+            if _invoice_store is None:
+                _invoice_store = create_invoice_store()
+    return _invoice_store
+
+def get_invoice_by_number(invoice_number):
+    """Retrieve a single invoice by invoice number."""
+    return get_invoice_store().get_by_number(invoice_number)
 
 def get_invoices_by_customer(customer_number):
     """Retrieve all invoices for a specific customer number."""
-    ref = get_db_reference("invoices")
-    all_invoices = ref.get() or {}
-
-    matched_invoices = {}
+    return get_invoice_store().get_by_customer(customer_number)
 
-    for key, entry in all_invoices.items():
-        customer_data = entry.get("Data", {}).get("ProzessDaten", {}).get("ProzessDatenElement", {}).get("Geschaeftspartner", {}).get("GeschaeftspartnerElement", {})
-        if customer_data.get("customerNumber") == customer_number:
-            matched_invoices[key] = entry
+def get_invoice_summary(key):
+    """Retrieve the summary document materialized for the invoice stored under ``key``."""
+    return get_invoice_store().get_summary(key)
 
-    return matched_invoices
+if __name__ == "__main__":
+    rebuild_lookup_nodes()
@@ -0,0 +1,361 @@
+# ingest_invoices.py
+"""Bulk, idempotent invoice ingestion.
+
+Streams invoices from a directory of ``*.json`` files or from an NDJSON file
+(one invoice per line) into the Realtime Database:
+
+- invoices are stored under deterministic keys (``inv-<invoice number>``),
+  so re-running an ingestion rewrites the same nodes instead of duplicating;
+- invoice numbers already in the database are skipped, and a manifest of
+  content hashes lets re-runs skip invoices that did not change and are
+  still stored;
+- writes are batched into multi-path ``update()`` calls together with the
+  lookup nodes and summary documents, with a few batches in flight at once;
+- QR codes are rendered in a process pool, one customer code per customer;
+  skipped invoices get theirs only if the file is missing.
+
+Run from backend/:  python -m data.ingest_invoices <directory or .ndjson> [options]
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from data.firebase_service import (get_db_reference, build_lookup_updates, INVOICE_BY_NUMBER_PATH,
+                                   INVOICES_BY_CUSTOMER_PATH, INVOICE_SUMMARIES_PATH, _node_key)
+from invoice_analysis import previous_invoice_pointers, summarize_invoice, summary_to_document
+from invoice_models import BusinessPartner, loads, partner_element, process_element
+from .createQr import create_invoice_qr_code, create_customer_qr_code, customer_qr_path, invoice_qr_path
+
+DEFAULT_MANIFEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".ingest_manifest.ndjson")
+
+def invoice_key(invoice_number: str) -> str:
+    """Deterministic database key of an invoice"""
+    return f"inv-{_node_key(invoice_number)}"
+
+def iter_invoices(source: str, pattern: str = "*.json") -> Iterator[Tuple[str, bytes]]:
+    """Yield (origin, raw JSON) from a directory of JSON files or an NDJSON file, one at a time"""
+    if os.path.isdir(source):
+        for file_path in sorted(glob.glob(os.path.join(source, pattern))):
+            try:
+                with open(file_path, "rb") as f:
+                    yield os.path.basename(file_path), f.read()
+            except OSError as e:
+                print(f"Error reading invoice file {file_path}: {e}")
+        return
+
+    with open(source, "rb") as f:
+        for line_number, line in enumerate(f, 1):
+            if line.strip():
+                yield f"{os.path.basename(source)}:{line_number}", line
+
+def raw_content_hash(raw: bytes) -> str:
+    """Hash of an invoice's source bytes; cheap enough to skip unchanged invoices before parsing"""
+    return hashlib.blake2b(raw.strip(), digest_size=12).hexdigest()
+
+class IngestManifest:
+    """Append-only NDJSON record of ingested invoices: invoice number -> content hash, key and QR fields.
+
+    Later lines win; ``compact`` rewrites the file with one line per invoice.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict[str, str]] = {}
+        self.numbers_by_hash: Dict[str, str] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.entries[entry["invoice_number"]] = entry
+                        self.numbers_by_hash[entry["hash"]] = entry["invoice_number"]
+                    except (ValueError, KeyError):
+                        continue
+        self._file = None
+
+    def get(self, invoice_number: str) -> Optional[Dict[str, str]]:
+        return self.entries.get(invoice_number)
+
+    def record(self, entries):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        for entry in entries:
+            self.entries[entry["invoice_number"]] = entry
+            self.numbers_by_hash[entry["hash"]] = entry["invoice_number"]
+            self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def compact(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp_path, self.path)
+
+def existing_invoice_numbers(backfill: bool = True, batch_size: int = 500) -> set:
+    """Node keys of the invoice numbers already stored, from the invoice_by_number/ lookup node.
+
+    Stored invoices missing from it (uploaded before the lookup nodes existed) are read
+    one by one and, with ``backfill``, get their lookup nodes written.
+    """
+    by_number = get_db_reference(INVOICE_BY_NUMBER_PATH).get() or {}
+    indexed = set(by_number.values())
+    missing = [key for key in get_db_reference("invoices").get(shallow=True) or {} if key not in indexed]
+    if not missing:
+        return set(by_number)
+    print(f"⚠️ {len(missing)} invoices have no lookup nodes, {'backfilling' if backfill else 'reading'} them")
+    invoices = get_db_reference("invoices")
+    updates = {}
+    for key in missing:
+        entry = invoices.child(key).get() or {}
+        invoice_number = process_element(entry).get("invoiceNumber")
+        if invoice_number:
+            by_number[_node_key(invoice_number)] = key
+        updates.update(build_lookup_updates(key, entry))
+        if backfill and len(updates) >= batch_size:
+            get_db_reference("/").update(updates)
+            updates = {}
+    if backfill and updates:
+        get_db_reference("/").update(updates)
+    return set(by_number)
+
+class SummaryTimelines:
+    """Previous-invoice pointers of the customers an ingestion writes to.
+
+    Per customer: invoice date, invoice number and stored pointer of each invoice
+    written in this run, plus those of its summary documents already in the
+    database, read once when the customer is first seen.
+    """
+
+    def __init__(self, stored_customers: set):
+        self.stored_customers = stored_customers
+        self.timelines: Dict[str, Dict[str, List[Any]]] = {}
+
+    def _timeline(self, customer_number: str) -> Dict[str, List[Any]]:
+        timeline = self.timelines.get(customer_number)
+        if timeline is not None:
+            return timeline
+        timeline = self.timelines[customer_number] = {}
+        if _node_key(customer_number) in self.stored_customers:
+            keys = get_db_reference(f"{INVOICES_BY_CUSTOMER_PATH}/{_node_key(customer_number)}").get(shallow=True) or {}
+            summaries = get_db_reference(INVOICE_SUMMARIES_PATH)
+            for key in keys:
+                document = summaries.child(key).get()
+                if document:
+                    timeline[key] = [document.get("invoice_date") or "", document.get("invoice_number") or "",
+                                     document.get("previous_invoice")]
+        return timeline
+
+    def add(self, customer_number: str, key: str, invoice_number: str, invoice_date: str) -> Optional[Dict[str, str]]:
+        """Add a written invoice; returns its previous-invoice pointer as far as known now"""
+        timeline = self._timeline(customer_number)
+        timeline[key] = [invoice_date, invoice_number, None]
+        pointer = previous_invoice_pointers(
+            (other, number, date) for other, (date, number, _) in timeline.items()).get(key)
+        timeline[key][2] = pointer
+        return pointer
+
+    def pointer_updates(self, skip_keys=()) -> Dict[str, Any]:
+        """Multi-path update for the stored pointers that later invoices of this run made stale"""
+        updates = {}
+        for timeline in self.timelines.values():
+            pointers = previous_invoice_pointers((key, number, date) for key, (date, number, _) in timeline.items())
+            for key, (_, _, stored) in timeline.items():
+                if key not in skip_keys and pointers.get(key) != stored:
+                    updates[f"{INVOICE_SUMMARIES_PATH}/{key}/previous_invoice"] = pointers.get(key)
+        return updates
+
+def _qr_fields(invoice) -> Tuple[str, str]:
+    """Name and customer number printed on an invoice's QR codes"""
+    partner = BusinessPartner.from_dict(partner_element(invoice))
+    return f"{partner.salutation} {partner.name}".strip(), partner.customer_number
+
+def _render_qr(task):
+    kind, base_url, name, number, output_dir = task
+    if kind == "invoice":
+        return create_invoice_qr_code(base_url, name, number, output_dir)
+    return create_customer_qr_code(base_url, name, number, output_dir)
+
+def ingest_invoices(source: str, pattern: str = "*.json", batch_size: int = None, writers: int = None,
+                    qr_workers: int = None, qr_codes: bool = True, qr_output_dir: str = None, manifest_path: str = None,
+                    force: bool = False, dry_run: bool = False, summaries: bool = True) -> Dict[str, int]:
+    """Ingest every invoice from ``source``; returns counts of written and skipped invoices.
+
+    With ``summaries`` each invoice's summary document is written in the same batch.
+    """
+    batch_size = batch_size or int(os.getenv("INGEST_BATCH_SIZE", "500"))
+    writers = writers or int(os.getenv("INGEST_WRITERS", "4"))
+    base_url = os.getenv("QR_BASE_URL", "http://127.0.0.1:8000")
+    started = time.perf_counter()
+
+    manifest = IngestManifest(manifest_path or os.getenv("INGEST_MANIFEST_PATH", DEFAULT_MANIFEST))
+    existing = existing_invoice_numbers(backfill=not dry_run, batch_size=batch_size)
+    counts = {"written": 0, "unchanged": 0, "already_uploaded": 0, "invalid": 0, "failed": 0, "qr_codes": 0}
+    qr_tasks = []
+    customers_with_qr = set()
+    # Customers with stored invoices, whose existing summaries take part in the pointers
+    timelines = SummaryTimelines(set(get_db_reference(INVOICES_BY_CUSTOMER_PATH).get(shallow=True) or {})
+                                 if summaries and existing else set())
+    failed_keys = set()
+
+    root = get_db_reference("/")
+    write_pool = ThreadPoolExecutor(max_workers=writers)
+    in_flight = []  # (future, manifest entries)
+
+    def collect(block: bool):
+        nonlocal in_flight
+        pending = []
+        for future, entries in in_flight:
+            if not block and not future.done():
+                pending.append((future, entries))
+                continue
+            try:
+                future.result()
+                manifest.record(entries)
+                counts["written"] += len(entries)
+            except Exception as e:
+                counts["failed"] += len(entries)
+                failed_keys.update(entry["key"] for entry in entries)
+                print(f"Error writing invoice batch: {e}")
+        in_flight = pending
+
+    def queue_qr(full_name, customer_number, invoice_number, missing_only):
+        if not (qr_codes and full_name and customer_number):
+            return
+        if not (missing_only and os.path.exists(invoice_qr_path(full_name, invoice_number, qr_output_dir))):
+            qr_tasks.append(("invoice", base_url, full_name, invoice_number, qr_output_dir))
+        if customer_number not in customers_with_qr:
+            customers_with_qr.add(customer_number)
+            if not (missing_only and os.path.exists(customer_qr_path(full_name, customer_number, qr_output_dir))):
+                qr_tasks.append(("customer", base_url, full_name, customer_number, qr_output_dir))
+
+    def flush(updates, entries):
+        if not entries:
+            return
+        if dry_run:
+            counts["written"] += len(entries)
+            return
+        in_flight.append((write_pool.submit(root.update, updates), entries))
+        # Bound memory: wait for the oldest batch once every writer is busy
+        if len(in_flight) >= writers:
+            wait([in_flight[0][0]])
+        collect(block=False)
+
+    updates, entries = {}, []
+    for origin, raw in iter_invoices(source, pattern):
+        content_hash = raw_content_hash(raw)
+        recorded_number = manifest.numbers_by_hash.get(content_hash)
+        # Only skipped while the invoice is still stored: the database may have been reset or switched
+        if recorded_number is not None and _node_key(recorded_number) in existing and not force:
+            counts["unchanged"] += 1
+            recorded = manifest.get(recorded_number)
+            if qr_codes:
+                if "name" in recorded:
+                    full_name, customer_number = recorded["name"], recorded["customer_number"]
+                else:
+                    full_name, customer_number = _qr_fields(loads(raw))
+                queue_qr(full_name, customer_number, recorded_number, missing_only=True)
+            continue
+        try:
+            invoice = loads(raw)
+        except ValueError as e:
+            counts["invalid"] += 1
+            print(f"Error parsing {origin}: {e}")
+            continue
+
+        invoice_number = process_element(invoice).get("invoiceNumber")
+        if not invoice_number:
+            counts["invalid"] += 1
+            print(f"Skipping {origin}: no invoice number")
+            continue
+        invoice_number = str(invoice_number)
+
+        recorded = manifest.get(invoice_number)
+        # Invoices uploaded by other means keep their node; only manifest-tracked ones are rewritten
+        if _node_key(invoice_number) in existing and not recorded and not force:
+            counts["already_uploaded"] += 1
+            queue_qr(*_qr_fields(invoice), invoice_number, missing_only=True)
+            continue
+
+        key = recorded["key"] if recorded else invoice_key(invoice_number)
+        # Stored with the invoice (and in invoice_versions/), so readers get its version without hashing it
+        invoice["content_hash"] = content_hash
+        updates[f"invoices/{key}"] = invoice
+        updates.update(build_lookup_updates(key, invoice))
+        partner_dict = partner_element(invoice)
+        full_name, customer_number = _qr_fields(invoice)
+        entries.append({"invoice_number": invoice_number, "hash": content_hash, "key": key,
+                        "name": full_name, "customer_number": customer_number})
+        existing.add(_node_key(invoice_number))
+        if summaries:
+            summary = summarize_invoice(invoice.get("Data") or {})
+            pointer = (timelines.add(customer_number, key, summary.invoice_number, summary.invoice_date)
+                       if customer_number else None)
+            updates[f"{INVOICE_SUMMARIES_PATH}/{key}"] = summary_to_document(summary, content_hash, partner_dict,
+                                                                             pointer)
+        queue_qr(full_name, customer_number, invoice_number, missing_only=False)
+
+        if len(entries) >= batch_size:
+            flush(updates, entries)
+            updates, entries = {}, []
+
+    flush(updates, entries)
+    collect(block=True)
+    write_pool.shutdown()
+    if not dry_run:
+        manifest.compact()
+        # An invoice dated before ones written earlier in the run changes their pointers
+        pointer_updates = timelines.pointer_updates(failed_keys)
+        keys = list(pointer_updates)
+        for start in range(0, len(keys), batch_size):
+            root.update({path: pointer_updates[path] for path in keys[start:start + batch_size]})
+
+    if qr_tasks and not dry_run:
+        # Spawned, not forked: the parent holds database sessions and writer threads
+        with ProcessPoolExecutor(max_workers=qr_workers, mp_context=multiprocessing.get_context("spawn")) as qr_pool:
+            for _ in qr_pool.map(_render_qr, qr_tasks, chunksize=max(1, len(qr_tasks) // 64)):
+                counts["qr_codes"] += 1
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Ingested {counts['written']} invoices in {elapsed:.1f}s "
+          f"({counts['unchanged']} unchanged, {counts['already_uploaded']} already uploaded, "
+          f"{counts['invalid']} invalid, {counts['failed']} failed, {counts['qr_codes']} QR codes)")
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-ingest invoices into the Realtime Database")
+    parser.add_argument("source", help="directory of invoice JSON files or an NDJSON file")
+    parser.add_argument("--pattern", default="*.json", help="file pattern inside a source directory")
+    parser.add_argument("--batch-size", type=int, help="invoices per multi-path update (INGEST_BATCH_SIZE, 500)")
+    parser.add_argument("--writers", type=int, help="batches written concurrently (INGEST_WRITERS, 4)")
+    parser.add_argument("--qr-workers", type=int, help="QR rendering processes (default: CPU count)")
+    parser.add_argument("--qr-dir", help="output directory for QR codes (default: backend/data)")
+    parser.add_argument("--no-qr", action="store_true", help="skip QR code rendering")
+    parser.add_argument("--manifest", help=f"manifest path (INGEST_MANIFEST_PATH, {DEFAULT_MANIFEST})")
+    parser.add_argument("--force", action="store_true", help="rewrite invoices even if unchanged or already uploaded")
+    parser.add_argument("--no-summaries", action="store_true", help="do not write invoice_summaries/ documents")
+    parser.add_argument("--dry-run", action="store_true", help="read and dedupe only, write nothing")
+    args = parser.parse_args(argv)
+
+    from config import ensure_config
+    ensure_config()
+
+    counts = ingest_invoices(
+        args.source, pattern=args.pattern, batch_size=args.batch_size, writers=args.writers, qr_workers=args.qr_workers,
+        qr_codes=not args.no_qr, qr_output_dir=args.qr_dir, manifest_path=args.manifest,
+        force=args.force, dry_run=args.dry_run, summaries=not args.no_summaries
+    )
+    return 1 if counts["failed"] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,267 @@
+# invoice_store.py
+"""Local invoice store: invoices and their summaries in a SQLite file.
+
+An alternative to the Realtime Database for offline deployments, load tests
+and API benchmarks (``INVOICE_STORE=sqlite``). Invoices are stored as JSON
+documents, checked with SQLite's JSON1 ``json_valid``, next to extracted and
+indexed invoice number, customer number and invoice date columns, so lookups
+are index seeks on local disk instead of network round trips.
+
+Run from backend/:  python -m data.invoice_store <directory or .ndjson> [options]
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from data.ingest_invoices import invoice_key, iter_invoices, raw_content_hash
+from invoice_analysis import build_summary_documents, parse_invoice_date
+from invoice_models import loads, partner_element, process_element
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "invoices.sqlite3")
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS invoices ("
+    "key TEXT PRIMARY KEY, invoice_number TEXT, customer_number TEXT, invoice_date TEXT, "
+    "content_hash TEXT NOT NULL, data TEXT NOT NULL CHECK (json_valid(data)))",
+    "CREATE INDEX IF NOT EXISTS invoices_number ON invoices(invoice_number, key)",
+    "CREATE INDEX IF NOT EXISTS invoices_customer ON invoices(customer_number, invoice_date)",
+    "CREATE TABLE IF NOT EXISTS invoice_summaries ("
+    "key TEXT PRIMARY KEY, data TEXT NOT NULL CHECK (json_valid(data)))"
+)
+
+def invoice_columns(invoice: Dict[str, Any]) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """Invoice number, customer number and ISO invoice date of a raw invoice"""
+    process_data = process_element(invoice)
+    invoice_number = process_data.get("invoiceNumber")
+    customer_number = partner_element(invoice).get("customerNumber")
+    invoice_date = parse_invoice_date(process_data.get("invoiceDate") or "")
+    return (str(invoice_number) if invoice_number else None,
+            str(customer_number) if customer_number else None,
+            invoice_date.strftime("%Y-%m-%d") if invoice_date else None)
+
+class SQLiteInvoiceStore:
+    """Invoices and invoice summaries in a local SQLite file.
+
+    Each thread reads through its own connection (WAL mode, so readers never
+    block each other or the loader). Parsed invoices are kept in an LRU keyed
+    by content hash, so repeat lookups return the same dict, as the invoice
+    index does, and the summary cache can skip re-hashing them.
+    """
+
+    def __init__(self, path: str = None, cache_size: int = None):
+        self.path = path or os.getenv("INVOICE_SQLITE_PATH", DEFAULT_PATH)
+        self.cache_size = cache_size or int(os.getenv("INVOICE_STORE_CACHE_SIZE", "1024"))
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._cache = OrderedDict()  # key -> (content hash, parsed invoice)
+        self._cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            conn.execute(statement)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # A forked worker opens its own connections
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # ----- lookups -----
+
+    def _parsed(self, rows: Iterable[Tuple[str, str, str]]) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for key, content_hash, data in rows:
+            with self._cache_lock:
+                entry = self._cache.get(key)
+                if entry is not None and entry[0] == content_hash:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    result[key] = entry[1]
+                    continue
+                self.misses += 1
+            invoice = loads(data)
+            # Same shape as an ingested Realtime Database entry
+            invoice["content_hash"] = content_hash
+            with self._cache_lock:
+                self._cache[key] = (content_hash, invoice)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            result[key] = invoice
+        return result
+
+    def get_by_number(self, invoice_number) -> Dict[str, Dict[str, Any]]:
+        rows = self._connection().execute(
+            "SELECT key, content_hash, data FROM invoices WHERE invoice_number = ? ORDER BY key LIMIT 1",
+            (str(invoice_number),)
+        ).fetchall()
+        return self._parsed(rows)
+
+    def get_by_customer(self, customer_number) -> Dict[str, Dict[str, Any]]:
+        rows = self._connection().execute(
+            "SELECT key, content_hash, data FROM invoices WHERE customer_number = ? ORDER BY invoice_date, key",
+            (str(customer_number),)
+        ).fetchall()
+        return self._parsed(rows)
+
+    def get_summary(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute("SELECT data FROM invoice_summaries WHERE key = ?", (key,)).fetchone()
+        return loads(row[0]) if row else None
+
+    # ----- loading -----
+
+    def _write(self, invoice_rows, summary_rows=()):
+        conn = self._connection()
+        with self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT INTO invoices (key, invoice_number, customer_number, invoice_date, content_hash, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+                    "invoice_number = excluded.invoice_number, customer_number = excluded.customer_number, "
+                    "invoice_date = excluded.invoice_date, content_hash = excluded.content_hash, data = excluded.data",
+                    invoice_rows
+                )
+                conn.executemany(
+                    "INSERT INTO invoice_summaries (key, data) VALUES (?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+                    summary_rows
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def load(self, source: str, pattern: str = "*.json", batch_size: int = None, force: bool = False,
+             summaries: bool = True) -> Dict[str, int]:
+        """Load invoices from a directory of JSON files or an NDJSON file; unchanged ones are skipped"""
+        batch_size = batch_size or int(os.getenv("INGEST_BATCH_SIZE", "500"))
+        started = time.perf_counter()
+        stored_hashes = {row[0] for row in self._connection().execute("SELECT content_hash FROM invoices")}
+        counts = {"written": 0, "unchanged": 0, "invalid": 0}
+        rows = []
+        customers, keys = set(), set()
+
+        def write():
+            # A re-ingested invoice may have moved from another customer, whose pointers change too
+            customers.update(customer for (customer,) in self._select(
+                "SELECT customer_number FROM invoices WHERE key IN ({})", [row[0] for row in rows]) if customer)
+            for key, _, customer_number, *_ in rows:
+                if customer_number:
+                    customers.add(customer_number)
+                else:
+                    keys.add(key)
+            self._write(rows)
+            counts["written"] += len(rows)
+        for origin, raw in iter_invoices(source, pattern):
+            content_hash = raw_content_hash(raw)
+            # Same check as the ingestion manifest: unchanged invoices are not even parsed
+            if content_hash in stored_hashes and not force:
+                counts["unchanged"] += 1
+                continue
+            try:
+                invoice = loads(raw)
+            except ValueError as e:
+                counts["invalid"] += 1
+                print(f"Error parsing {origin}: {e}")
+                continue
+            invoice_number, customer_number, invoice_date = invoice_columns(invoice)
+            if not invoice_number:
+                counts["invalid"] += 1
+                print(f"Skipping {origin}: no invoice number")
+                continue
+            key = invoice_key(invoice_number)
+            stored_hashes.add(content_hash)
+            # The source text is stored as is; re-serializing the parsed invoice would double the load time
+            rows.append((key, invoice_number, customer_number, invoice_date, content_hash, raw.decode("utf-8").strip()))
+            if len(rows) >= batch_size:
+                write()
+                rows = []
+        if rows:
+            write()
+
+        if counts["written"] and summaries:
+            self.materialize_summaries(customers, keys)
+        print(f"✅ Loaded {counts['written']} invoices into {self.path} in {time.perf_counter() - started:.1f}s "
+              f"({counts['unchanged']} unchanged, {counts['invalid']} invalid)")
+        return counts
+
+    def _select(self, query: str, values: List[Any], chunk_size: int = 500) -> List[tuple]:
+        """Run ``query`` with its ``IN ({})`` filled in for ``values``, in chunks below SQLite's parameter limit"""
+        conn = self._connection()
+        result = []
+        for start in range(0, len(values), chunk_size):
+            chunk = values[start:start + chunk_size]
+            result.extend(conn.execute(query.format(", ".join("?" * len(chunk))), chunk).fetchall())
+        return result
+
+    def materialize_summaries(self, customers: Optional[Iterable[str]] = None, keys: Iterable[str] = ()) -> int:
+        """Rewrite the summary documents (with previous-invoice pointers) whose content changed.
+
+        With ``customers`` only their invoices (plus ``keys``) are summarized: previous-invoice
+        pointers never cross customers, so no other summary can change.
+        """
+        conn = self._connection()
+        if customers is None:
+            rows = conn.execute("SELECT key, content_hash, data FROM invoices").fetchall()
+        else:
+            rows = self._select("SELECT key, content_hash, data FROM invoices WHERE customer_number IN ({})",
+                                list(customers))
+            rows += self._select("SELECT key, content_hash, data FROM invoices WHERE key IN ({})", list(keys))
+        invoices = {key: {**loads(data), "content_hash": content_hash} for key, content_hash, data in rows}
+        existing = dict(self._select("SELECT key, data FROM invoice_summaries WHERE key IN ({})", list(invoices)))
+        summary_rows = []
+        for key, document in build_summary_documents(invoices).items():
+            data = json.dumps(document, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+            if existing.get(key) != data:
+                summary_rows.append((key, data))
+        if summary_rows:
+            self._write((), summary_rows)
+        print(f"✅ Materialized {len(summary_rows)} of {len(invoices)} invoice summaries")
+        return len(summary_rows)
+
+    def stats(self) -> dict:
+        conn = self._connection()
+        invoices, customers = conn.execute("SELECT COUNT(*), COUNT(DISTINCT customer_number) FROM invoices").fetchone()
+        summaries = conn.execute("SELECT COUNT(*) FROM invoice_summaries").fetchone()[0]
+        with self._cache_lock:
+            lookups = self.hits + self.misses
+            cached = len(self._cache)
+            hit_rate = round(self.hits / lookups, 3) if lookups else 0.0
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "invoices": invoices,
+            "customers": customers,
+            "summaries": summaries,
+            "parsed_cached": cached,
+            "parsed_hit_rate": hit_rate
+        }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load invoices into the local SQLite invoice store")
+    parser.add_argument("source", help="directory of invoice JSON files or an NDJSON file")
+    parser.add_argument("--pattern", default="*.json", help="file pattern inside a source directory")
+    parser.add_argument("--db", help=f"SQLite file (INVOICE_SQLITE_PATH, {DEFAULT_PATH})")
+    parser.add_argument("--batch-size", type=int, help="invoices per transaction (INGEST_BATCH_SIZE, 500)")
+    parser.add_argument("--force", action="store_true", help="rewrite invoices even if unchanged")
+    parser.add_argument("--no-summaries", action="store_true", help="do not refresh the invoice summaries afterwards")
+    args = parser.parse_args(argv)
+
+    SQLiteInvoiceStore(args.db).load(args.source, pattern=args.pattern, batch_size=args.batch_size,
+                                     force=args.force, summaries=not args.no_summaries)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
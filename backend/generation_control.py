@@ -0,0 +1,301 @@
+# generation_control.py
+
+import json
+import os
+import re
+import threading
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+# Markers of text the model should not generate: the start of a new prompt turn...
+STOP_SEQUENCES = ("\nQUERY:", "\nQuery:", "\nCUSTOMER:", "\nResponse:", "\nAntwort:", "\nUser:", "\n\n\n")
+# ...and closing pleasantries; a footer, if any, is appended by code instead
+FOOTER_MARKERS = (
+    "Was this helpful", "Was this answer helpful", "Is there anything else", "I hope this helps",
+    "Let me know if", "Feel free to ask", "War das hilfreich", "War diese Antwort hilfreich",
+    "Gibt es noch etwas", "Ich hoffe, das hilft", "Lassen Sie mich wissen"
+)
+FOOTERS = {
+    "en": "Was this helpful? Ask me anything else about your bill.",
+    "de": "War das hilfreich? Fragen Sie mich gerne alles Weitere zu Ihrer Rechnung."
+}
+# Sentence limits matching the RESPONSE STYLE instruction of each conciseness level
+MAX_SENTENCES = {"brief": 2, "moderate": 4, "detailed": None}
+DEFAULT_MAX_TOKENS = {"brief": 300, "moderate": 600, "detailed": 1200}
+
+# "15. März", "am 1. des Monats": a number with a period before a month or a lowercase word is an ordinal
+MONTH_ABBREVIATIONS = {"jan", "feb", "mär", "apr", "jun", "jul", "aug", "sep", "sept", "okt", "nov", "dez"}
+GERMAN_MONTHS = {"januar", "jänner", "februar", "märz", "april", "mai", "juni", "juli", "august", "september",
+                 "oktober", "november", "dezember"} | MONTH_ABBREVIATIONS
+ABBREVIATIONS = {"mr.", "ms.", "mrs.", "dr.", "nr.", "ca.", "bzw.", "inkl.", "ggf.", "usw.", "etc.", "vs.",
+                 "z.b.", "d.h.", "e.g.", "i.e.", "zzgl.", "evtl."} | {month + "." for month in MONTH_ABBREVIATIONS}
+SENTENCE_END = re.compile(r"[.!?](?=\s)")
+NEXT_WORD = re.compile(r"\s+(\w+)(\W)?")
+
+DEFAULT_LENGTH_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", ".generation_lengths.ndjson")
+
+def budget_level(max_tokens: int) -> str:
+    """The conciseness level a token budget belongs to: the shortest whose static limit covers it"""
+    for level, limit in sorted(DEFAULT_MAX_TOKENS.items(), key=lambda item: item[1]):
+        if max_tokens <= limit:
+            return level
+    return "detailed"
+
+def server_stop_sequences() -> List[str]:
+    """Stop strings for runtimes that check them while decoding"""
+    return list(STOP_SEQUENCES) + list(FOOTER_MARKERS)
+
+class GenerationController:
+    """Decides when an answer is complete while it is being generated.
+
+    Used as the GPT4All-style ``callback`` (returning False stops decoding) or
+    fed streamed tokens; stops at a stop sequence, at a closing pleasantry
+    and, for brief and moderate answers, at the sentence boundary after the
+    last allowed sentence. ``finish`` applies the same cuts to a full text,
+    for runtimes that do not report tokens, and appends the footer.
+    """
+
+    def __init__(self, max_tokens: int, max_sentences: Optional[int] = None, language: str = "en",
+                 footer: bool = None):
+        self.max_tokens = max_tokens
+        self.max_sentences = max_sentences
+        self.language = language
+        self.footer = footer if footer is not None else os.getenv("LLM_RESPONSE_FOOTER", "false").lower() == "true"
+        self.text = ""
+        self.tokens = 0
+        self.stop_reason: Optional[str] = None
+        self._emitted = 0
+        self._markers = [marker.lower() for marker in STOP_SEQUENCES + FOOTER_MARKERS]
+        self._longest_marker = max(len(marker) for marker in self._markers)
+        self._marker_prefixes = {marker[:length] for marker in self._markers for length in range(1, len(marker))}
+        self._sentences = 0
+        self._sentence_scan = 0
+        self._undecided: Optional[int] = None  # a "<digits>." that may still turn out to be a date
+        self._marker_scan = 0
+
+    @property
+    def done(self) -> bool:
+        return self.stop_reason is not None
+
+    def __call__(self, token_id: int, token: str) -> bool:
+        self.feed(token)
+        return not self.done
+
+    def _sentence_start(self, end: int) -> int:
+        return max(self.text.rfind(char, 0, end) for char in ".!?\n") + 1
+
+    def _is_ordinal(self, end: int) -> Optional[bool]:
+        """Whether the number ending in the period at ``end`` is an ordinal; None until the next word is complete"""
+        match = NEXT_WORD.match(self.text, end + 1)
+        if match is None:
+            return None
+        word = match.group(1)
+        if word[:1].islower():
+            return True
+        if match.group(2) is None:
+            return None
+        return word.lower() in GERMAN_MONTHS
+
+    def _find_cut(self) -> Tuple[Optional[int], Optional[str]]:
+        # Only the new text, plus enough overlap for a marker split across tokens, is searched
+        lowered = self.text[self._marker_scan:].lower()
+        cut, reason = None, None
+        for marker, original in zip(self._markers, STOP_SEQUENCES + FOOTER_MARKERS):
+            index = lowered.find(marker)
+            if index < 0:
+                continue
+            index += self._marker_scan
+            if cut is not None and index >= cut:
+                continue
+            # Pleasantries are dropped together with the start of their sentence ("Please let me know if...")
+            cut, reason = (index, "stop") if original in STOP_SEQUENCES else (self._sentence_start(index), "footer")
+        self._marker_scan = max(0, len(self.text) - self._longest_marker)
+
+        if self.max_sentences:
+            # A final period is only a boundary once the following whitespace arrives
+            scanned = len(self.text) - 1
+            self._undecided = None
+            for match in SENTENCE_END.finditer(self.text, self._sentence_scan):
+                end = match.start()
+                if cut is not None and end >= cut:
+                    break
+                word_start = max(self.text.rfind(" ", 0, end), self.text.rfind("\n", 0, end)) + 1
+                word = self.text[word_start:end + 1].lower()
+                # Abbreviations and list numbering ("1. ") do not end a sentence
+                if word in ABBREVIATIONS or (word[:-1].isdigit() and (word_start == 0 or self.text[word_start - 1] == "\n")):
+                    continue
+                if word[:-1].isdigit():
+                    ordinal = self._is_ordinal(end)
+                    if ordinal is None:
+                        # Look at this period again once the next word arrived
+                        scanned = self._undecided = end
+                        break
+                    if ordinal:
+                        continue
+                self._sentences += 1
+                if self._sentences >= self.max_sentences:
+                    cut, reason = end + 1, "sentences"
+                    break
+            self._sentence_scan = max(self._sentence_scan, scanned)
+        return cut, reason
+
+    def feed(self, token: str):
+        """Add a generated token and check whether the answer is complete"""
+        if self.done:
+            return
+        self.text += token
+        self.tokens += 1
+        cut, reason = self._find_cut()
+        if cut is not None:
+            # Text already streamed to the client stays shown
+            self.text = self.text[:max(cut, self._emitted)]
+            self.stop_reason = reason
+        elif self.tokens >= self.max_tokens:
+            self.stop_reason = "max_tokens"
+
+    def _held_back(self) -> int:
+        """Length of the tail that could still turn into a marker"""
+        lowered = self.text[-self._longest_marker:].lower()
+        for length in range(len(lowered), 0, -1):
+            if lowered[-length:] in self._marker_prefixes:
+                return length
+        return 0
+
+    def stream(self, tokens: Iterator[str]) -> Iterator[str]:
+        """Relay a token stream, cut where the answer is complete and followed by the footer"""
+        for token in tokens:
+            self.feed(token)
+            # Hold back trailing whitespace and a tail that could still turn into a marker
+            safe = len(self.text) if self.done else len(self.text) - self._held_back()
+            if not self.done and self._undecided is not None:
+                safe = min(safe, self._undecided + 1)
+            safe = len(self.text[:safe].rstrip())
+            if safe > self._emitted:
+                yield self.text[self._emitted:safe]
+                self._emitted = safe
+            if self.done:
+                break
+        else:
+            rest = self.text[self._emitted:].rstrip()
+            self._emitted = len(self.text)
+            if rest:
+                yield rest
+        if self.footer:
+            yield "\n\n" + FOOTERS[self.language]
+
+    def finish(self, text: Optional[str] = None) -> str:
+        """The final answer; ``text`` is the full output of a runtime that never called back"""
+        if text is not None and not self.tokens:
+            # Remote runtimes return text only; about four characters per token
+            self.feed(text)
+            self.tokens = max(1, len(text) // 4)
+            if self.stop_reason == "max_tokens" or (not self.done and self.tokens >= self.max_tokens):
+                self.stop_reason = "max_tokens"
+        answer = self.text.strip()
+        if self.footer and answer:
+            answer += "\n\n" + FOOTERS[self.language]
+        return answer
+
+    @property
+    def truncated(self) -> bool:
+        return self.stop_reason == "max_tokens"
+
+class TokenBudgets:
+    """max_tokens per query type and conciseness level, learned from the lengths of finished answers.
+
+    Until ``min_samples`` answers of a kind were seen the static limit
+    applies; afterwards the budget is the 95th percentile of recent lengths
+    plus ``headroom``, never above the static limit. Lengths are appended
+    to an NDJSON log so the budgets survive restarts.
+    """
+
+    def __init__(self, defaults: Dict[str, int] = None, window: int = None, min_samples: int = None,
+                 headroom: float = None, path: str = None):
+        self.defaults = defaults or DEFAULT_MAX_TOKENS
+        self.window = window or int(os.getenv("LLM_BUDGET_WINDOW", "200"))
+        self.min_samples = min_samples or int(os.getenv("LLM_BUDGET_MIN_SAMPLES", "20"))
+        self.headroom = headroom or float(os.getenv("LLM_BUDGET_HEADROOM", "1.25"))
+        self.path = path if path is not None else os.getenv("LLM_BUDGET_LOG_PATH", DEFAULT_LENGTH_LOG)
+        self.enabled = os.getenv("LLM_ADAPTIVE_BUDGETS", "true").lower() == "true"
+        self._lengths: Dict[Tuple[str, str], Deque[int]] = {}
+        self._budgets: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self.truncated = 0
+        self.observed = 0
+        self._load()
+
+    def _load(self):
+        if not self.enabled or not self.path or not os.path.exists(self.path):
+            return
+        lines = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                        self._add((entry["query_type"], entry["level"]), int(entry["tokens"]))
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except OSError as e:
+            print(f"⚠️ Could not read generation lengths: {e}")
+            return
+        # Keep the log bounded: rewrite it with the retained window once it grew far beyond
+        if lines > 10 * self.window * max(1, len(self._lengths)):
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for (query_type, level), lengths in self._lengths.items():
+                    for tokens in lengths:
+                        f.write(json.dumps({"query_type": query_type, "level": level, "tokens": tokens}) + "\n")
+            os.replace(tmp_path, self.path)
+
+    def _add(self, key: Tuple[str, str], tokens: int):
+        lengths = self._lengths.setdefault(key, deque(maxlen=self.window))
+        lengths.append(tokens)
+        if len(lengths) >= self.min_samples:
+            ordered = sorted(lengths)
+            p95 = ordered[int(0.95 * (len(ordered) - 1))]
+            self._budgets[key] = min(self.defaults[key[1]], max(32, int(p95 * self.headroom) + 8))
+
+    def budget(self, query_type: str, level: str) -> int:
+        default = self.defaults.get(level, self.defaults["moderate"])
+        if not self.enabled:
+            return default
+        with self._lock:
+            return self._budgets.get((query_type, level), default)
+
+    def observe(self, query_type: str, level: str, tokens: int, truncated: bool = False):
+        if not self.enabled or level not in self.defaults or tokens <= 0:
+            return
+        # A truncated answer needed more than it got: count it double so the budget grows back
+        if truncated:
+            tokens = min(self.defaults[level], tokens * 2)
+        with self._lock:
+            self.observed += 1
+            self.truncated += truncated
+            self._add((query_type, level), tokens)
+            if self.path:
+                try:
+                    if self._file is None:
+                        self._file = open(self.path, "a", encoding="utf-8")
+                    self._file.write(json.dumps({"query_type": query_type, "level": level, "tokens": tokens}) + "\n")
+                    self._file.flush()
+                except OSError as e:
+                    print(f"⚠️ Could not log generation length: {e}")
+
+    def close(self):
+        """Close the length log; a later ``observe`` reopens it"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "observed": self.observed,
+                "truncated": self.truncated,
+                "budgets": {f"{query_type}/{level}": budget for (query_type, level), budget in sorted(self._budgets.items())}
+            }
@@ -0,0 +1,182 @@
+# inference_backends.py
+
+import abc
+import json
+import os
+import threading
+import time
+from typing import Callable, Iterator, List, Optional, Protocol, Union
+
+class InferenceBackend(Protocol):
+    """What ModelPool needs from a model: GPT4All's ``generate`` signature plus a prefix-cache flag.
+
+    Runtimes that set ``supports_stop_sequences`` also accept ``stop``, a list
+    of strings that end the generation.
+
+    Implemented by GPT4All itself, ``LlamaCppModel`` and the HTTP backends below.
+    """
+
+    supports_prefix_cache: bool
+
+    def generate(self, prompt: str, max_tokens: int = 200, temp: float = 0.7, streaming: bool = False,
+                 callback: Optional[Callable[[int, str], bool]] = None,
+                 **kwargs) -> Union[str, Iterator[str]]: ...
+
+class HTTPInferenceBackend(abc.ABC):
+    """Inference server client with a GPT4All-compatible ``generate``.
+
+    One instance is shared by all inference workers of a process: it keeps a
+    pooled ``requests.Session`` (keep-alive connections, ``pool_size`` of
+    them), applies connect/read timeouts and retries connection failures and
+    502/503/504 answers with backoff. A prompt that repeats the previous
+    prefix is served from the server's own prompt cache, so the static
+    prompt prefix is worth sending.
+    """
+
+    supports_prefix_cache = True
+    supports_stop_sequences = True
+    path = ""
+
+    def __init__(self, base_url: str, model: str = None, api_key: str = None, timeout: float = None,
+                 connect_timeout: float = None, retries: int = None, pool_size: int = None):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout = (connect_timeout or float(os.getenv("INFERENCE_CONNECT_TIMEOUT_SECONDS", "5")),
+                        timeout or float(os.getenv("INFERENCE_TIMEOUT_SECONDS", "120")))
+        retries = retries if retries is not None else int(os.getenv("INFERENCE_RETRIES", "2"))
+        pool_size = pool_size or int(os.getenv("INFERENCE_POOL_SIZE", "16"))
+
+        retry = Retry(total=retries, connect=retries, read=0, status=retries, backoff_factor=0.5,
+                      status_forcelist=(502, 503, 504), allowed_methods=frozenset({"POST"}),
+                      respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.request_seconds = 0.0
+
+    @abc.abstractmethod
+    def _payload(self, prompt: str, max_tokens: int, temp: float, stream: bool, stop: Optional[List[str]] = None) -> dict:
+        """Request body for the server's completion API"""
+
+    @abc.abstractmethod
+    def _text(self, data: dict) -> str:
+        """Generated text of a response body or of one streamed event"""
+
+    def _post(self, payload: dict, stream: bool):
+        started = time.perf_counter()
+        try:
+            response = self.session.post(self.base_url + self.path, json=payload, timeout=self.timeout, stream=stream)
+            response.raise_for_status()
+            return response
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.requests += 1
+                self.request_seconds += time.perf_counter() - started
+
+    def generate(self, prompt: str, max_tokens: int = 200, temp: float = 0.7, streaming: bool = False,
+                 callback: Optional[Callable[[int, str], bool]] = None, prefix: str = None,
+                 stop: Optional[List[str]] = None):
+        if not streaming:
+            return self._text(self._post(self._payload(prompt, max_tokens, temp, False, stop), False).json())
+        return self._stream(prompt, max_tokens, temp, callback, stop)
+
+    def _stream(self, prompt: str, max_tokens: int, temp: float,
+                callback: Optional[Callable[[int, str], bool]], stop: Optional[List[str]] = None) -> Iterator[str]:
+        response = self._post(self._payload(prompt, max_tokens, temp, True, stop), True)
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                # Server-Sent Events: "data: {...}" lines, OpenAI servers end with "data: [DONE]"
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                text = self._text(json.loads(data))
+                if not text:
+                    continue
+                # Same contract as GPT4All: returning False from the callback stops generation
+                if callback is not None and callback(0, text) is False:
+                    break
+                yield text
+        finally:
+            response.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": type(self).__name__,
+                "url": self.base_url,
+                "requests": self.requests,
+                "errors": self.errors,
+                "avg_request_seconds": round(self.request_seconds / self.requests, 3) if self.requests else 0.0
+            }
+
+class OpenAICompatibleBackend(HTTPInferenceBackend):
+    """Any server exposing the OpenAI ``/v1/completions`` API (vLLM, llama.cpp server, LocalAI, ...)"""
+
+    path = "/v1/completions"
+
+    def _payload(self, prompt: Union[str, List[str]], max_tokens: int, temp: float, stream: bool,
+                 stop: Optional[List[str]] = None) -> dict:
+        payload = {"prompt": prompt, "max_tokens": max_tokens, "temperature": temp, "stream": stream}
+        if self.model:
+            payload["model"] = self.model
+        if stop:
+            payload["stop"] = stop
+        return payload
+
+    def _text(self, data: dict) -> str:
+        choices = data.get("choices") or [{}]
+        return choices[0].get("text") or ""
+
+    def generate_batch(self, prompts: List[str], max_tokens: int = 200, temp: float = 0.7,
+                       stop: Optional[List[str]] = None) -> List[str]:
+        """Several prompts in one request; the server decodes them as one batch"""
+        choices = self._post(self._payload(prompts, max_tokens, temp, False, stop), False).json().get("choices") or []
+        texts = [""] * len(prompts)
+        for position, choice in enumerate(choices):
+            texts[choice.get("index", position)] = choice.get("text") or ""
+        return texts
+
+class LlamaServerBackend(HTTPInferenceBackend):
+    """llama.cpp ``llama-server`` native ``/completion`` API with its prompt cache enabled"""
+
+    path = "/completion"
+
+    def _payload(self, prompt: str, max_tokens: int, temp: float, stream: bool, stop: Optional[List[str]] = None) -> dict:
+        payload = {"prompt": prompt, "n_predict": max_tokens, "temperature": temp, "stream": stream,
+                   "cache_prompt": True}
+        if stop:
+            payload["stop"] = stop
+        return payload
+
+    def _text(self, data: dict) -> str:
+        return data.get("content") or ""
+
+HTTP_BACKENDS = {
+    "openai": OpenAICompatibleBackend,
+    "llama_server": LlamaServerBackend
+}
+
+def create_http_backend(runtime: str) -> HTTPInferenceBackend:
+    """HTTP backend for LLM_RUNTIME=openai or llama_server, configured from INFERENCE_* variables"""
+    return HTTP_BACKENDS[runtime](
+        os.getenv("INFERENCE_URL", "http://127.0.0.1:8001"),
+        model=os.getenv("INFERENCE_MODEL") or None,
+        api_key=os.getenv("INFERENCE_API_KEY") or None
+    )
@@ -0,0 +1,187 @@
+# inference_pool.py
+
+import asyncio
+import functools
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator, List
+
+def inference_workers() -> int:
+    """LLM_INSTANCES; unset, enough workers to fill a micro-batch when the openai runtime batches, else 1"""
+    if os.getenv("LLM_INSTANCES"):
+        return int(os.getenv("LLM_INSTANCES"))
+    if os.getenv("LLM_RUNTIME", "gpt4all") == "openai" and os.getenv("INFERENCE_BATCHING", "true").lower() == "true":
+        return int(os.getenv("INFERENCE_BATCH_MAX_SIZE", "8"))
+    return 1
+
+class InferenceSaturatedError(Exception):
+    """Raised when the admission queue is full and the request is rejected"""
+
+class InferenceTimeoutError(Exception):
+    """Raised when a request does not finish within its deadline"""
+
+class ModelPool:
+    """Fixed set of model instances, each used by at most one thread at a time.
+
+    Exposes the same ``generate`` signature as a single GPT4All model so
+    callers do not need to know how many instances exist.
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int = 1):
+        self.size = max(1, size)
+        self.instances: List[Any] = [factory() for _ in range(self.size)]
+        self._free: "queue.Queue[Any]" = queue.Queue()
+        for instance in self.instances:
+            self._free.put(instance)
+
+    @property
+    def supports_prefix_cache(self) -> bool:
+        return all(getattr(instance, "supports_prefix_cache", False) for instance in self.instances)
+
+    @property
+    def supports_stop_sequences(self) -> bool:
+        return all(getattr(instance, "supports_stop_sequences", False) for instance in self.instances)
+
+    def _prefix_kwargs(self, prefix: str, kwargs: dict) -> dict:
+        # ``prefix`` is a hint for runtimes that cache prompt prefixes; others never see it
+        if prefix is not None and self.supports_prefix_cache:
+            kwargs["prefix"] = prefix
+        # Runtimes without native stop strings rely on the generation callback instead
+        if "stop" in kwargs and not self.supports_stop_sequences:
+            del kwargs["stop"]
+        return kwargs
+
+    def generate(self, prompt: str, prefix: str = None, **kwargs) -> str:
+        instance = self._free.get()
+        try:
+            return instance.generate(prompt, **self._prefix_kwargs(prefix, kwargs))
+        finally:
+            self._free.put(instance)
+
+    def stream(self, prompt: str, prefix: str = None, **kwargs) -> Iterator[str]:
+        """Stream tokens; the instance stays checked out until the stream ends"""
+        instance = self._free.get()
+        try:
+            yield from instance.generate(prompt, streaming=True, **self._prefix_kwargs(prefix, kwargs))
+        finally:
+            self._free.put(instance)
+
+    def available(self) -> int:
+        return self._free.qsize()
+
+class InferencePool:
+    """Dedicated executor for blocking inference with admission control.
+
+    At most ``workers`` requests run at once and at most ``max_queue_depth``
+    more wait for a worker; anything beyond that is rejected immediately so
+    the event loop and the lightweight endpoints stay responsive.
+    """
+
+    def __init__(self, workers: int = None, max_queue_depth: int = None, timeout: float = None):
+        self.workers = workers or inference_workers()
+        self.max_queue_depth = max_queue_depth if max_queue_depth is not None else int(os.getenv("LLM_QUEUE_DEPTH", "8"))
+        self.timeout = timeout or float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.completed = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.max_queue_depth
+
+    def _admit(self):
+        with self._lock:
+            if self._admitted >= self.capacity:
+                self.rejected += 1
+                raise InferenceSaturatedError(f"Inference queue full ({self._admitted}/{self.capacity})")
+            self._admitted += 1
+
+    def _release(self, _future):
+        with self._lock:
+            self._admitted -= 1
+            self.completed += 1
+
+    async def run(self, fn: Callable, *args, timeout: float = None, **kwargs):
+        """Run ``fn`` on the inference executor, enforcing queue depth and deadline"""
+        self._admit()
+
+        # Slots are released when the work actually finishes, not when the caller
+        # gives up, so a timed-out generation still counts against capacity.
+        future = self.executor.submit(functools.partial(fn, *args, **kwargs))
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            raise InferenceTimeoutError(f"Inference did not finish within {timeout or self.timeout:.0f}s")
+
+    def stream(self, fn: Callable[..., Iterator[Any]], *args, timeout: float = None, **kwargs) -> AsyncIterator[Any]:
+        """Run the blocking iterator returned by ``fn`` on the executor and relay its items.
+
+        Admission happens immediately (so saturation is reported before any
+        response bytes are sent); ``fn`` receives a ``callback`` that tells the
+        model to stop once the consumer goes away.
+        """
+        self._admit()
+        loop = asyncio.get_running_loop()
+        items: "asyncio.Queue[Any]" = asyncio.Queue()
+        cancelled = threading.Event()
+        end = object()
+
+        def pump():
+            try:
+                for item in fn(*args, callback=lambda *_: not cancelled.is_set(), **kwargs):
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(items.put_nowait, item)
+            except Exception as e:
+                loop.call_soon_threadsafe(items.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(items.put_nowait, end)
+
+        future = self.executor.submit(pump)
+        future.add_done_callback(self._release)
+        deadline = loop.time() + (timeout or self.timeout)
+
+        async def relay():
+            try:
+                while True:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError
+                    item = await asyncio.wait_for(items.get(), remaining)
+                    if item is end:
+                        return
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            except asyncio.TimeoutError:
+                with self._lock:
+                    self.timed_out += 1
+                raise InferenceTimeoutError(f"Inference did not finish within {timeout or self.timeout:.0f}s")
+            finally:
+                cancelled.set()
+
+        return relay()
+
+    def stats(self) -> dict:
+        with self._lock:
+            admitted = self._admitted
+        return {
+            "workers": self.workers,
+            "max_queue_depth": self.max_queue_depth,
+            "in_flight": min(admitted, self.workers),
+            "queued": max(0, admitted - self.workers),
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "completed": self.completed
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
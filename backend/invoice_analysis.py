@@ -0,0 +1,479 @@
+# invoice_analysis.py
+
+import bisect
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict, fields
+from datetime import datetime
+from typing import Callable, Dict, Any, Iterable, Tuple, List, Optional, Union
+
+from invoice_models import BusinessPartner, Invoice, partner_element
+
+# Bump when InvoiceSummary or the document layout changes; older documents are then ignored
+SUMMARY_SCHEMA_VERSION = 1
+
+LEVY_NAMES = ("KWKG-Umlage", "Offshore-Netzumlage", "Konzessionsabgabe", "NEV-Umlage",
+              "Stromsteuer", "Netznutzung", "Messstellenbetrieb")
+
+def invoice_content_hash(invoice: Dict[str, Any]) -> str:
+    """Stable hash of an invoice's content; changes whenever any field changes"""
+    return hashlib.blake2b(json.dumps(invoice, sort_keys=True, default=str).encode("utf-8"), digest_size=12).hexdigest()
+
+def stored_content_hash(entry: Dict[str, Any]) -> Optional[str]:
+    """Hash recorded next to ``Data`` when the invoice was stored (ingestion, SQLite store), if any.
+
+    Only trust it for invoices read from the store: it is not checked against the content.
+    """
+    value = entry.get("content_hash") if isinstance(entry, dict) else None
+    return value if isinstance(value, str) and value else None
+
+def parse_invoice_date(value: str) -> Optional[datetime]:
+    """Parse an invoiceDate; the source systems emit both 15.04.2025 and 2025-04-15"""
+    for date_format in ("%d.%m.%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, date_format)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+@dataclass(frozen=True, slots=True)
+class InvoiceSummary:
+    """Everything the chat path reads from an invoice, computed in one pass.
+
+    Shared between requests through the summary cache: treat the dict and
+    list fields as read-only.
+    """
+    invoice_number: str
+    invoice_date: str
+    invoice_amount: float
+    net_amount: float
+    tax_amount: float
+    bonus_amount: float
+    total_consumption: float
+    period_from: str
+    period_to: str
+    working_price_details: Dict[str, Any]
+    base_price_net: float
+    base_price_gross: float
+    levies: Dict[str, float]
+    cost_breakdown: Dict[str, Any]
+    unusual_charges: List[Dict[str, Any]]
+
+def summarize_invoice(invoice_data: Union[Dict[str, Any], Invoice]) -> InvoiceSummary:
+    """Walk the invoice once and derive all figures the analyzer exposes"""
+    invoice = invoice_data if isinstance(invoice_data, Invoice) else Invoice.from_data(invoice_data)
+    process = invoice.process
+
+    # Consumption: sum of the meter reading periods, else the process data figure
+    total = 0
+    period_from = ""
+    period_to = ""
+    if invoice.consumption:
+        total = sum(period.consumption for period in invoice.consumption)
+        period_from = invoice.consumption[0].date_from
+        period_to = invoice.consumption[-1].date_to
+    if total == 0:
+        period_from = process.period_from
+        period_to = process.period_to
+        total = process.consumption
+
+    # Single pass over the billing items: working prices, base price, levies, unusual charges
+    working_prices = []
+    base_price_net = None
+    levies = dict.fromkeys(LEVY_NAMES, 0)
+    unusual_charges = []
+    for item in invoice.billing_items:
+        if item.price_type == "USAGE_RATE" and item.name == "Arbeit":
+            price_ct = item.price  # This is in ct/kWh
+            working_prices.append({
+                "period": f"{item.date_from} - {item.date_to}",
+                "price_ct_per_kwh": price_ct,
+                "price_euro_per_kwh": price_ct / 100,
+                "date_from": item.date_from,
+                "date_to": item.date_to
+            })
+        elif item.price_type == "BASIC_RATE":
+            if base_price_net is None and item.name == "Grundkosten":
+                base_price_net = item.amount
+            if item.amount > 100:
+                unusual_charges.append({
+                    "type": "high_basic_charge",
+                    "amount": item.amount,
+                    "explanation": "Higher than typical basic charge"
+                })
+
+        for detail in item.details:
+            # Usage-based charges scale with the total consumption
+            if detail.price_type == "USAGE_RATE" and total > 0:
+                amount = (detail.price / 100) * total
+                if "KWKG" in detail.name:
+                    levies["KWKG-Umlage"] += amount
+                elif "Offshore" in detail.name:
+                    levies["Offshore-Netzumlage"] += amount
+                elif "Konzessionsabgabe" in detail.name:
+                    levies["Konzessionsabgabe"] += amount
+                elif "NEV" in detail.name:
+                    levies["NEV-Umlage"] += amount
+                elif "Stromsteuer" in detail.name:
+                    levies["Stromsteuer"] += amount
+                elif detail.type == "GRID_USAGE":
+                    levies["Netznutzung"] += amount
+            elif detail.price_type == "BASIC_RATE":
+                if detail.type == "GRID_USAGE":
+                    levies["Netznutzung"] += detail.price
+                elif detail.type == "METERING_POINT_OPERATION":
+                    levies["Messstellenbetrieb"] += detail.price
+
+    if total == 0:
+        unusual_charges.append({
+            "type": "zero_consumption_bill",
+            "explanation": "This is a setup/initial bill with zero consumption"
+        })
+
+    current_tariff_price = process.current_work_price / 100  # Convert ct to €
+    working_price_details = {
+        "current_tariff_ct_per_kwh": current_tariff_price * 100,
+        "main_price_ct_per_kwh": working_prices[0]["price_ct_per_kwh"] if working_prices else current_tariff_price * 100,
+        "billed_periods": working_prices,
+        "has_multiple_periods": len(working_prices) > 1
+    }
+
+    return InvoiceSummary(
+        invoice_number=process.invoice_number,
+        invoice_date=process.invoice_date,
+        invoice_amount=process.invoice_amount,
+        net_amount=process.net_amount,
+        tax_amount=process.tax_amount,
+        bonus_amount=process.bonus,
+        total_consumption=total,
+        period_from=period_from,
+        period_to=period_to,
+        working_price_details=working_price_details,
+        base_price_net=base_price_net or 0,
+        base_price_gross=process.current_base_price,
+        levies=levies,
+        cost_breakdown=_cost_breakdown(invoice.cost_blocks, levies, process.invoice_amount, process.net_amount,
+                                       process.tax_amount, process.bonus),
+        unusual_charges=unusual_charges
+    )
+
+def _cost_breakdown(cost_blocks, levies, total_gross, net_amount, tax_amount, bonus_amount) -> Dict[str, Any]:
+    breakdown = {
+        "grid_and_metering": {"amount": 0, "percentage": 0, "components": []},
+        "taxes_and_levies": {"amount": 0, "percentage": 0, "components": []},
+        "energy_supply": {"amount": 0, "percentage": 0, "components": []},
+        "bonuses": {"amount": 0, "components": []}
+    }
+
+    # Try Kostenblock first
+    if cost_blocks:
+        for cost_block in cost_blocks:
+            name, amount, percentage = cost_block.print_item_name, cost_block.amount, cost_block.percentage
+
+            if "Netz" in name or "Messung" in name:
+                breakdown["grid_and_metering"]["amount"] = amount
+                breakdown["grid_and_metering"]["percentage"] = percentage
+            elif "Steuer" in name or "Umlage" in name:
+                breakdown["taxes_and_levies"]["amount"] = amount
+                breakdown["taxes_and_levies"]["percentage"] = percentage
+            elif "Beschaffung" in name or "Vertrieb" in name:
+                breakdown["energy_supply"]["amount"] = amount
+                breakdown["energy_supply"]["percentage"] = percentage
+
+    # Calculate from components if Kostenblock not available
+    else:
+        grid_amount = levies["Netznutzung"] + levies["Messstellenbetrieb"]
+        levy_amount = (levies["KWKG-Umlage"] + levies["Offshore-Netzumlage"] +
+                       levies["Konzessionsabgabe"] + levies["NEV-Umlage"] +
+                       levies["Stromsteuer"] + tax_amount)
+        supply_amount = net_amount - grid_amount - (levy_amount - tax_amount)
+
+        for category, amount in (("grid_and_metering", grid_amount), ("taxes_and_levies", levy_amount),
+                                 ("energy_supply", supply_amount)):
+            breakdown[category]["amount"] = amount
+            breakdown[category]["percentage"] = (amount / total_gross * 100) if total_gross > 0 else 0
+
+    if bonus_amount != 0:
+        breakdown["bonuses"]["amount"] = bonus_amount
+
+    return breakdown
+
+def summary_to_document(summary: InvoiceSummary, content_hash: str, partner: Dict[str, Any],
+                        previous_invoice: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Serializable summary document stored under invoice_summaries/{key}"""
+    document = asdict(summary)
+    document.update({
+        "schema_version": SUMMARY_SCHEMA_VERSION,
+        "content_hash": content_hash,
+        "customer": {
+            "customerNumber": partner.get("customerNumber", ""),
+            "firstName": partner.get("firstName", ""),
+            "name": partner.get("name", ""),
+            "salutation": partner.get("salutation", "")
+        },
+        "previous_invoice": previous_invoice
+    })
+    return document
+
+def summary_from_document(document: Optional[Dict[str, Any]]) -> Optional[InvoiceSummary]:
+    """Rebuild an InvoiceSummary from a stored document; None if it is missing or outdated"""
+    if not document or document.get("schema_version") != SUMMARY_SCHEMA_VERSION:
+        return None
+    # The Realtime Database drops empty lists and dicts, so restore them
+    values = {field.name: document.get(field.name) for field in fields(InvoiceSummary)}
+    working_price_details = dict(values["working_price_details"] or {})
+    working_price_details.setdefault("billed_periods", [])
+    values["working_price_details"] = working_price_details
+    values["levies"] = {**dict.fromkeys(LEVY_NAMES, 0), **(values["levies"] or {})}
+    cost_breakdown = {}
+    for category in ("grid_and_metering", "taxes_and_levies", "energy_supply", "bonuses"):
+        block = {"amount": 0, "components": []}
+        if category != "bonuses":
+            block["percentage"] = 0
+        block.update((values["cost_breakdown"] or {}).get(category) or {})
+        cost_breakdown[category] = block
+    values["cost_breakdown"] = cost_breakdown
+    values["unusual_charges"] = values["unusual_charges"] or []
+    return InvoiceSummary(**values)
+
+def previous_invoice_pointers(invoices: Iterable[Tuple[str, str, str]]) -> Dict[str, Dict[str, str]]:
+    """Previous-invoice pointers for one customer's (key, invoice number, invoice date) entries.
+
+    The previous invoice is the latest one dated before; first and undated invoices get none.
+    """
+    timeline = []
+    for key, invoice_number, invoice_date in invoices:
+        parsed = parse_invoice_date(invoice_date)
+        if parsed:
+            timeline.append((parsed, key, invoice_number, invoice_date))
+    timeline.sort(key=lambda entry: (entry[0], entry[1]))
+    dates = [entry[0] for entry in timeline]
+    pointers = {}
+    for parsed, key, _, _ in timeline:
+        position = bisect.bisect_left(dates, parsed)
+        if position:
+            _, earlier_key, earlier_number, earlier_date = timeline[position - 1]
+            pointers[key] = {"key": earlier_key, "invoice_number": earlier_number, "invoice_date": earlier_date}
+    return pointers
+
+def build_summary_documents(invoices: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Summary documents for raw invoices keyed by database key, with previous-invoice pointers.
+
+    The previous invoice is the customer's latest invoice dated before this one.
+    """
+    entries = []
+    for key, raw_invoice in invoices.items():
+        invoice_data = (raw_invoice or {}).get("Data", {})
+        if not invoice_data:
+            continue
+        summary = summarize_invoice(invoice_data)
+        partner = partner_element(invoice_data)
+        content_hash = stored_content_hash(raw_invoice) or invoice_content_hash(invoice_data)
+        entries.append((key, summary, content_hash, partner))
+
+    by_customer: Dict[str, List[Tuple[str, str, str]]] = {}
+    for key, summary, _, partner in entries:
+        if partner.get("customerNumber"):
+            by_customer.setdefault(partner["customerNumber"], []).append(
+                (key, summary.invoice_number, summary.invoice_date))
+
+    previous = {}
+    for timeline in by_customer.values():
+        previous.update(previous_invoice_pointers(timeline))
+
+    return {
+        key: summary_to_document(summary, content_hash, partner, previous.get(key))
+        for key, summary, content_hash, partner in entries
+    }
+
+class InvoiceSummaryCache:
+    """LRU of invoice summaries keyed by (invoice key, content hash).
+
+    Invoice dicts served by the invoice index are replaced, never mutated, on
+    updates; when a key comes back with the very same dict object the stored
+    content hash is reused, so repeat turns skip hashing as well as parsing.
+    Callers pass the hash recorded at ingestion when they have one, so fresh
+    dicts (query and lookup modes) are not hashed either.
+    """
+
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries or int(os.getenv("INVOICE_SUMMARY_CACHE_SIZE", "1024"))
+        self._entries = OrderedDict()  # (key, content hash) -> (summary, invoice dict)
+        self._latest = {}  # key -> (key, content hash) of the last invoice seen under it
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.loaded = 0
+        # Optional key -> stored summary document lookup, tried before parsing the invoice
+        self.loader: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None
+
+    def _load(self, key: str, content_hash: str) -> Optional[InvoiceSummary]:
+        if not key or self.loader is None:
+            return None
+        try:
+            document = self.loader(key)
+        except Exception as e:
+            print(f"Error loading invoice summary {key}: {e}")
+            return None
+        # A document written for other content (or an older schema) is ignored
+        if not document or document.get("content_hash") != content_hash:
+            return None
+        return summary_from_document(document)
+
+    def known_hash(self, invoice_data: Dict[str, Any], key: Optional[str] = None) -> Optional[str]:
+        """Content hash of the invoice dict last seen under ``key``, if it is this very dict"""
+        with self._lock:
+            cache_key = self._latest.get(key or "")
+            entry = self._entries.get(cache_key) if cache_key else None
+            return cache_key[1] if entry is not None and entry[1] is invoice_data else None
+
+    def get(self, invoice_data: Dict[str, Any], key: Optional[str] = None,
+            content_hash: Optional[str] = None) -> Tuple[InvoiceSummary, str]:
+        """Return the summary and content hash of an invoice, computing the summary on a miss"""
+        key = key or ""
+        with self._lock:
+            cache_key = self._latest.get(key)
+            entry = self._entries.get(cache_key) if cache_key else None
+            if entry is not None and entry[1] is invoice_data and content_hash in (None, cache_key[1]):
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return entry[0], cache_key[1]
+
+        content_hash = content_hash or invoice_content_hash(invoice_data)
+        cache_key = (key, content_hash)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                self._entries[cache_key] = (entry[0], invoice_data)
+                self._entries.move_to_end(cache_key)
+                self._latest[key] = cache_key
+                self.hits += 1
+                return entry[0], content_hash
+            self.misses += 1
+
+        summary = self._load(key, content_hash)
+        if summary is not None:
+            self.loaded += 1
+        else:
+            summary = summarize_invoice(invoice_data)
+        with self._lock:
+            self._entries[cache_key] = (summary, invoice_data)
+            self._latest[key] = cache_key
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                if self._latest.get(evicted[0]) == evicted:
+                    del self._latest[evicted[0]]
+        return summary, content_hash
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "loaded": self.loaded}
+
+summary_cache = InvoiceSummaryCache()
+
+class IntelligentInvoiceAnalyzer:
+    """Advanced invoice analysis with corrected data extraction.
+
+    All figures come from a single-pass ``InvoiceSummary``, shared across
+    requests for the same invoice key and content.
+    """
+
+    def __init__(self, invoice_data: Dict[str, Any], key: Optional[str] = None, content_hash: Optional[str] = None):
+        self.invoice_data = invoice_data
+        self.partner = BusinessPartner.from_dict(partner_element(invoice_data))
+        self.summary, self.content_hash = summary_cache.get(invoice_data, key, content_hash)
+
+    @classmethod
+    def from_summary_document(cls, document: Dict[str, Any]) -> Optional["IntelligentInvoiceAnalyzer"]:
+        """Analyzer backed only by a stored summary document (no raw invoice)"""
+        summary = summary_from_document(document)
+        if summary is None:
+            return None
+        analyzer = cls.__new__(cls)
+        analyzer.invoice_data = {}
+        analyzer.partner = BusinessPartner.from_dict(document.get("customer"))
+        analyzer.summary = summary
+        analyzer.content_hash = document.get("content_hash", "")
+        return analyzer
+
+    def get_total_consumption(self) -> Tuple[float, str, str]:
+        """Get total consumption from AbrechnungsmengenElement - CORRECTED"""
+        return self.summary.total_consumption, self.summary.period_from, self.summary.period_to
+
+    def get_invoice_amount(self) -> float:
+        """Get total invoice amount"""
+        return self.summary.invoice_amount
+
+    def get_bonus_amount(self) -> float:
+        """Get bonus amount applied"""
+        return self.summary.bonus_amount
+
+    def get_tax_amount(self) -> float:
+        """Get tax amount"""
+        return self.summary.tax_amount
+
+    def get_net_amount(self) -> float:
+        """Get net invoice amount"""
+        return self.summary.net_amount
+
+    def get_invoice_date(self) -> str:
+        """Get invoice date"""
+        return self.summary.invoice_date
+
+    def get_invoice_number(self) -> str:
+        """Get invoice number"""
+        return self.summary.invoice_number
+
+    def get_working_price_details(self) -> Dict[str, Any]:
+        """Get working price information from actual billing - SIMPLIFIED"""
+        return self.summary.working_price_details
+
+    def get_base_price(self) -> Tuple[float, float]:
+        """Get base price (Grundpreis) - CORRECTED"""
+        return self.summary.base_price_net, self.summary.base_price_gross
+
+    def get_specific_levy_amounts(self) -> Dict[str, float]:
+        """Calculate actual levy amounts - CORRECTED"""
+        return self.summary.levies
+
+    def is_zero_consumption_bill(self) -> bool:
+        """Check if this is a zero consumption bill"""
+        return self.summary.total_consumption == 0
+
+    def get_detailed_cost_breakdown(self) -> Dict[str, Any]:
+        """Get cost breakdown - CORRECTED"""
+        return self.summary.cost_breakdown
+
+    def analyze_unusual_charges(self) -> List[Dict[str, Any]]:
+        """Identify unusual charges - keeping original logic"""
+        return self.summary.unusual_charges
+
+    def invoice_details(self) -> Dict[str, Any]:
+        """Invoice-level structured data: the same for every question about this invoice"""
+        total_consumption, period_from, period_to = self.get_total_consumption()
+        working_price_details = self.get_working_price_details()
+        base_price_net, base_price_gross = self.get_base_price()
+        return {
+            "customer_name": self.partner.first_name + " " + self.partner.name,
+            "salutation": self.partner.salutation,
+            "consumption": total_consumption,
+            "consumption_period": f"{period_from} to {period_to}",
+            "invoice_amount": self.get_invoice_amount(),
+            "net_amount": self.get_net_amount(),
+            "tax_amount": self.get_tax_amount(),
+            "bonus": self.get_bonus_amount(),
+            "invoice_number": self.get_invoice_number(),
+            "cost_breakdown": self.get_detailed_cost_breakdown(),
+            "tariff_info": {
+                "working_price_ct_per_kwh": working_price_details['main_price_ct_per_kwh'],
+                "working_price_periods": working_price_details['billed_periods'] if working_price_details['has_multiple_periods'] else None,
+                "base_price_net_per_year": base_price_net,
+                "base_price_gross_per_year": base_price_gross
+            },
+            "specific_levies": self.get_specific_levy_amounts(),
+            "is_zero_consumption": self.is_zero_consumption_bill(),
+            "unusual_charges": self.analyze_unusual_charges()
+        }
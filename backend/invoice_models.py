@@ -0,0 +1,188 @@
+# invoice_models.py
+"""Typed views of the raw invoice JSON.
+
+The source systems nest every block as ``{"<Name>": {"<Name>Element": ...}}``,
+where the element is a dict or a list of dicts, and send numbers as strings.
+``Invoice.from_data`` walks that structure once: elements are normalized to
+tuples, numeric strings become floats and missing text becomes "". The raw
+dicts stay the stored and hashed format; the models carry only the fields
+the analysis reads, in slotted, frozen dataclasses.
+
+``loads`` is orjson's decoder when orjson is installed, else ``json.loads``.
+"""
+
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple, Union
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+def _elements(node: Any, name: str) -> List[Dict[str, Any]]:
+    """``node[name][name + "Element"]`` as a list, whether it is a list, a single dict or missing"""
+    element = ((node or {}).get(name) or {}).get(name + "Element")
+    if isinstance(element, list):
+        return [item for item in element if isinstance(item, dict)]
+    return [element] if isinstance(element, dict) else []
+
+def _number(value: Any) -> float:
+    if value is None or value == "":
+        return 0.0
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+def _text(value: Any) -> str:
+    return "" if value is None else str(value)
+
+def process_element(invoice: Dict[str, Any]) -> Dict[str, Any]:
+    """The ProzessDatenElement of a raw invoice entry or of its ``Data`` node (list or dict variant)"""
+    invoice = invoice or {}
+    data = invoice.get("Data", invoice) if isinstance(invoice, dict) else {}
+    elements = _elements(data, "ProzessDaten")
+    return elements[0] if elements else {}
+
+def partner_element(invoice: Dict[str, Any]) -> Dict[str, Any]:
+    """The GeschaeftspartnerElement of a raw invoice entry or of its ``Data`` node"""
+    elements = _elements(process_element(invoice), "Geschaeftspartner")
+    return elements[0] if elements else {}
+
+@dataclass(frozen=True, slots=True)
+class BusinessPartner:
+    customer_number: str = ""
+    salutation: str = ""
+    first_name: str = ""
+    name: str = ""
+    date_of_birth: str = ""
+
+    @classmethod
+    def from_dict(cls, raw: Dict[str, Any]) -> "BusinessPartner":
+        """From a GeschaeftspartnerElement, or the customer block of a summary document (same keys)"""
+        raw = raw or {}
+        return cls(
+            customer_number=_text(raw.get("customerNumber")),
+            salutation=_text(raw.get("salutation")),
+            first_name=_text(raw.get("firstName")),
+            name=_text(raw.get("name")),
+            date_of_birth=_text(raw.get("dateOfBirth"))
+        )
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.first_name} {self.name}".strip()
+
+@dataclass(frozen=True, slots=True)
+class ProcessData:
+    invoice_number: str
+    invoice_date: str
+    invoice_amount: float
+    net_amount: float
+    tax_amount: float
+    bonus: float
+    consumption: float
+    period_from: str
+    period_to: str
+    current_work_price: float  # ct/kWh
+    current_base_price: float
+    partner: BusinessPartner
+
+    @classmethod
+    def from_dict(cls, raw: Dict[str, Any]) -> "ProcessData":
+        partners = _elements(raw, "Geschaeftspartner")
+        return cls(
+            invoice_number=_text(raw.get("invoiceNumber")),
+            invoice_date=_text(raw.get("invoiceDate")),
+            invoice_amount=_number(raw.get("invoiceAmount")),
+            net_amount=_number(raw.get("netInvoiceAmount")),
+            tax_amount=_number(raw.get("taxAmount")),
+            bonus=_number(raw.get("bonus")),
+            consumption=_number(raw.get("consumption")),
+            period_from=_text(raw.get("invoicePeriodFrom")),
+            period_to=_text(raw.get("invoicePeriodTo")),
+            current_work_price=_number(raw.get("currentWorkPrice")),
+            current_base_price=_number(raw.get("currentBasePrice")),
+            partner=BusinessPartner.from_dict(partners[0] if partners else {})
+        )
+
+@dataclass(frozen=True, slots=True)
+class ConsumptionPeriod:
+    date_from: str
+    date_to: str
+    consumption: float
+
+@dataclass(frozen=True, slots=True)
+class BillingDetail:
+    name: str
+    type: str
+    price_type: str
+    price: float
+
+@dataclass(frozen=True, slots=True)
+class BillingItem:
+    name: str
+    price_type: str
+    price: float
+    amount: float
+    date_from: str
+    date_to: str
+    details: Tuple[BillingDetail, ...]
+
+    @classmethod
+    def from_dict(cls, raw: Dict[str, Any]) -> "BillingItem":
+        return cls(
+            name=_text(raw.get("name")),
+            price_type=_text(raw.get("priceType")),
+            price=_number(raw.get("price")),
+            amount=_number(raw.get("amount")),
+            date_from=_text(raw.get("dateFrom")),
+            date_to=_text(raw.get("dateTo")),
+            details=tuple(
+                BillingDetail(_text(detail.get("name")), _text(detail.get("type")), _text(detail.get("priceType")),
+                              _number(detail.get("price")))
+                for detail in _elements(raw, "Abrechnungspositionen-Detailliert")
+            )
+        )
+
+@dataclass(frozen=True, slots=True)
+class CostBlock:
+    print_item_name: str
+    amount: float
+    percentage: float
+
+@dataclass(frozen=True, slots=True)
+class Invoice:
+    process: ProcessData
+    consumption: Tuple[ConsumptionPeriod, ...]
+    billing_items: Tuple[BillingItem, ...]
+    cost_blocks: Tuple[CostBlock, ...]
+
+    @classmethod
+    def from_data(cls, invoice_data: Dict[str, Any]) -> "Invoice":
+        """From the ``Data`` node of a raw invoice"""
+        processes = _elements(invoice_data, "ProzessDaten")
+        return cls(
+            process=ProcessData.from_dict(processes[0] if processes else {}),
+            consumption=tuple(
+                ConsumptionPeriod(_text(item.get("dateFrom")), _text(item.get("dateTo")), _number(item.get("consumption")))
+                for item in _elements(invoice_data, "Abrechnungsmengen")
+            ),
+            billing_items=tuple(BillingItem.from_dict(item) for item in _elements(invoice_data, "Abrechnungspositionen")),
+            cost_blocks=tuple(
+                CostBlock(_text(block.get("printItemName")), _number(block.get("amount")),
+                          _number(block.get("percentageAmount")))
+                for block in _elements(invoice_data, "Kostenblock")
+            )
+        )
+
+    @classmethod
+    def from_entry(cls, entry: Dict[str, Any]) -> "Invoice":
+        """From a raw invoice entry (``{"Data": ...}``)"""
+        return cls.from_data((entry or {}).get("Data") or {})
+
+def decode_invoice(raw: Union[bytes, str]) -> Invoice:
+    """Decode an invoice's JSON straight into the typed model"""
+    return Invoice.from_entry(loads(raw))
@@ -0,0 +1,181 @@
+# invoice_timeline.py
+
+import bisect
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from invoice_analysis import InvoiceSummary, parse_invoice_date, stored_content_hash, summary_cache
+
+@dataclass(frozen=True, slots=True)
+class TimelineEntry:
+    date: datetime
+    key: str
+    summary: InvoiceSummary
+
+def _entry_order(entry: TimelineEntry):
+    return entry.date, entry.key
+
+class CustomerTimeline:
+    """One customer's invoices ordered by invoice date.
+
+    Entries carry the cached ``InvoiceSummary`` of each invoice, so finding
+    the previous bill is a bisect and trends read precomputed figures.
+    ``fetched_keys`` also holds the keys of undated invoices, which have no entry.
+    """
+
+    def __init__(self, customer_number: str, entries: List[TimelineEntry] = (), fetched_keys: Iterable[str] = ()):
+        self.customer_number = customer_number
+        self.entries = sorted(entries, key=_entry_order)
+        self.fetched_keys = set(fetched_keys)
+        self._reindex()
+
+    def _reindex(self):
+        self._dates = [entry.date for entry in self.entries]
+        self._positions = {entry.key: position for position, entry in enumerate(self.entries)}
+
+    @classmethod
+    def from_invoices(cls, customer_number: str, invoices: Dict[str, Dict[str, Any]],
+                      from_store: bool = False) -> "CustomerTimeline":
+        """Build from raw invoices keyed by database key; undated invoices are left out.
+
+        ``from_store``: the invoices were read from the store, so their recorded content hashes are used.
+        """
+        entries = []
+        for key, raw_invoice in (invoices or {}).items():
+            invoice_data = (raw_invoice or {}).get("Data", {})
+            if not invoice_data:
+                continue
+            summary, _ = summary_cache.get(invoice_data, key, stored_content_hash(raw_invoice) if from_store else None)
+            invoice_date = parse_invoice_date(summary.invoice_date)
+            if invoice_date is not None:
+                entries.append(TimelineEntry(invoice_date, key, summary))
+        return cls(customer_number, entries, fetched_keys=(invoices or {}).keys())
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._positions
+
+    def add(self, key: str, summary: InvoiceSummary) -> Optional[TimelineEntry]:
+        """Insert (or replace) one invoice, keeping the date order"""
+        invoice_date = parse_invoice_date(summary.invoice_date)
+        if invoice_date is None:
+            return None
+        if key in self._positions:
+            del self.entries[self._positions[key]]
+        entry = TimelineEntry(invoice_date, key, summary)
+        bisect.insort(self.entries, entry, key=_entry_order)
+        self._reindex()
+        return entry
+
+    def entry(self, key: str) -> Optional[TimelineEntry]:
+        position = self._positions.get(key)
+        return self.entries[position] if position is not None else None
+
+    def previous(self, key: str) -> Optional[TimelineEntry]:
+        """Latest invoice dated strictly before the invoice stored under ``key``"""
+        current = self.entry(key)
+        if current is None:
+            return None
+        position = bisect.bisect_left(self._dates, current.date)
+        return self.entries[position - 1] if position else None
+
+    def nearest(self, date: datetime, tolerance: timedelta) -> Optional[TimelineEntry]:
+        """Invoice dated closest to ``date``, if one lies within ``tolerance``"""
+        position = bisect.bisect_left(self._dates, date)
+        candidates = self.entries[max(position - 1, 0):position + 1]
+        best = min(candidates, key=lambda entry: abs(entry.date - date), default=None)
+        if best is None or abs(best.date - date) > tolerance:
+            return None
+        return best
+
+    def last(self, key: str, periods: int) -> List[TimelineEntry]:
+        """Up to ``periods`` invoices ending with the one stored under ``key``, oldest first"""
+        position = self._positions.get(key)
+        if position is None:
+            return []
+        return self.entries[max(position + 1 - periods, 0):position + 1]
+
+    def year_over_year(self, key: str, tolerance_days: int = 45) -> Optional[TimelineEntry]:
+        """The invoice from about one year before the one stored under ``key``"""
+        current = self.entry(key)
+        if current is None:
+            return None
+        try:
+            year_before = current.date.replace(year=current.date.year - 1)
+        except ValueError:  # 29 February
+            year_before = current.date.replace(year=current.date.year - 1, day=28)
+        found = self.nearest(year_before, timedelta(days=tolerance_days))
+        return found if found is not None and found.key != key else None
+
+    def trend(self, key: str, periods: int = 6) -> Dict[str, Any]:
+        """Amounts and consumption of the last ``periods`` bills up to ``key``"""
+        window = self.last(key, periods)
+        bills = [{
+            "invoice_number": entry.summary.invoice_number,
+            "invoice_date": entry.summary.invoice_date,
+            "amount": entry.summary.invoice_amount,
+            "consumption": entry.summary.total_consumption
+        } for entry in window]
+        trend = {"bills": bills, "periods": len(bills)}
+        if bills:
+            trend["average_amount"] = sum(bill["amount"] for bill in bills) / len(bills)
+            trend["average_consumption"] = sum(bill["consumption"] for bill in bills) / len(bills)
+            trend["amount_change"] = bills[-1]["amount"] - bills[0]["amount"]
+        return trend
+
+class TimelineIndex:
+    """LRU of customer timelines, rebuilt after ``ttl`` seconds or when an unknown invoice shows up.
+
+    A timeline is cached even when it is empty or misses the current
+    invoice's date, so such customers are fetched once per ``ttl`` too.
+    """
+
+    def __init__(self, fetch: Callable[[str], Dict[str, Any]], ttl: float = None, max_customers: int = None):
+        self.fetch = fetch
+        self.ttl = ttl if ttl is not None else float(os.getenv("TIMELINE_TTL_SECONDS", "300"))
+        self.max_customers = max_customers or int(os.getenv("TIMELINE_CACHE_SIZE", "1024"))
+        self._timelines = OrderedDict()  # customer number -> (built at, CustomerTimeline)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.builds = 0
+
+    def get(self, customer_number: str, required_key: Optional[str] = None) -> Optional[CustomerTimeline]:
+        """Timeline of ``customer_number`` that contains ``required_key``, fetching it if needed"""
+        if not customer_number:
+            return None
+        now = time.time()
+        with self._lock:
+            cached = self._timelines.get(customer_number)
+            if cached and now - cached[0] <= self.ttl and (required_key is None or required_key in cached[1].fetched_keys):
+                self._timelines.move_to_end(customer_number)
+                self.hits += 1
+                return cached[1]
+
+        invoices = self.fetch(customer_number)
+        timeline = CustomerTimeline.from_invoices(customer_number, invoices, from_store=True)
+        with self._lock:
+            self._timelines[customer_number] = (now, timeline)
+            self._timelines.move_to_end(customer_number)
+            while len(self._timelines) > self.max_customers:
+                self._timelines.popitem(last=False)
+            self.builds += 1
+        return timeline
+
+    def invalidate(self, customer_number: Optional[str] = None):
+        with self._lock:
+            if customer_number is None:
+                self._timelines.clear()
+            else:
+                self._timelines.pop(customer_number, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"customers": len(self._timelines), "hits": self.hits, "builds": self.builds,
+                    "ttl_seconds": self.ttl}
@@ -0,0 +1,257 @@
+# knowledge_retrieval.py
+
+import math
+import os
+import re
+import unicodedata
+from collections import defaultdict, deque
+from typing import Dict, Iterable, List, Tuple
+
+UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def normalize_text(text: str) -> str:
+    """Lowercase, spell out umlauts (ä -> ae) and strip remaining accents"""
+    text = text.lower().translate(UMLAUTS)
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(normalize_text(text))
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton reporting every (possibly overlapping) keyword in a text"""
+
+    def __init__(self, keywords: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[str]] = [[]]
+        for keyword in keywords:
+            self._add(keyword)
+        self._build_failure_links()
+
+    def _add(self, keyword: str):
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = nxt
+        self._output[state].append(keyword)
+
+    def _build_failure_links(self):
+        # Breadth-first, so every failure target is finished before it is used
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(ch, 0)
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+
+    def find_all(self, text: str) -> set:
+        found = set()
+        state = 0
+        goto, fail, output = self._goto, self._fail, self._output
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+class BM25Index:
+    """Inverted index with Okapi BM25 scoring over tokenized documents"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, candidate_limit: int = 256):
+        self.k1 = k1
+        self.b = b
+        self.candidate_limit = candidate_limit
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        self.doc_tfs: List[Dict[str, int]] = []
+        self.doc_norms: List[float] = []
+        self.idf: Dict[str, float] = {}
+
+    def add(self, tokens: List[str]) -> int:
+        doc_id = len(self.doc_tfs)
+        counts: Dict[str, int] = defaultdict(int)
+        for token in tokens:
+            counts[token] += 1
+        for term in counts:
+            self.postings[term].append(doc_id)
+        self.doc_tfs.append(dict(counts))
+        self.doc_norms.append(len(tokens))
+        return doc_id
+
+    def finalize(self):
+        n = len(self.doc_tfs)
+        avg_length = (sum(self.doc_norms) / n) if n else 1.0
+        # Length normalisation only depends on the document, so fold it in once
+        self.doc_norms = [self.k1 * (1 - self.b + self.b * length / (avg_length or 1.0)) for length in self.doc_norms]
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+        # Impact-ordered postings: the documents a term contributes most to come first
+        for term, docs in self.postings.items():
+            docs.sort(key=lambda doc_id: -self.doc_tfs[doc_id][term] / (self.doc_tfs[doc_id][term] + self.doc_norms[doc_id]))
+
+    def search(self, query_tokens: List[str]) -> Dict[int, Tuple[float, int]]:
+        """Return {doc_id: (bm25 score, number of distinct query terms in the doc)}.
+
+        Candidates are collected from the rarest query terms first, taking
+        the highest-impact postings of each term until ``candidate_limit``
+        documents are found, so common words never walk their (long) posting
+        lists; every candidate is still scored against all query terms.
+        """
+        terms = [term for term in set(query_tokens) if term in self.postings]
+        terms.sort(key=lambda term: len(self.postings[term]))
+        candidates = set()
+        for term in terms:
+            remaining = self.candidate_limit - len(candidates)
+            if remaining <= 0:
+                break
+            candidates.update(self.postings[term][:remaining])
+
+        results = {}
+        k1 = self.k1
+        for doc_id in candidates:
+            tfs = self.doc_tfs[doc_id]
+            norm = self.doc_norms[doc_id]
+            score = 0.0
+            overlap = 0
+            for term in terms:
+                tf = tfs.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (k1 + 1) / (tf + norm)
+                    overlap += 1
+            results[doc_id] = (score, overlap)
+        return results
+
+class KnowledgeRetriever:
+    """Retrieval engine over the knowledge base, built once at load time.
+
+    Holds one BM25 index per language over the ``input_<lang>`` questions
+    and an Aho-Corasick automaton over the category keywords.
+    """
+
+    def __init__(self, categories: Dict[str, List[Dict[str, str]]], category_keywords: Dict[str, List[str]],
+                 languages: Iterable[str] = ("en", "de")):
+        self.items: List[Tuple[str, Dict[str, str]]] = []
+        self.indexes: Dict[str, BM25Index] = {}
+        self.doc_items: Dict[str, List[int]] = {}
+        self.doc_questions: Dict[str, List[str]] = {}
+
+        for category, entries in categories.items():
+            for item in entries:
+                self.items.append((category, item))
+
+        for language in languages:
+            index = BM25Index()
+            doc_items = []
+            doc_questions = []
+            input_key = f"input_{language}"
+            for item_id, (_, item) in enumerate(self.items):
+                if input_key in item:
+                    question = normalize_text(item[input_key])
+                    index.add(TOKEN_PATTERN.findall(question))
+                    doc_items.append(item_id)
+                    doc_questions.append(question)
+            index.finalize()
+            self.indexes[language] = index
+            self.doc_items[language] = doc_items
+            self.doc_questions[language] = doc_questions
+
+        # Category scoring: 2 points per keyword present, 5 for the category name itself
+        self.category_order = list(category_keywords)
+        self._keyword_categories: Dict[str, List[Tuple[str, int]]] = defaultdict(list)
+        for category, keywords in category_keywords.items():
+            for keyword in keywords:
+                self._keyword_categories[normalize_text(keyword)].append((category, 2))
+            self._keyword_categories[normalize_text(category.replace('_', ' '))].append((category, 5))
+        self.category_automaton = KeywordAutomaton(self._keyword_categories)
+
+    def category_for_query(self, query: str, default: str = 'miscellaneous') -> str:
+        scores: Dict[str, int] = defaultdict(int)
+        for keyword in self.category_automaton.find_all(normalize_text(query)):
+            for category, points in self._keyword_categories[keyword]:
+                scores[category] += points
+        if not scores:
+            return default
+        # Ties go to the category listed first, as before
+        return max(self.category_order, key=lambda category: scores.get(category, 0))
+
+    def search(self, query: str, language: str = 'en') -> List[Tuple[str, Dict[str, str], str, float, int]]:
+        """Return (category, item, normalized question, bm25 score, term overlap) for candidate items"""
+        index = self.indexes.get(language)
+        if index is None:
+            return []
+        doc_items = self.doc_items[language]
+        doc_questions = self.doc_questions[language]
+        results = []
+        for doc_id, (score, overlap) in index.search(tokenize(query)).items():
+            category, item = self.items[doc_items[doc_id]]
+            results.append((category, item, doc_questions[doc_id], score, overlap))
+        return results
+
+class EmbeddingIndex:
+    """Dense vector index over the knowledge base questions.
+
+    Every ``input_<lang>`` entry is embedded with a small local
+    sentence-transformers model; the normalized vectors are saved as ``.npy``
+    files keyed by the knowledge base hash and model, and memory-mapped on
+    later starts so they are only recomputed when the knowledge base changes.
+    """
+
+    def __init__(self, retriever: KnowledgeRetriever, kb_hash: str, model_name: str = None, cache_dir: str = None):
+        # Optional dependencies: only needed when KB_RETRIEVAL_BACKEND=embedding
+        import numpy as np
+        from sentence_transformers import SentenceTransformer
+
+        self.np = np
+        self.retriever = retriever
+        self.model_name = model_name or os.getenv("KB_EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+        self.cache_dir = cache_dir or os.getenv(
+            "KB_EMBEDDING_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".kb_cache")
+        )
+        self.model = SentenceTransformer(self.model_name, device="cpu")
+        self.vectors = {}
+
+        model_slug = re.sub(r"[^A-Za-z0-9]+", "_", self.model_name)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for language, doc_items in retriever.doc_items.items():
+            path = os.path.join(self.cache_dir, f"{kb_hash[:16]}_{model_slug}_{language}.npy")
+            if not os.path.exists(path):
+                questions = [retriever.items[item_id][1][f"input_{language}"] for item_id in doc_items]
+                matrix = self.embed(questions) if questions else np.zeros((0, 0), dtype=np.float32)
+                # Write to a temp file first so a crash never leaves a truncated cache behind
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    np.save(f, matrix)
+                os.replace(tmp_path, path)
+            self.vectors[language] = np.load(path, mmap_mode="r")
+
+    def embed(self, texts: List[str]):
+        vectors = self.model.encode(texts, batch_size=64, normalize_embeddings=True, convert_to_numpy=True)
+        return vectors.astype(self.np.float32)
+
+    def search(self, query: str, language: str = 'en', top_k: int = 10) -> List[Tuple[str, Dict[str, str], float]]:
+        """Return (category, item, cosine similarity) for the ``top_k`` closest questions"""
+        matrix = self.vectors.get(language)
+        if matrix is None or not len(matrix):
+            return []
+        np = self.np
+        similarities = matrix @ self.embed([query])[0]
+        top_k = min(top_k, len(similarities))
+        top = np.argpartition(-similarities, top_k - 1)[:top_k]
+        top = top[np.argsort(-similarities[top])]
+        doc_items = self.retriever.doc_items[language]
+        return [(*self.retriever.items[doc_items[doc_id]], float(similarities[doc_id])) for doc_id in top]
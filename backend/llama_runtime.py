@@ -0,0 +1,95 @@
+# llama_runtime.py
+
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, Iterator, List, Optional
+
+class LlamaCppModel:
+    """llama.cpp (llama-cpp-python) model with a GPT4All-compatible ``generate``.
+
+    ``create_completion`` already reuses the tokens at the start of the
+    context that match the new prompt. A snapshot of a prefix's evaluated
+    KV cache is only restored when the context holds something else (another
+    prefix, e.g. the other language), since restoring copies the whole state.
+    """
+
+    supports_prefix_cache = True
+    supports_stop_sequences = True
+
+    def __init__(self, model_path: str, n_ctx: int = None, n_threads: int = None, max_prefixes: int = None,
+                 use_mmap: bool = True, use_mlock: bool = False):
+        # Optional dependency: only needed when LLM_RUNTIME=llama_cpp
+        from llama_cpp import Llama
+
+        self.llm = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx or int(os.getenv("LLM_CONTEXT_SIZE", "4096")),
+            n_threads=n_threads,
+            # Read-only mapping: processes loading the same file share its pages
+            use_mmap=use_mmap,
+            use_mlock=use_mlock,
+            verbose=False
+        )
+        self.max_prefixes = max_prefixes or int(os.getenv("LLM_PREFIX_CACHE_SIZE", "4"))
+        self._prefix_states = OrderedDict()  # prefix -> (prefix tokens, saved state)
+        self.prefix_hits = 0
+        self.prefix_restores = 0
+        self.prefix_misses = 0
+        self.prefix_eval_seconds = 0.0
+
+    def prime_prefix(self, prefix: str):
+        """Make the context start with the evaluated ``prefix``: as it is, from a snapshot, or evaluated now"""
+        cached = self._prefix_states.get(prefix)
+        if cached is not None:
+            tokens, state = cached
+            self._prefix_states.move_to_end(prefix)
+            if self.llm.n_tokens >= len(tokens) and self.llm.input_ids[:len(tokens)].tolist() == tokens:
+                self.prefix_hits += 1
+            else:
+                self.llm.load_state(state)
+                self.prefix_restores += 1
+            return
+
+        started = time.perf_counter()
+        tokens = self.llm.tokenize(prefix.encode("utf-8"), add_bos=True)
+        self.llm.reset()
+        self.llm.eval(tokens)
+        self._prefix_states[prefix] = (tokens, self.llm.save_state())
+        self.prefix_eval_seconds += time.perf_counter() - started
+        self.prefix_misses += 1
+        while len(self._prefix_states) > self.max_prefixes:
+            self._prefix_states.popitem(last=False)
+
+    def generate(self, prompt: str, max_tokens: int = 200, temp: float = 0.7, streaming: bool = False,
+                 callback: Optional[Callable[[int, str], bool]] = None, prefix: str = None,
+                 stop: Optional[List[str]] = None):
+        if prefix and prompt.startswith(prefix):
+            # create_completion reuses the longest matching token prefix already in the context
+            self.prime_prefix(prefix)
+
+        if not streaming:
+            if callback is not None:
+                # Decode token by token so the callback can end the generation early
+                return "".join(self._stream(prompt, max_tokens, temp, callback, stop))
+            result = self.llm.create_completion(prompt, max_tokens=max_tokens, temperature=temp, stop=stop)
+            return result["choices"][0]["text"]
+        return self._stream(prompt, max_tokens, temp, callback, stop)
+
+    def _stream(self, prompt: str, max_tokens: int, temp: float,
+                callback: Optional[Callable[[int, str], bool]], stop: Optional[List[str]] = None) -> Iterator[str]:
+        for chunk in self.llm.create_completion(prompt, max_tokens=max_tokens, temperature=temp, stop=stop, stream=True):
+            text = chunk["choices"][0]["text"]
+            # Same contract as GPT4All: returning False from the callback stops generation
+            if callback is not None and callback(0, text) is False:
+                break
+            yield text
+
+    def stats(self) -> dict:
+        return {
+            "prefix_hits": self.prefix_hits,
+            "prefix_restores": self.prefix_restores,
+            "prefix_misses": self.prefix_misses,
+            "cached_prefixes": len(self._prefix_states),
+            "prefix_eval_seconds": round(self.prefix_eval_seconds, 3)
+        }
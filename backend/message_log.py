@@ -0,0 +1,296 @@
+# message_log.py
+
+import glob
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, Optional, Tuple
+
+PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+DEFAULT_JOURNAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+class PushKeys:
+    """Realtime Database push keys generated locally: chronologically ordered and unique.
+
+    Same scheme as the SDK's ``push()`` (8 characters of milliseconds, 12
+    random ones incremented within the same millisecond), so batched writes
+    sort exactly like pushed ones.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_time = 0
+        self._last_random = [0] * 12
+
+    def next(self) -> str:
+        now = int(time.time() * 1000)
+        with self._lock:
+            if now <= self._last_time:
+                now = self._last_time
+                for i in range(11, -1, -1):
+                    if self._last_random[i] != 63:
+                        self._last_random[i] += 1
+                        break
+                    self._last_random[i] = 0
+            else:
+                self._last_random = [random.randrange(64) for _ in range(12)]
+            self._last_time = now
+            random_part = "".join(PUSH_CHARS[i] for i in self._last_random)
+        time_part = ""
+        for _ in range(8):
+            time_part = PUSH_CHARS[now % 64] + time_part
+            now //= 64
+        return time_part + random_part
+
+def message_log_path(customer_number: Optional[str], invoice_number: Optional[str]) -> Optional[str]:
+    """Database path a chat message is logged under, by customer or else by invoice"""
+    if customer_number:
+        return f"messages/customers/{re.sub(r'[^a-zA-Z0-9_-]', '_', customer_number)}"
+    if invoice_number:
+        return f"messages/invoices/{re.sub(r'[^a-zA-Z0-9_-]', '_', invoice_number)}"
+    return None
+
+def _try_lock(path: str):
+    """Open ``path`` and lock it without waiting; returns the open file, or None if another process holds it.
+
+    The lock goes away with its process, however it ends, so it tells live journals from orphaned ones.
+    """
+    f = open(path, "a+")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+def _release_lock(f):
+    f.close()
+    try:
+        os.remove(f.name)
+    except OSError:
+        # Another process may just have opened it to probe
+        pass
+
+class MessageLogger:
+    """Write-behind buffer for chat message logs.
+
+    ``log`` only queues the message (and appends it to a local journal file
+    when ``journal`` is on) and returns at once; a background thread writes
+    the queue to the database in multi-path updates of up to ``batch_size``
+    messages, at least every ``flush_interval`` seconds. Keys are assigned
+    when queued, so a retried or replayed batch rewrites the same nodes
+    instead of duplicating them. Failed batches stay queued and are retried
+    with exponential backoff; ``close`` drains the queue on shutdown.
+
+    Each process journals to its own file from ``start`` on, holding a lock
+    file next to it while it runs; the journal is emptied whenever the queue
+    has been written. Journals whose lock is free, left behind by a process
+    that died, are taken over and replayed by ``start``.
+    """
+
+    def __init__(self, write: Callable[[Dict[str, dict]], None], batch_size: int = None,
+                 flush_interval: float = None, max_pending: int = None, journal: bool = None,
+                 journal_dir: str = None):
+        self.write = write
+        self.batch_size = batch_size or int(os.getenv("MESSAGE_LOG_BATCH_SIZE", "200"))
+        self.flush_interval = flush_interval or float(os.getenv("MESSAGE_LOG_FLUSH_SECONDS", "2"))
+        self.max_pending = max_pending or int(os.getenv("MESSAGE_LOG_MAX_PENDING", "100000"))
+        self.max_backoff = float(os.getenv("MESSAGE_LOG_MAX_BACKOFF_SECONDS", "60"))
+        self.journaling = journal if journal is not None else os.getenv("MESSAGE_LOG_JOURNAL", "true").lower() == "true"
+        self.journal_dir = journal_dir or os.getenv("MESSAGE_LOG_JOURNAL_DIR", DEFAULT_JOURNAL_DIR)
+        self.journal_path = None
+        self._journal_lock = None
+
+        self.keys = PushKeys()
+        self._pending: Deque[Tuple[str, dict]] = deque()  # (database path incl. key, data)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._journal = None
+        self._journal_lines = 0
+        self._thread: Optional[threading.Thread] = None
+        self._backoff = 0.0
+        self.queued = 0
+        self.written = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.dropped = 0
+        self.replayed = 0
+        self.last_flush_seconds = None
+
+    def _replay_journals(self):
+        """Queue the messages of journals whose process is gone (including a crashed earlier run)"""
+        files = glob.glob(os.path.join(self.journal_dir, ".message_journal-*.ndjson")) + \
+            glob.glob(os.path.join(self.journal_dir, ".message_journal-*.lock"))
+        for base in sorted({os.path.splitext(path)[0] for path in files}):
+            owner_lock = _try_lock(base + ".lock")
+            if owner_lock is None:
+                # Its process is still running (or another starting worker is replaying it)
+                continue
+            path = base + ".ndjson"
+            claimed = f"{path}.replay-{os.getpid()}"
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                # Nothing was journaled, or another worker took it over first
+                _release_lock(owner_lock)
+                continue
+            _release_lock(owner_lock)
+            entries = []
+            with open(claimed, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        entries.append((entry["path"], entry["data"]))
+                    except (ValueError, KeyError):
+                        continue
+            self._enqueue(entries)
+            os.remove(claimed)
+            self.replayed += len(entries)
+        if self.replayed:
+            print(f"📨 Replaying {self.replayed} journaled chat messages")
+
+    def start(self):
+        """Open this process's journal, replay orphaned ones and start writing in the background"""
+        if self._thread is None:
+            if self.journaling:
+                # Named after the serving process, which may be a fork of the one that created the logger
+                self.journal_path = os.path.join(self.journal_dir, f".message_journal-{os.getpid()}.ndjson")
+                self._replay_journals()
+                self._journal_lock = _try_lock(self.journal_path[:-len(".ndjson")] + ".lock")
+            self._thread = threading.Thread(target=self._run, name="message-log", daemon=True)
+            self._thread.start()
+
+    def log(self, path: str, data: dict) -> str:
+        """Queue one message under ``path``; returns its key"""
+        key = self.keys.next()
+        self._enqueue([(f"{path}/{key}", data)])
+        return key
+
+    def log_many(self, messages: Iterable[Tuple[str, dict]]):
+        """Queue several messages at once, e.g. both sides of a chat turn"""
+        self._enqueue([(f"{path}/{self.keys.next()}", data) for path, data in messages])
+
+    def _enqueue(self, entries):
+        with self._lock:
+            # Past max_pending (database unreachable for long) new messages are dropped
+            accepted = max(0, self.max_pending - len(self._pending))
+            if len(entries) > accepted:
+                self.dropped += len(entries) - accepted
+                entries = entries[:accepted]
+            if not entries:
+                return
+            if self.journal_path:
+                try:
+                    if self._journal is None:
+                        self._journal = open(self.journal_path, "a", encoding="utf-8")
+                    self._journal.write("".join(json.dumps({"path": path, "data": data}) + "\n" for path, data in entries))
+                    self._journal.flush()
+                    self._journal_lines += len(entries)
+                except OSError as e:
+                    print(f"⚠️ Could not journal chat messages: {e}")
+            self._pending.extend(entries)
+            self.queued += len(entries)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._backoff:
+                # New messages do not cut a backoff short, only shutdown does
+                self._stop.wait(self._backoff)
+            else:
+                self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            # Full batches are written back to back; a partial one waits for the next interval
+            while self.flush() and len(self._pending) >= self.batch_size:
+                pass
+        while self.flush():
+            pass
+
+    def flush(self) -> bool:
+        """Write one batch; returns False if there was nothing to write or the write failed"""
+        with self._lock:
+            batch = [self._pending[i] for i in range(min(self.batch_size, len(self._pending)))]
+        if not batch:
+            return False
+        started = time.perf_counter()
+        try:
+            self.write(dict(batch))
+        except Exception as e:
+            self.failed_batches += 1
+            self._backoff = min(self.max_backoff, max(1.0, self._backoff * 2))
+            print(f"⚠️ Writing {len(batch)} chat messages failed, retrying in {self._backoff:.1f}s: {e}")
+            return False
+        self._backoff = 0.0
+        self.last_flush_seconds = round(time.perf_counter() - started, 3)
+        with self._lock:
+            for _ in batch:
+                self._pending.popleft()
+            self.written += len(batch)
+            self.batches += 1
+            if self._journal is not None:
+                self._compact_journal()
+        return True
+
+    def _compact_journal(self):
+        if not self._pending:
+            # Everything queued so far is stored: start the journal over
+            self._journal.truncate(0)
+            self._journal_lines = 0
+        elif self._journal_lines > 10 * self.batch_size:
+            # Under constant traffic the queue never empties: rewrite the journal with what is still pending
+            self._journal.close()
+            tmp_path = self.journal_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write("".join(json.dumps({"path": path, "data": data}) + "\n" for path, data in self._pending))
+            os.replace(tmp_path, self.journal_path)
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+            self._journal_lines = len(self._pending)
+
+    def close(self, timeout: float = None):
+        """Stop the background thread after draining the queue"""
+        timeout = timeout if timeout is not None else float(os.getenv("MESSAGE_LOG_DRAIN_SECONDS", "10"))
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._lock:
+            remaining = len(self._pending)
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+                if not remaining:
+                    os.remove(self.journal_path)
+            if self._journal_lock is not None and not remaining:
+                _release_lock(self._journal_lock)
+                self._journal_lock = None
+        if remaining:
+            print(f"⚠️ {remaining} chat messages not written"
+                  + (f", kept in {self.journal_path}" if self.journal_path else ""))
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "queued": self.queued,
+            "written": self.written,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "dropped": self.dropped,
+            "replayed": self.replayed,
+            "last_flush_seconds": self.last_flush_seconds,
+            "journal": self.journal_path
+        }
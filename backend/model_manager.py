@@ -0,0 +1,142 @@
+# model_manager.py
+
+import os
+import threading
+import time
+from typing import Optional
+
+from inference_pool import ModelPool, inference_workers
+
+def memory_usage_mb() -> dict:
+    """Resident memory of this process in MB; on Linux split into anonymous and file-backed pages.
+
+    File-backed resident pages of a memory-mapped GGUF live in the OS page
+    cache and are shared by every process mapping the same file.
+    """
+    usage = {}
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("VmRSS", "RssAnon", "RssFile"):
+                    usage[{"VmRSS": "rss_mb", "RssAnon": "rss_anon_mb", "RssFile": "rss_file_mb"}[name]] = \
+                        round(int(value.split()[0]) / 1024, 1)
+        return usage
+    except OSError:
+        pass
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is the peak, in bytes on macOS and kilobytes elsewhere
+        usage["peak_rss_mb"] = round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        pass
+    return usage
+
+class ModelManager:
+    """Loads the model pool on first use and reports load time and memory.
+
+    The GGUF weights are memory-mapped read-only (``LLM_USE_MMAP``, on by
+    default), so workers on one host share a single copy through the page
+    cache instead of each holding the 4 GB in private memory. ``preload``
+    loads eagerly, e.g. in a ``gunicorn --preload`` master before it forks.
+    """
+
+    def __init__(self, model_path: str, model_name: str, runtime: str = None, instances: int = None):
+        self.model_path = model_path
+        self.model_name = model_name
+        self.runtime = runtime or os.getenv("LLM_RUNTIME", "gpt4all")
+        self.instances = instances or inference_workers()
+        self.use_mmap = os.getenv("LLM_USE_MMAP", "true").lower() == "true"
+        self.use_mlock = os.getenv("LLM_USE_MLOCK", "false").lower() == "true"
+        self._pool: Optional[ModelPool] = None
+        self._lock = threading.Lock()
+        self.load_seconds = None
+        self.load_rss_delta_mb = None
+        self.loaded_in_pid = None
+
+    @property
+    def model_file(self) -> str:
+        return os.path.join(self.model_path, self.model_name)
+
+    @property
+    def loaded(self) -> bool:
+        return self._pool is not None
+
+    @property
+    def is_remote(self) -> bool:
+        return self.runtime in ("openai", "llama_server")
+
+    @property
+    def supports_prefix_cache(self) -> bool:
+        """Known from the runtime, so prompt building never forces a load"""
+        return self.runtime == "llama_cpp" or self.is_remote
+
+    def _factory(self):
+        if self.is_remote:
+            from inference_backends import create_http_backend
+            # One thread-safe client shared by every inference worker; the server does the batching
+            backend = create_http_backend(self.runtime)
+            if hasattr(backend, "generate_batch") and os.getenv("INFERENCE_BATCHING", "true").lower() == "true":
+                from batching import MicroBatcher
+                # Concurrent requests from the workers are coalesced into multi-prompt requests
+                backend = MicroBatcher(backend)
+            return lambda: backend
+
+        # One model instance per inference worker; cores are split between them
+        n_threads = max(1, (os.cpu_count() or 1) // self.instances)
+        if self.runtime == "llama_cpp":
+            from llama_runtime import LlamaCppModel
+            # Same GGUF file, but with KV-cache reuse for the static prompt prefix
+            return lambda: LlamaCppModel(self.model_file, n_threads=n_threads,
+                                         use_mmap=self.use_mmap, use_mlock=self.use_mlock)
+
+        from gpt4all import GPT4All
+        # GPT4All's llama.cpp backend memory-maps the weights itself
+        return lambda: GPT4All(self.model_name, model_path=self.model_path, n_threads=n_threads)
+
+    def get(self) -> ModelPool:
+        """The model pool, loading it on the first call"""
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    rss_before = memory_usage_mb().get("rss_mb")
+                    started = time.perf_counter()
+                    pool = ModelPool(self._factory(), size=self.instances)
+                    self.load_seconds = round(time.perf_counter() - started, 3)
+                    rss_after = memory_usage_mb().get("rss_mb")
+                    if rss_before is not None and rss_after is not None:
+                        self.load_rss_delta_mb = round(rss_after - rss_before, 1)
+                    self.loaded_in_pid = os.getpid()
+                    self._pool = pool
+                    print(f"✅ Loaded {self.instances} x {self.model_name} ({self.runtime}) in {self.load_seconds:.2f}s")
+        return self._pool
+
+    def preload(self) -> ModelPool:
+        return self.get()
+
+    def stats(self) -> dict:
+        try:
+            model_file_mb = round(os.path.getsize(self.model_file) / (1024 * 1024), 1)
+        except OSError:
+            model_file_mb = None
+        backends = []
+        if self._pool is not None:
+            for instance in {id(instance): instance for instance in self._pool.instances}.values():
+                if hasattr(instance, "stats"):
+                    backends.append(instance.stats())
+        return {
+            "runtime": self.runtime,
+            "model": os.getenv("INFERENCE_MODEL") if self.is_remote else self.model_name,
+            "model_file_mb": None if self.is_remote else model_file_mb,
+            "loaded": self.loaded,
+            "instances": self.instances,
+            "use_mmap": self.use_mmap,
+            "load_seconds": self.load_seconds,
+            "load_rss_delta_mb": self.load_rss_delta_mb,
+            # Differs from the current pid when the weights were preloaded before fork
+            "loaded_in_pid": self.loaded_in_pid,
+            "memory": memory_usage_mb(),
+            "backends": backends
+        }
@@ -0,0 +1,193 @@
+# session_store.py
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import List, Optional
+
+class InMemorySessionStore:
+    """Per-session query history kept in process memory.
+
+    Each session holds a ring buffer of its last ``max_history`` queries.
+    Sessions are kept in least-recently-used order, so idle ones expire from
+    the front after ``ttl`` seconds and the oldest are dropped once
+    ``max_sessions`` is reached; memory stays bounded whatever the traffic.
+    """
+
+    def __init__(self, max_history: int = 20, ttl: float = 1800, max_sessions: int = 20000):
+        self.max_history = max_history
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session_id -> (last_seen, deque of queries)
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def _evict(self, now: float):
+        while self._sessions:
+            session_id, (last_seen, _) = next(iter(self._sessions.items()))
+            if now - last_seen <= self.ttl and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+            self.evicted += 1
+
+    def append_query(self, session_id: str, query: str) -> List[str]:
+        """Record a query and return the session history including it"""
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            queries = entry[1] if entry and now - entry[0] <= self.ttl else deque(maxlen=self.max_history)
+            queries.append(query)
+            self._sessions[session_id] = (now, queries)
+            self._evict(now)
+            return list(queries)
+
+    def get_history(self, session_id: str) -> List[str]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                return []
+            return list(entry[1])
+
+    def clear(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": "memory", "sessions": len(self._sessions), "evicted": self.evicted,
+                    "max_sessions": self.max_sessions, "ttl_seconds": self.ttl}
+
+class SQLiteSessionStore:
+    """Session history in a local SQLite file, shared by all workers on one host"""
+
+    def __init__(self, path: str, max_history: int = 20, ttl: float = 1800, max_sessions: int = 20000,
+                 sweep_interval: float = 60):
+        self.max_history = max_history
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, last_seen REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions(last_seen)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_queries ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, query TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS session_queries_session ON session_queries(session_id, id)")
+
+    def _sweep(self, now: float):
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        self._conn.execute("DELETE FROM sessions WHERE last_seen < ?", (now - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM sessions WHERE session_id IN ("
+            "SELECT session_id FROM sessions ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,)
+        )
+        self._conn.execute("DELETE FROM session_queries WHERE session_id NOT IN (SELECT session_id FROM sessions)")
+
+    def append_query(self, session_id: str, query: str) -> List[str]:
+        """Record a query and return the session history including it"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                row = self._conn.execute("SELECT last_seen FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+                if row and now - row[0] > self.ttl:
+                    self._conn.execute("DELETE FROM session_queries WHERE session_id = ?", (session_id,))
+                self._conn.execute(
+                    "INSERT INTO sessions (session_id, last_seen) VALUES (?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET last_seen = excluded.last_seen",
+                    (session_id, now)
+                )
+                self._conn.execute("INSERT INTO session_queries (session_id, query) VALUES (?, ?)", (session_id, query))
+                # Ring buffer: keep only the newest max_history rows of this session
+                self._conn.execute(
+                    "DELETE FROM session_queries WHERE session_id = ? AND id NOT IN ("
+                    "SELECT id FROM session_queries WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                    (session_id, session_id, self.max_history)
+                )
+                self._sweep(now)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return self._history(session_id)
+
+    def _history(self, session_id: str) -> List[str]:
+        rows = self._conn.execute(
+            "SELECT query FROM session_queries WHERE session_id = ? ORDER BY id", (session_id,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_history(self, session_id: str) -> List[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT last_seen FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None or time.time() - row[0] > self.ttl:
+                return []
+            return self._history(session_id)
+
+    def clear(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM session_queries WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            sessions = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return {"backend": "sqlite", "sessions": sessions, "max_sessions": self.max_sessions, "ttl_seconds": self.ttl}
+
+class RedisSessionStore:
+    """Session history in Redis (or any Redis-compatible server) for multi-host deployments.
+
+    Each session is a capped list with a sliding TTL, so Redis expires idle
+    sessions itself; bound the total with the server's maxmemory policy.
+    """
+
+    def __init__(self, url: str, max_history: int = 20, ttl: float = 1800, key_prefix: str = "klarbill:session:"):
+        # Optional dependency: only needed when SESSION_STORE=redis
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.max_history = max_history
+        self.ttl = int(ttl)
+        self.key_prefix = key_prefix
+
+    def append_query(self, session_id: str, query: str) -> List[str]:
+        """Record a query and return the session history including it"""
+        key = self.key_prefix + session_id
+        pipe = self.client.pipeline()
+        pipe.rpush(key, query)
+        pipe.ltrim(key, -self.max_history, -1)
+        pipe.expire(key, self.ttl)
+        pipe.lrange(key, 0, -1)
+        return pipe.execute()[-1]
+
+    def get_history(self, session_id: str) -> List[str]:
+        return self.client.lrange(self.key_prefix + session_id, 0, -1)
+
+    def clear(self, session_id: str):
+        self.client.delete(self.key_prefix + session_id)
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "ttl_seconds": self.ttl}
+
+def create_session_store(backend: Optional[str] = None):
+    """Build the session store selected by SESSION_STORE (memory, sqlite or redis)"""
+    backend = backend or os.getenv("SESSION_STORE", "memory")
+    max_history = int(os.getenv("SESSION_HISTORY", "20"))
+    ttl = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+    max_sessions = int(os.getenv("SESSION_MAX", "20000"))
+
+    if backend == "sqlite":
+        default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions.sqlite3")
+        return SQLiteSessionStore(os.getenv("SESSION_SQLITE_PATH", default_path), max_history, ttl, max_sessions)
+    if backend == "redis":
+        return RedisSessionStore(os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0"), max_history, ttl)
+    return InMemorySessionStore(max_history, ttl, max_sessions)
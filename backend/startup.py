@@ -0,0 +1,133 @@
+# startup.py
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Optional
+
+class StartupPhases:
+    """Timings and status of the startup phases.
+
+    The app boots with the cheap phases only; slow warmups (model load,
+    indexes, ingestion) run on background threads and report here. ``ready``
+    turns true once every required phase is done (or skipped), which is what ``/ready``
+    exposes to load balancers; ``/health`` stays a pure liveness check.
+    """
+
+    def __init__(self, required: Iterable[str] = (), started: Optional[float] = None):
+        self.started = started if started is not None else time.perf_counter()
+        self.required = tuple(required)
+        self._phases: Dict[str, Dict] = OrderedDict((name, {"status": "pending"}) for name in self.required)
+        self._lock = threading.Lock()
+        self.boot_seconds = None
+        self.ready_seconds = None
+
+    def _update(self, name: str, **fields):
+        with self._lock:
+            self._phases[name] = fields
+            if self.ready_seconds is None and self.required and all(
+                    self._phases.get(required, {}).get("status") in ("done", "skipped") for required in self.required):
+                self.ready_seconds = round(time.perf_counter() - self.started, 3)
+                print(f"✅ Ready to serve after {self.ready_seconds:.2f}s")
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time a phase and record whether it succeeded"""
+        self._update(name, status="running")
+        phase_started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self._update(name, status="failed", seconds=round(time.perf_counter() - phase_started, 3), error=str(e))
+            print(f"❌ Startup phase {name} failed: {e}")
+            raise
+        seconds = round(time.perf_counter() - phase_started, 3)
+        self._update(name, status="done", seconds=seconds)
+        print(f"✅ Startup phase {name}: {seconds:.2f}s")
+
+    def skip(self, name: str, reason: str):
+        self._update(name, status="skipped", reason=reason)
+
+    def run_in_background(self, name: str, fn: Callable[[], None]) -> threading.Thread:
+        """Run ``fn`` on a daemon thread; ``fn`` reports its own phases"""
+        def target():
+            try:
+                fn()
+            except Exception as e:
+                print(f"Startup task {name} stopped: {e}")
+
+        thread = threading.Thread(target=target, name=f"startup-{name}", daemon=True)
+        thread.start()
+        return thread
+
+    def mark_booted(self):
+        self.boot_seconds = round(time.perf_counter() - self.started, 3)
+        print(f"✅ App booted in {self.boot_seconds:.2f}s, warming up in the background")
+
+    def status(self, name: str) -> Optional[str]:
+        with self._lock:
+            return self._phases.get(name, {}).get("status")
+
+    def is_done(self, name: str) -> bool:
+        return self.status(name) == "done"
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_seconds is not None
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self.ready_seconds is not None,
+                "boot_seconds": self.boot_seconds,
+                "ready_seconds": self.ready_seconds,
+                "uptime_seconds": round(time.perf_counter() - self.started, 3),
+                "phases": {name: dict(fields) for name, fields in self._phases.items()}
+            }
+
+class LockFile:
+    """Cross-process lock held by creating a file exclusively.
+
+    Used so that only one of several uvicorn workers runs a task. A lock
+    older than ``stale_after`` seconds is assumed to belong to a crashed
+    process and is taken over.
+    """
+
+    def __init__(self, path: str, stale_after: float = None):
+        self.path = path
+        self.stale_after = stale_after if stale_after is not None else float(os.getenv("STARTUP_LOCK_STALE_SECONDS", "3600"))
+        self.held = False
+
+    def acquire(self) -> bool:
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.path) <= self.stale_after:
+                        return False
+                    os.remove(self.path)
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(f"{os.getpid()}\n")
+            self.held = True
+            return True
+        return False
+
+    def release(self):
+        if self.held:
+            self.held = False
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
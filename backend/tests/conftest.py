@@ -0,0 +1,103 @@
+import copy
+import os
+import sys
+
+import pytest
+
+# The backend modules import each other as top-level modules (run from backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def make_invoice(invoice_number, customer_number, invoice_date="15.01.2024"):
+    """Minimal invoice document in the nested shape of the source JSON"""
+    return {"Data": {"ProzessDaten": {"ProzessDatenElement": {
+        "invoiceNumber": invoice_number,
+        "invoiceDate": invoice_date,
+        "invoiceAmount": "100.00",
+        "Geschaeftspartner": {"GeschaeftspartnerElement": {
+            "customerNumber": customer_number, "salutation": "Frau", "name": "Muster"
+        }}
+    }}}}
+
+class FakeReference:
+    """In-memory stand-in for ``firebase_admin.db.Reference``: child, get, order_by_child/equal_to, set, update"""
+
+    def __init__(self, database, parts, order_by=None, equal_to_value=None):
+        self.database = database
+        self.parts = parts
+        self.order_by = order_by
+        self.equal_to_value = equal_to_value
+
+    def child(self, path):
+        return FakeReference(self.database, self.parts + [part for part in path.split("/") if part])
+
+    def _node(self):
+        node = self.database.data
+        for part in self.parts:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def get(self, shallow=False):
+        self.database.reads.append(("/".join(self.parts), shallow))
+        node = self._node()
+        if self.order_by is not None:
+            matches = {}
+            for key, entry in (node or {}).items():
+                value = entry
+                for part in self.order_by.split("/"):
+                    value = value.get(part) if isinstance(value, dict) else None
+                if value == self.equal_to_value:
+                    matches[key] = copy.deepcopy(entry)
+            return matches
+        if shallow and isinstance(node, dict):
+            return {key: True for key in node}
+        return copy.deepcopy(node)
+
+    def order_by_child(self, path):
+        return FakeReference(self.database, self.parts, order_by=path)
+
+    def equal_to(self, value):
+        return FakeReference(self.database, self.parts, self.order_by, value)
+
+    def set(self, value):
+        self.database.write(self.parts, value)
+
+    def update(self, values):
+        for path, value in values.items():
+            self.database.write(self.parts + [part for part in path.split("/") if part], value)
+
+class FakeDatabase:
+    """Realtime Database tree as nested dicts; ``None`` deletes, like the real one"""
+
+    def __init__(self, data=None):
+        self.data = data or {}
+        self.reads = []
+
+    def reference(self, path="/"):
+        return FakeReference(self, [part for part in path.split("/") if part])
+
+    def write(self, parts, value):
+        if not parts:
+            self.data = copy.deepcopy(value) or {}
+            return
+        node = self.data
+        for part in parts[:-1]:
+            if not isinstance(node.get(part), dict):
+                node[part] = {}
+            node = node[part]
+        if value is None:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = copy.deepcopy(value)
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """A FakeDatabase behind ``get_db_reference`` of the database modules"""
+    pytest.importorskip("firebase_admin")
+    from data import firebase_service, ingest_invoices
+    database = FakeDatabase()
+    for module in (firebase_service, ingest_invoices):
+        monkeypatch.setattr(module, "get_db_reference", database.reference)
+    monkeypatch.setattr(firebase_service, "_invoice_index", None)
+    return database
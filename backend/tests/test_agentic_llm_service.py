@@ -0,0 +1,84 @@
+import pytest
+
+from agentic_llm_service import FastPathResponder, QueryType, ResponseCache
+from conftest import make_invoice
+
+def classify(query):
+    return FastPathResponder(enabled=True).classify(query, QueryType.SIMPLE_FACT)
+
+@pytest.mark.parametrize("query", [
+    "Wie kann ich meinen Verbrauch senken?",
+    "Welche Geräte haben den meisten Verbrauch?",
+    "Wie viel CO2 verursacht mein Verbrauch?",
+    "Kann ich den Rechnungsbetrag in Raten zahlen?",
+    "Wie hoch ist die Mehrwertsteuer?",
+    "How can I reduce my usage?",
+])
+def test_advice_and_other_questions_get_no_template(query):
+    assert classify(query) == (None, 0.0)
+
+@pytest.mark.parametrize("query, intent", [
+    ("What is my consumption?", "consumption"),
+    ("Wie viel habe ich verbraucht?", "consumption"),
+    ("How much is my bill?", "amount"),
+    ("Wie hoch ist der Rechnungsbetrag?", "amount"),
+    ("Was ist meine Kundennummer?", "customer_number"),
+    ("Can you show me the breakdown?", "breakdown"),
+])
+def test_plain_fact_questions_get_a_template(query, intent):
+    assert classify(query) == (intent, 0.95)
+
+def test_two_facts_in_one_question_go_to_the_model():
+    intent, confidence = classify("What is my consumption and the total amount?")
+    assert confidence < FastPathResponder().min_confidence
+
+def test_response_cache_matches_rephrasings_of_the_same_question():
+    cache = ResponseCache(similarity_threshold=0.8)
+    cache.put("A1", "v1", "en", "How much did I use?", "simple_fact", "500 kWh")
+    assert cache.get("A1", "v1", "en", "how much did i use", "simple_fact") == "500 kWh"
+    assert cache.get("A1", "v1", "en", "What was my usage?", "simple_fact") == "500 kWh"
+    assert cache.get("A1", "v1", "de", "How much did I use?", "simple_fact") is None
+    assert (cache.hits, cache.near_hits, cache.misses) == (2, 0, 1)
+
+def test_response_cache_near_duplicates_need_the_similarity_threshold():
+    cache = ResponseCache(similarity_threshold=0.75)
+    cache.put("A1", "v1", "en", "Explain the network fees", "explanation", "text")
+    assert cache.get("A1", "v1", "en", "Explain the network fee", "explanation") == "text"
+    # A near-duplicate must also ask for the same kind of answer
+    assert cache.get("A1", "v1", "en", "Explain the network fee", "calculation") is None
+    assert cache.get("A1", "v1", "en", "Explain the meter fees", "explanation") is None
+
+def test_response_cache_forgets_answers_of_a_changed_invoice():
+    cache = ResponseCache()
+    cache.put("A1", "v1", "en", "Explain my bill", "explanation", "old")
+    cache.put("B1", "v1", "en", "Explain my bill", "explanation", "other")
+    assert cache.get("A1", "v2", "en", "Explain my bill", "explanation") is None
+    cache.put("A1", "v2", "en", "Explain my bill", "explanation", "new")
+    assert cache.get("A1", "v2", "en", "Explain my bill", "explanation") == "new"
+    assert cache.get("B1", "v1", "en", "Explain my bill", "explanation") == "other"
+    assert cache.invalidations == 1
+
+def test_response_cache_entries_expire(monkeypatch):
+    import agentic_llm_service
+    now = [1000.0]
+    monkeypatch.setattr(agentic_llm_service.time, "monotonic", lambda: now[0])
+    cache = ResponseCache(ttl_seconds=60)
+    cache.put("A1", "v1", "en", "Explain my bill", "explanation", "text")
+    now[0] += 59
+    assert cache.get("A1", "v1", "en", "Explain my bill", "explanation") == "text"
+    now[0] += 2
+    assert cache.get("A1", "v1", "en", "Explain my bill", "explanation") is None
+    assert cache.stats()["entries"] == 0
+
+def test_comparisons_are_never_answered_from_the_cache(fake_db):
+    from agentic_llm_service import AgenticUtilityBillLLM
+    llm = AgenticUtilityBillLLM(load_model=False)
+    bill_context = {"inv-A1": make_invoice("A1", "C1")}
+
+    prepared = llm.prepare_response("Verglichen mit der letzten Rechnung?", dict(bill_context), language="de")
+    assert prepared["structured"]["query_type"] == "comparison" and prepared["cache_key"] is None
+
+    prepared = llm.prepare_response("Warum kostet das so viel?", dict(bill_context))
+    llm.remember_response(prepared, "Because")
+    again = llm.prepare_response("Warum kostet das so viel?", dict(bill_context))
+    assert again["text"] == "Because" and again["structured"]["response_source"] == "cache"
@@ -0,0 +1,54 @@
+import pytest
+
+from conftest import make_invoice
+
+for module in ("fastapi", "httpx", "dotenv", "requests"):
+    pytest.importorskip(module)
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    # ensure_config writes ../.env relative to the working directory
+    workdir = tmp_path_factory.mktemp("root") / "backend"
+    workdir.mkdir()
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(workdir)
+        import app
+    return app
+
+@pytest.fixture
+def client(app_module, monkeypatch):
+    from fastapi.testclient import TestClient
+    stored = {"inv-A1": make_invoice("A1", "C1")}
+    monkeypatch.setattr(app_module, "get_invoice_by_number",
+                        lambda number: {key: entry for key, entry in stored.items() if number == "A1"})
+    test_client = TestClient(app_module.app)
+    test_client.stored = stored
+    return test_client
+
+def test_select_fields_returns_the_requested_keys(app_module):
+    response = {"response": "text", "structured": {"comparison": {"change": 5}, "consumption": 500}, "query_type": "x"}
+
+    def select(**options):
+        return app_module.select_fields(response, app_module.QueryRequest(message="hi", **options))
+
+    assert select(fields=["response", "structured.comparison", "structured.missing", "missing"]) == {
+        "response": "text", "structured": {"comparison": {"change": 5}}}
+    assert select(slim=True) == {"response": "text", "query_type": "x"}
+    assert select() is response
+
+def test_invoice_details_revalidate_with_the_etag(client):
+    first = client.get("/invoice/A1")
+    assert first.status_code == 200 and first.json()["invoice_number"] == "A1"
+    etag = first.headers["etag"]
+
+    for if_none_match in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        cached = client.get("/invoice/A1", headers={"If-None-Match": if_none_match})
+        assert cached.status_code == 304 and cached.content == b""
+        assert cached.headers["etag"] == etag
+
+    client.stored["inv-A1"] = make_invoice("A1", "C1", "15.02.2024")
+    changed = client.get("/invoice/A1", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+
+def test_unknown_invoice_is_not_found(client):
+    assert client.get("/invoice/B9").status_code == 404
@@ -0,0 +1,53 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from batching import MicroBatcher
+from inference_pool import inference_workers
+
+class FakeBatchBackend:
+    """generate_batch that records each batch and holds the first one until released"""
+
+    def __init__(self):
+        self.batches = []
+        self.first_started = threading.Event()
+        self.release = threading.Event()
+
+    def generate_batch(self, prompts, max_tokens=200, temp=0.7, stop=None):
+        self.batches.append((list(prompts), max_tokens))
+        if len(self.batches) == 1:
+            self.first_started.set()
+            self.release.wait(5)
+        return [prompt.upper() for prompt in prompts]
+
+def test_concurrent_requests_coalesce_while_a_batch_runs():
+    backend = FakeBatchBackend()
+    batcher = MicroBatcher(backend, max_batch_size=8, max_wait_ms=200, concurrency=1)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        first = pool.submit(batcher.generate, "first", max_tokens=100)
+        assert backend.first_started.wait(5)
+        rest = [pool.submit(batcher.generate, f"p{n}", max_tokens=100 + n) for n in range(3)]
+        backend.release.set()
+        assert first.result(5) == "FIRST"
+        assert [future.result(5) for future in rest] == ["P0", "P1", "P2"]
+
+    assert [sorted(prompts) for prompts, _ in backend.batches] == [["first"], ["p0", "p1", "p2"]]
+    # A batch is sent with the largest budget among its requests
+    assert backend.batches[1][1] == 102
+
+def test_different_answer_lengths_are_not_batched_together():
+    backend = FakeBatchBackend()
+    backend.release.set()
+    batcher = MicroBatcher(backend, max_batch_size=8, max_wait_ms=50, concurrency=1)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        list(pool.map(lambda tokens: batcher.generate("p", max_tokens=tokens), [50, 1000]))
+    assert sorted(max_tokens for _, max_tokens in backend.batches) == [50, 1000]
+
+def test_workers_follow_the_batch_size_when_batching(monkeypatch):
+    monkeypatch.delenv("LLM_INSTANCES", raising=False)
+    monkeypatch.setenv("LLM_RUNTIME", "openai")
+    monkeypatch.setenv("INFERENCE_BATCH_MAX_SIZE", "6")
+    assert inference_workers() == 6
+    monkeypatch.setenv("INFERENCE_BATCHING", "false")
+    assert inference_workers() == 1
+    monkeypatch.setenv("LLM_INSTANCES", "3")
+    assert inference_workers() == 3
@@ -0,0 +1,68 @@
+import pytest
+
+from conftest import make_invoice
+
+INVOICES = {
+    "inv-A1": make_invoice("A1", "C1", "15.01.2024"),
+    "inv-A2": make_invoice("A2", "C1", "15.02.2024"),
+    "inv-B1": make_invoice("B1", "C2", "15.01.2024"),
+}
+
+@pytest.fixture
+def stored(fake_db):
+    from data.firebase_service import build_lookup_updates
+    fake_db.data["invoices"] = {key: dict(invoice) for key, invoice in INVOICES.items()}
+    root = fake_db.reference("/")
+    for key, invoice in INVOICES.items():
+        root.update(build_lookup_updates(key, invoice))
+    return fake_db
+
+@pytest.mark.parametrize("mode", ["query", "lookup", "index"])
+def test_lookup_modes_find_invoices(stored, monkeypatch, mode):
+    from data.firebase_service import FirebaseInvoiceStore
+    monkeypatch.setenv("INVOICE_LOOKUP_MODE", mode)
+    monkeypatch.setenv("INVOICE_INDEX_SYNC", "poll")
+    monkeypatch.setenv("INVOICE_INDEX_POLL_SECONDS", "0")
+    store = FirebaseInvoiceStore()
+
+    assert store.get_by_number("A2") == {"inv-A2": INVOICES["inv-A2"]}
+    assert set(store.get_by_customer("C1")) == {"inv-A1", "inv-A2"}
+    assert store.get_by_number("missing") == {}
+    assert store.get_by_customer("missing") == {}
+
+def test_lookup_mode_reads_only_the_lookup_nodes_and_invoices(stored, monkeypatch):
+    from data.firebase_service import FirebaseInvoiceStore
+    monkeypatch.setenv("INVOICE_LOOKUP_MODE", "lookup")
+    FirebaseInvoiceStore().get_by_customer("C1")
+    assert stored.reads == [("invoices_by_customer/C1", True), ("invoices/inv-A1", False), ("invoices/inv-A2", False)]
+
+def test_delta_sync_picks_up_added_changed_and_deleted_invoices(stored):
+    from data.firebase_service import InvoiceIndex, build_lookup_updates
+    index = InvoiceIndex(sync_mode="poll", poll_interval=0).start()
+    root = stored.reference("/")
+    changed = {**make_invoice("A2", "C2", "15.02.2024"), "content_hash": "v2"}
+    root.update({"invoices/inv-A2": changed, **build_lookup_updates("inv-A2", changed),
+                 "invoices/inv-C1": make_invoice("C1", "C1"), "invoices/inv-B1": None})
+
+    index.delta_sync()
+    assert index.get_by_number("A2") == {"inv-A2": changed}
+    assert set(index.get_by_customer("C1")) == {"inv-A1", "inv-C1"}
+    assert index.get_by_number("B1") == {}
+
+def test_nested_patch_keeps_element_lists(stored):
+    from data.firebase_service import InvoiceIndex
+
+    class Event:
+        event_type = "patch"
+        path = "/inv-A1/Data/Positionen/PositionenElement/1"
+        data = {"price": "2.00"}
+
+    index = InvoiceIndex(sync_mode="poll", poll_interval=0)
+    invoice = make_invoice("A1", "C1")
+    invoice["Data"]["Positionen"] = {"PositionenElement": [{"price": "1.00"}, {"price": "1.50"}]}
+    index.load({"inv-A1": invoice})
+    index.apply_event(Event())
+
+    patched = index.get_by_number("A1")["inv-A1"]["Data"]["Positionen"]["PositionenElement"]
+    assert patched == [{"price": "1.00"}, {"price": "2.00"}]
+    assert invoice["Data"]["Positionen"]["PositionenElement"][1] == {"price": "1.50"}
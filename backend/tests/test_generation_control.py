@@ -0,0 +1,49 @@
+from generation_control import GenerationController
+
+def finish(text, max_sentences=2):
+    return GenerationController(max_tokens=1000, max_sentences=max_sentences, language="de", footer=False).finish(text)
+
+def stream(tokens, max_sentences=2):
+    controller = GenerationController(max_tokens=1000, max_sentences=max_sentences, language="de", footer=False)
+    return "".join(controller.stream(iter(tokens))), controller.stop_reason
+
+def test_german_date_is_not_a_sentence_end():
+    text = "Ihre Rechnung vom 15. März 2024 beträgt 80 €. Der Verbrauch lag bei 1200 kWh. Mehr dazu später."
+    assert finish(text) == "Ihre Rechnung vom 15. März 2024 beträgt 80 €. Der Verbrauch lag bei 1200 kWh."
+
+def test_abbreviated_month_and_lowercase_word_follow_ordinals():
+    text = "Der Abschlag ist am 1. Dez. fällig und bis zum 3. des Monats zu zahlen. Danach folgt eine Mahnung. Ende."
+    assert finish(text) == "Der Abschlag ist am 1. Dez. fällig und bis zum 3. des Monats zu zahlen. Danach folgt eine Mahnung."
+
+def test_year_at_the_end_of_a_sentence_still_counts():
+    assert finish("Der Tarif gilt seit 2024. Er ist günstig. Mehr nicht.") == "Der Tarif gilt seit 2024. Er ist günstig."
+
+def test_list_numbering_is_not_a_sentence_end():
+    assert finish("Zwei Punkte:\n1. Der Verbrauch stieg.\n2. Der Preis stieg. Ende.") == \
+        "Zwei Punkte:\n1. Der Verbrauch stieg.\n2. Der Preis stieg."
+
+def test_streamed_month_split_across_tokens():
+    tokens = ["Ab", " dem", " 1", ".", " Feb", "ruar", " steigt", " der", " Preis", ".", " Das", " ist", " alles", ".",
+              " Noch", " mehr", "."]
+    text, reason = stream(tokens)
+    assert text == "Ab dem 1. Februar steigt der Preis. Das ist alles."
+    assert reason == "sentences"
+
+def test_streamed_capitalized_word_after_number_ends_the_sentence():
+    tokens = ["Das", " war", " 2024", ".", " Danach", " kam", " mehr", ".", " Ende", "."]
+    text, reason = stream(tokens, max_sentences=1)
+    assert text == "Das war 2024."
+    assert reason == "sentences"
+
+def test_token_budgets_learn_from_logged_lengths_and_close(tmp_path, monkeypatch):
+    from generation_control import TokenBudgets
+    monkeypatch.setenv("LLM_ADAPTIVE_BUDGETS", "true")
+    path = str(tmp_path / "lengths.ndjson")
+    budgets = TokenBudgets(min_samples=3, headroom=1.0, path=path)
+    for tokens in (40, 50, 60):
+        budgets.observe("simple_fact", "moderate", tokens)
+    budgets.close()
+    assert budgets._file is None
+
+    # A restart reads the lengths back from the log
+    assert TokenBudgets(min_samples=3, headroom=1.0, path=path).budget("simple_fact", "moderate") == 58
@@ -0,0 +1,131 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("requests")
+
+from inference_backends import HTTPInferenceBackend, LlamaServerBackend, OpenAICompatibleBackend
+
+class StubServer:
+    """Inference server stub: records request bodies and answers from a queue of (status, body, events)"""
+
+    def __init__(self):
+        self.requests = []
+        self.replies = []
+        self.disconnected = threading.Event()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.requests.append((self.path, body))
+                status, reply, events = stub.replies.pop(0) if stub.replies else (200, {}, None)
+                if events is None:
+                    data = json.dumps(reply).encode()
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    if status == 503:
+                        self.send_header("Retry-After", "0")
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                self.send_response(status)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                try:
+                    for event in events:
+                        self.wfile.write(f"data: {event if isinstance(event, str) else json.dumps(event)}\n\n".encode())
+                        self.wfile.flush()
+                        threading.Event().wait(0.01)
+                except (BrokenPipeError, ConnectionResetError):
+                    stub.disconnected.set()
+                self.close_connection = True
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+
+    def reply(self, status=200, body=None, events=None):
+        self.replies.append((status, body or {}, events))
+
+@pytest.fixture
+def server():
+    stub = StubServer()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+def test_http_backend_hooks_are_abstract():
+    with pytest.raises(TypeError):
+        HTTPInferenceBackend("http://127.0.0.1:1")
+
+def test_blocking_generation_openai(server):
+    server.reply(body={"choices": [{"index": 0, "text": "Ihr Verbrauch"}]})
+    backend = OpenAICompatibleBackend(server.url, model="mistral")
+    assert backend.generate("prompt", max_tokens=50, temp=0.1, stop=["\nQUERY:"]) == "Ihr Verbrauch"
+    path, body = server.requests[0]
+    assert path == "/v1/completions"
+    assert body == {"prompt": "prompt", "max_tokens": 50, "temperature": 0.1, "stream": False,
+                    "model": "mistral", "stop": ["\nQUERY:"]}
+    assert backend.stats()["requests"] == 1
+
+def test_blocking_generation_llama_server(server):
+    server.reply(body={"content": "Hallo"})
+    backend = LlamaServerBackend(server.url)
+    assert backend.generate("prompt", max_tokens=20) == "Hallo"
+    path, body = server.requests[0]
+    assert path == "/completion"
+    assert body["n_predict"] == 20 and body["cache_prompt"] is True
+
+def test_sse_streaming(server):
+    server.reply(events=[{"choices": [{"text": "Ihr "}]}, {"choices": [{"text": ""}]},
+                         {"choices": [{"text": "Betrag"}]}, "[DONE]", {"choices": [{"text": "ignored"}]}])
+    backend = OpenAICompatibleBackend(server.url)
+    assert list(backend.generate("prompt", streaming=True)) == ["Ihr ", "Betrag"]
+    assert server.requests[0][1]["stream"] is True
+
+def test_callback_false_stops_the_stream(server):
+    server.reply(events=[{"content": f"t{i} "} for i in range(200)])
+    backend = LlamaServerBackend(server.url)
+    seen = []
+
+    def callback(token_id, token):
+        seen.append(token)
+        return len(seen) < 3
+
+    assert list(backend.generate("prompt", streaming=True, callback=callback)) == ["t0 ", "t1 "]
+    assert seen == ["t0 ", "t1 ", "t2 "]
+    # The response is closed, so the server stops writing
+    assert server.disconnected.wait(5)
+
+def test_retries_on_503(server):
+    server.reply(status=503)
+    server.reply(body={"content": "ok"})
+    backend = LlamaServerBackend(server.url, retries=2)
+    assert backend.generate("prompt") == "ok"
+    assert len(server.requests) == 2
+    assert backend.stats()["errors"] == 0
+
+def test_gives_up_after_the_retries(server):
+    for _ in range(3):
+        server.reply(status=503)
+    backend = LlamaServerBackend(server.url, retries=1)
+    with pytest.raises(Exception):
+        backend.generate("prompt")
+    assert len(server.requests) == 2
+    assert backend.stats()["errors"] == 1
+
+def test_generate_batch_orders_choices_by_index(server):
+    server.reply(body={"choices": [{"index": 2, "text": "c"}, {"index": 0, "text": "a"}, {"index": 1, "text": "b"}]})
+    backend = OpenAICompatibleBackend(server.url)
+    assert backend.generate_batch(["p0", "p1", "p2"], max_tokens=300) == ["a", "b", "c"]
+    assert server.requests[0][1]["prompt"] == ["p0", "p1", "p2"]
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from conftest import make_invoice
+
+def write_invoices(directory, invoices):
+    directory.mkdir(exist_ok=True)
+    for invoice in invoices:
+        number = invoice["Data"]["ProzessDaten"]["ProzessDatenElement"]["invoiceNumber"]
+        (directory / f"invoice_{number}.json").write_text(json.dumps(invoice))
+    return str(directory)
+
+@pytest.fixture
+def ingest(fake_db, tmp_path):
+    from data.ingest_invoices import ingest_invoices
+
+    def run(directory, **options):
+        return ingest_invoices(directory, manifest_path=str(tmp_path / "manifest.ndjson"), qr_codes=False, **options)
+    return run
+
+def test_summary_pointers_span_ingestion_runs(fake_db, ingest, tmp_path):
+    from invoice_analysis import build_summary_documents
+    ingest(write_invoices(tmp_path / "first", [make_invoice("A1", "C1", "15.01.2024"),
+                                                make_invoice("A3", "C1", "15.03.2024")]))
+    # A2 falls between the stored invoices, so A3's stored pointer must move to it
+    ingest(write_invoices(tmp_path / "second", [make_invoice("A2", "C1", "15.02.2024")]))
+
+    summaries = fake_db.data["invoice_summaries"]
+    assert summaries["inv-A3"]["previous_invoice"]["key"] == "inv-A2"
+    assert summaries == json.loads(json.dumps(build_summary_documents(fake_db.data["invoices"])))
+    assert ("invoices", False) not in fake_db.reads
+
+def test_stored_invoices_without_lookup_nodes_are_backfilled(fake_db, ingest, tmp_path):
+    fake_db.data["invoices"] = {"-legacy": make_invoice("A1", "C1", "15.01.2024")}
+    counts = ingest(write_invoices(tmp_path / "source", [make_invoice("A1", "C1", "15.01.2024"),
+                                                         make_invoice("A2", "C1", "15.02.2024")]))
+
+    assert counts["already_uploaded"] == 1 and counts["written"] == 1
+    assert fake_db.data["invoice_by_number"] == {"A1": "-legacy", "A2": "inv-A2"}
+    assert set(fake_db.data["invoices_by_customer"]["C1"]) == {"-legacy", "inv-A2"}
+
+def test_manifest_skips_only_invoices_still_stored(fake_db, ingest, tmp_path):
+    source = write_invoices(tmp_path / "source", [make_invoice("A1", "C1", "15.01.2024")])
+    assert ingest(source)["written"] == 1
+    assert ingest(source)["unchanged"] == 1
+
+    fake_db.data = {}
+    assert ingest(source)["written"] == 1
+    assert "inv-A1" in fake_db.data["invoices"]
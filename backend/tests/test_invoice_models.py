@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from conftest import make_invoice
+from invoice_models import Invoice, decode_invoice, partner_element, process_element
+
+def with_positions(positions):
+    invoice = make_invoice("A1", "C1")
+    invoice["Data"]["Abrechnungspositionen"] = {"AbrechnungspositionenElement": positions}
+    return invoice
+
+@pytest.mark.parametrize("positions, names", [
+    ([{"name": "Arbeitspreis", "amount": "80.50"}, {"name": "Grundpreis", "amount": "12"}], ("Arbeitspreis", "Grundpreis")),
+    ({"name": "Arbeitspreis", "amount": "80.50"}, ("Arbeitspreis",)),
+    (None, ()),
+    ([{"name": "Arbeitspreis"}, "broken"], ("Arbeitspreis",)),
+])
+def test_elements_may_be_a_list_a_single_dict_or_missing(positions, names):
+    invoice = Invoice.from_entry(with_positions(positions))
+    assert tuple(item.name for item in invoice.billing_items) == names
+
+def test_numbers_and_text_are_normalized():
+    raw = with_positions({"name": "Arbeitspreis", "amount": "80.50", "price": "", "dateFrom": None,
+                          "Abrechnungspositionen-Detailliert": {"Abrechnungspositionen-DetailliertElement": {
+                              "name": "Netz", "price": "abc"}}})
+    item = Invoice.from_entry(raw).billing_items[0]
+    assert (item.amount, item.price, item.date_from) == (80.5, 0.0, "")
+    assert item.details[0].name == "Netz" and item.details[0].price == 0.0
+
+def test_process_data_reads_list_and_dict_variants():
+    invoice = make_invoice("A1", "C1")
+    process = invoice["Data"]["ProzessDaten"]["ProzessDatenElement"]
+    as_list = {"Data": {"ProzessDaten": {"ProzessDatenElement": [process]}}}
+    for entry in (invoice, as_list, invoice["Data"]):
+        assert process_element(entry)["invoiceNumber"] == "A1"
+        assert partner_element(entry)["customerNumber"] == "C1"
+    assert process_element(None) == {} and partner_element({}) == {}
+
+def test_decode_invoice_builds_the_typed_model():
+    invoice = decode_invoice(json.dumps(make_invoice("A1", "C1")).encode())
+    assert invoice.process.invoice_amount == 100.0
+    assert invoice.process.partner.customer_number == "C1"
+    assert invoice.process.partner.full_name == "Muster"
+    assert invoice.consumption == () and invoice.cost_blocks == ()
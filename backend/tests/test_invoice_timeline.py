@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+import invoice_timeline
+from conftest import make_invoice
+from invoice_timeline import CustomerTimeline, TimelineIndex
+
+def invoices(*dates, amounts=None):
+    found = {}
+    for n, date in enumerate(dates):
+        invoice = make_invoice(f"A{n}", "C1", date)
+        if amounts:
+            invoice["Data"]["ProzessDaten"]["ProzessDatenElement"]["invoiceAmount"] = amounts[n]
+        found[f"inv-A{n}"] = invoice
+    return found
+
+def test_timeline_orders_invoices_by_date():
+    timeline = CustomerTimeline.from_invoices("C1", invoices("15.03.2024", "15.01.2024", "15.02.2024", "undated"))
+    assert [entry.key for entry in timeline.entries] == ["inv-A1", "inv-A2", "inv-A0"]
+    assert "inv-A3" not in timeline and "inv-A3" in timeline.fetched_keys
+    assert timeline.previous("inv-A0").key == "inv-A2"
+    assert timeline.previous("inv-A1") is None
+    assert [entry.key for entry in timeline.last("inv-A2", 5)] == ["inv-A1", "inv-A2"]
+
+def test_year_over_year_allows_a_tolerance():
+    timeline = CustomerTimeline.from_invoices("C1", invoices("20.02.2023", "15.01.2024", "15.02.2024"))
+    assert timeline.year_over_year("inv-A2").key == "inv-A0"
+    assert timeline.year_over_year("inv-A2", tolerance_days=3) is None
+    assert timeline.nearest(datetime(2024, 1, 20), timedelta(days=7)).key == "inv-A1"
+
+def test_trend_summarizes_the_last_bills():
+    timeline = CustomerTimeline.from_invoices(
+        "C1", invoices("15.01.2024", "15.02.2024", "15.03.2024", amounts=["90.00", "100.00", "120.00"]))
+    trend = timeline.trend("inv-A2", periods=2)
+    assert [bill["invoice_number"] for bill in trend["bills"]] == ["A1", "A2"]
+    assert trend["average_amount"] == 110.0 and trend["amount_change"] == 20.0
+
+def test_index_refetches_for_unknown_invoices_and_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(invoice_timeline.time, "time", lambda: now[0])
+    stored = invoices("15.01.2024")
+    fetched = []
+
+    def fetch(customer_number):
+        fetched.append(customer_number)
+        return dict(stored)
+
+    index = TimelineIndex(fetch, ttl=60)
+    assert len(index.get("C1", "inv-A0")) == 1
+    assert index.get("C1", "inv-A0") is index.get("C1")
+    stored.update(invoices("15.01.2024", "15.02.2024"))
+    assert len(index.get("C1", "inv-A1")) == 2
+    now[0] += 61
+    index.get("C1")
+    assert fetched == ["C1", "C1", "C1"] and index.hits == 2
+
+def test_index_keeps_the_most_recently_used_customers():
+    index = TimelineIndex(lambda customer_number: {}, ttl=60, max_customers=2)
+    for customer_number in ("C1", "C2", "C1", "C3"):
+        index.get(customer_number)
+    assert list(index._timelines) == ["C1", "C3"]
+    assert index.get(None) is None
@@ -0,0 +1,57 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from llama_runtime import LlamaCppModel
+
+class FakeLlama:
+    """Token context of llama_cpp.Llama: one token per byte, save/load_state copy it"""
+
+    def __init__(self):
+        self.input_ids = np.zeros(64, dtype=np.intc)
+        self.n_tokens = 0
+        self.evaluated = 0
+        self.loads = 0
+
+    def tokenize(self, text, add_bos=True):
+        return [1] * add_bos + list(text)
+
+    def reset(self):
+        self.n_tokens = 0
+
+    def eval(self, tokens):
+        self.input_ids[self.n_tokens:self.n_tokens + len(tokens)] = tokens
+        self.n_tokens += len(tokens)
+        self.evaluated += len(tokens)
+
+    def save_state(self):
+        return self.input_ids.copy(), self.n_tokens
+
+    def load_state(self, state):
+        self.input_ids, self.n_tokens = state[0].copy(), state[1]
+        self.loads += 1
+
+def make_model():
+    model = LlamaCppModel.__new__(LlamaCppModel)
+    model.llm = FakeLlama()
+    model.max_prefixes = 2
+    model._prefix_states = OrderedDict()
+    model.prefix_hits = model.prefix_restores = model.prefix_misses = 0
+    model.prefix_eval_seconds = 0.0
+    return model
+
+def test_prefix_already_in_context_is_not_restored():
+    model = make_model()
+    model.prime_prefix("ab")
+    model.llm.eval([ord("x")])  # the suffix of the first prompt
+    model.prime_prefix("ab")
+    assert (model.prefix_misses, model.prefix_hits, model.prefix_restores) == (1, 1, 0)
+    assert model.llm.loads == 0
+
+def test_other_prefix_in_context_restores_the_snapshot():
+    model = make_model()
+    model.prime_prefix("ab")
+    model.prime_prefix("cd")
+    model.prime_prefix("ab")
+    assert (model.prefix_misses, model.prefix_hits, model.prefix_restores) == (2, 0, 1)
+    assert model.llm.input_ids[:model.llm.n_tokens].tolist() == [1, ord("a"), ord("b")]
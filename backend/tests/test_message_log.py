@@ -0,0 +1,75 @@
+import json
+import os
+import time
+
+from message_log import MessageLogger, _try_lock, message_log_path
+
+def make_logger(tmp_path, writes, **options):
+    options.setdefault("journal", False)
+    return MessageLogger(writes.append, journal_dir=str(tmp_path), **options)
+
+def test_flush_writes_full_batches_in_order(tmp_path):
+    writes = []
+    logger = make_logger(tmp_path, writes, batch_size=2)
+    keys = [logger.log("messages/customers/C1", {"n": n}) for n in range(5)]
+
+    while logger.flush():
+        pass
+    assert [len(batch) for batch in writes] == [2, 2, 1]
+    assert [path for batch in writes for path in batch] == [f"messages/customers/C1/{key}" for key in keys]
+    assert keys == sorted(keys)
+
+def test_failed_write_stays_queued():
+    writes = []
+
+    def write(batch):
+        if not writes:
+            writes.append(None)
+            raise ConnectionError("offline")
+        writes.append(batch)
+
+    logger = MessageLogger(write, batch_size=10, journal=False)
+    logger.log("messages/invoices/I1", {"n": 1})
+    assert not logger.flush()
+    assert logger.flush()
+    assert len(writes[1]) == 1 and logger.failed_batches == 1
+
+def test_close_drains_the_queue(tmp_path):
+    writes = []
+    logger = make_logger(tmp_path, writes, batch_size=100, flush_interval=60)
+    logger.start()
+    logger.log_many([("messages/customers/C1", {"n": n}) for n in range(3)])
+    started = time.perf_counter()
+    logger.close(timeout=5)
+    assert sum(len(batch) for batch in writes) == 3
+    assert time.perf_counter() - started < 5
+
+def test_orphaned_journal_is_replayed(tmp_path):
+    entries = [{"path": f"messages/customers/C1/-key{n}", "data": {"n": n}} for n in range(3)]
+    orphan = tmp_path / ".message_journal-999999.ndjson"
+    orphan.write_text("".join(json.dumps(entry) + "\n" for entry in entries))
+
+    writes = []
+    logger = make_logger(tmp_path, writes, journal=True)
+    logger.start()
+    logger.close(timeout=5)
+    assert logger.replayed == 3
+    assert {path for batch in writes for path in batch} == {entry["path"] for entry in entries}
+    assert os.listdir(tmp_path) == []
+
+def test_journal_of_a_running_process_is_left_alone(tmp_path):
+    journal = tmp_path / ".message_journal-424242.ndjson"
+    journal.write_text(json.dumps({"path": "messages/customers/C1/-key", "data": {}}) + "\n")
+    owner = _try_lock(str(tmp_path / ".message_journal-424242.lock"))
+    try:
+        logger = make_logger(tmp_path, [], journal=True)
+        logger.start()
+        logger.close(timeout=5)
+        assert logger.replayed == 0 and journal.exists()
+    finally:
+        owner.close()
+
+def test_message_log_path_prefers_the_customer():
+    assert message_log_path("10 00/5", "INV1") == "messages/customers/10_00_5"
+    assert message_log_path(None, "INV.1") == "messages/invoices/INV_1"
+    assert message_log_path(None, None) is None
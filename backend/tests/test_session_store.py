@@ -0,0 +1,59 @@
+import pytest
+
+import session_store
+from session_store import InMemorySessionStore, SQLiteSessionStore
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(**options):
+        if request.param == "sqlite":
+            return SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"), sweep_interval=0, **options)
+        return InMemorySessionStore(**options)
+    return make
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(session_store.time, "time", lambda: now[0])
+    return now
+
+def test_history_keeps_the_newest_queries(make_store):
+    store = make_store(max_history=3)
+    for n in range(5):
+        history = store.append_query("s1", f"q{n}")
+    assert history == ["q2", "q3", "q4"]
+    assert store.get_history("s1") == ["q2", "q3", "q4"]
+    assert store.get_history("s2") == []
+
+def test_idle_sessions_expire(make_store, clock):
+    store = make_store(ttl=60)
+    store.append_query("s1", "first")
+    clock[0] += 30
+    assert store.append_query("s1", "second") == ["first", "second"]
+    # The TTL slides with each query
+    clock[0] += 61
+    assert store.get_history("s1") == []
+    assert store.append_query("s1", "again") == ["again"]
+
+def test_oldest_sessions_are_dropped_beyond_the_limit(make_store, clock):
+    store = make_store(max_sessions=2)
+    for session_id in ("s1", "s2", "s3"):
+        clock[0] += 1
+        store.append_query(session_id, "q")
+    assert store.get_history("s1") == []
+    assert store.get_history("s3") == ["q"]
+    assert store.stats()["sessions"] == 2
+
+def test_clear_forgets_the_session(make_store):
+    store = make_store()
+    store.append_query("s1", "q")
+    store.clear("s1")
+    assert store.get_history("s1") == []
+
+def test_create_session_store_follows_the_environment(monkeypatch, tmp_path):
+    monkeypatch.setenv("SESSION_SQLITE_PATH", str(tmp_path / "sessions.sqlite3"))
+    monkeypatch.setenv("SESSION_HISTORY", "5")
+    store = session_store.create_session_store("sqlite")
+    assert isinstance(store, SQLiteSessionStore) and store.max_history == 5
+    monkeypatch.delenv("SESSION_STORE", raising=False)
+    assert isinstance(session_store.create_session_store(), InMemorySessionStore)
@@ -0,0 +1,51 @@
+import os
+import time
+
+import pytest
+
+from startup import LockFile, StartupPhases
+
+def test_lock_is_held_by_one_owner_at_a_time(tmp_path):
+    path = str(tmp_path / "task.lock")
+    first, second = LockFile(path, stale_after=60), LockFile(path, stale_after=60)
+    assert first.acquire()
+    assert not second.acquire()
+    first.release()
+    assert not os.path.exists(path)
+    with second as acquired:
+        assert acquired
+    assert not os.path.exists(path)
+
+def test_stale_lock_is_taken_over(tmp_path):
+    path = tmp_path / "task.lock"
+    path.write_text("999999\n")
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    lock = LockFile(str(path), stale_after=60)
+    assert lock.acquire()
+    assert path.read_text() == f"{os.getpid()}\n"
+
+def test_failed_acquire_leaves_the_owner_lock(tmp_path):
+    path = str(tmp_path / "task.lock")
+    owner = LockFile(path, stale_after=60)
+    owner.acquire()
+    other = LockFile(path, stale_after=60)
+    other.acquire()
+    other.release()
+    assert os.path.exists(path)
+
+def test_ready_once_required_phases_are_done_or_skipped():
+    phases = StartupPhases(required=["model", "index"])
+    with phases.phase("model"):
+        pass
+    assert not phases.ready
+    phases.skip("index", "disabled")
+    assert phases.ready and phases.is_done("model")
+
+def test_failed_phase_is_reported():
+    phases = StartupPhases(required=["model"])
+    with pytest.raises(RuntimeError):
+        with phases.phase("model"):
+            raise RuntimeError("no weights")
+    assert phases.report()["phases"]["model"]["error"] == "no weights"
+    assert not phases.ready
@@ -30,6 +30,15 @@ if (urlCustomerNumber || urlInvoiceNumber) {
   clearSessionData();  // Clear old session data on new param usage
 }
 
+// Every page load starts a new conversation; the backend keys its history on this id
+function newSessionId() {
+  if (window.crypto && crypto.randomUUID) {
+    return crypto.randomUUID();
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+}
+const sessionId = newSessionId();
+
 if (urlCustomerNumber) {
   localStorage.setItem('customerNumber', urlCustomerNumber);
 }
@@ -72,6 +81,7 @@ const translations = {
     inputPlaceholderDisabled: 'Please enter your customer/invoice number first...',
     greeting: (name) => name ? `Hi ${name} How can I help?` : 'Hi! How can I help you today?',
     error: 'Something went wrong. Please try again.',
+    truncated: 'The answer was cut off. Please try again.',
     selectInvoice: 'Please select an invoice:',
     thanksFeedback: 'Thanks for your feedback! 😊',
     sorryFeedback: 'Sorry I couldn\'t help better. 😔',
@@ -99,6 +109,7 @@ const translations = {
     inputPlaceholderDisabled: 'Bitte zuerst Kunden-/Rechnungsnummer eingeben...',
     greeting: (name) => name ? `Hallo ${name} Wie kann ich helfen?` : 'Hallo! Wie kann ich dir helfen?',
     error: 'Etwas ist schiefgelaufen. Bitte versuche es erneut.',
+    truncated: 'Die Antwort wurde abgebrochen. Bitte versuche es erneut.',
     selectInvoice: 'Bitte wähle eine Rechnung:',
     thanksFeedback: 'Danke für dein Feedback! 😊',
     sorryFeedback: 'Entschuldigung, dass ich nicht besser helfen konnte. 😔',
@@ -656,84 +667,162 @@ async function sendMessage(text) {
     message: text,
     language: currentLanguage,
     customer_number: currentCustomerNumber,
-    invoice_number: currentInvoiceNumber
+    invoice_number: currentInvoiceNumber,
+    session_id: sessionId,
+    // The chat view renders no invoice figures; they are available once per session from /invoice/{number}
+    slim: true
   };
 
   try {
-    const response = await fetch(`${BACKEND_BASE_URL}/chat`, {
+    const response = await fetch(`${BACKEND_BASE_URL}/chat/stream`, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify(payload)
     });
 
-    const data = await response.json();
-    messageList.removeChild(typingMsg);
-
-    // Handle multiple invoice selection (shouldn't happen if validated properly)
-    if (data.needs_invoice_number && data.invoice_suggestions?.length > 0) {
-      displayInvoiceSelection(data.response, data.invoice_suggestions);
+    const contentType = response.headers.get('content-type') || '';
+    if (!contentType.includes('text/event-stream') || !response.body) {
+      // Errors and backpressure responses come back as plain JSON
+      const data = await response.json().catch(() => ({}));
+      messageList.removeChild(typingMsg);
+      if (!response.ok || data.error || typeof data.response !== 'string') {
+        // Busy (503/504) and startup errors are shown but are not part of the conversation
+        const detail = typeof data.detail === 'string' ? data.detail : null;
+        appendMessage(data.response || detail || translations[currentLanguage].error, 'assistant error');
+        return;
+      }
+      if (handleChatMeta(data)) return;
+      finishAssistantMessage(text, data.response, appendMessage(data.response, 'assistant'));
       return;
     }
 
-    // Update session information
-    if (data.session_customer_number) {
-      currentCustomerNumber = data.session_customer_number;
-      localStorage.setItem('customerNumber', currentCustomerNumber);
-    }
-    
-    if (data.session_invoice_number) {
-      currentInvoiceNumber = data.session_invoice_number;
-      localStorage.setItem('invoiceNumber', currentInvoiceNumber);
-    }
+    let assistantMsg = null;
+    let streamedText = '';
+    // The server still sends done after an error; a failed answer is neither kept nor logged
+    let errored = false;
 
-    // Always log user message
-    fetch(`${BACKEND_BASE_URL}/log_message`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({
-        customer_number: currentCustomerNumber,
-        invoice_number: currentInvoiceNumber,
-        message: text,
-        role: 'user',
-        timestamp: new Date().toISOString(),
-        topic: null,
-        session_id: null
-      })
-    }).catch(err => console.error('User message log error:', err));
+    await readServerSentEvents(response, (event, data) => {
+      if (event === 'structured') {
+        if (handleChatMeta(data)) {
+          messageList.removeChild(typingMsg);
+          assistantMsg = false;
+        }
+      } else if (event === 'token' && assistantMsg !== false) {
+        if (!assistantMsg) {
+          messageList.removeChild(typingMsg);
+          assistantMsg = appendMessage('', 'assistant');
+        }
+        streamedText += data.text;
+        assistantMsg.innerHTML = streamedText.replace(/\n/g, '<br>');
+        messageList.scrollTop = messageList.scrollHeight;
+      } else if (event === 'error' && assistantMsg !== false) {
+        errored = true;
+        if (!assistantMsg) {
+          messageList.removeChild(typingMsg);
+          assistantMsg = appendMessage(translations[currentLanguage].error, 'assistant error');
+        } else {
+          // Keep what was streamed, marked as incomplete
+          assistantMsg.classList.add('error');
+          assistantMsg.innerHTML += `<br><em>${translations[currentLanguage].truncated}</em>`;
+        }
+      } else if (event === 'done' && assistantMsg !== false && !errored) {
+        if (!assistantMsg) {
+          messageList.removeChild(typingMsg);
+          assistantMsg = appendMessage(data.response, 'assistant');
+        } else if (data.response) {
+          assistantMsg.innerHTML = data.response.replace(/\n/g, '<br>');
+        }
+        finishAssistantMessage(text, data.response || streamedText, assistantMsg);
+      }
+    });
 
-    // Update greeting with customer info
-    if (data.customer_greeting) {
-      const greeting = translations[currentLanguage].greeting(data.customer_greeting);
-      localStorage.setItem('customerGreeting', greeting);
-    }
+  } catch (error) {
+    if (typingMsg.parentNode) messageList.removeChild(typingMsg);
+    appendMessage(translations[currentLanguage].error, 'assistant error');
+    console.error('Chat error:', error);
+  }
+}
 
-    // Add assistant response
-    conversationContext.push({ role: 'assistant', content: data.response });
-    const assistantMsg = appendMessage(data.response, 'assistant');
-    addFeedbackButtons(assistantMsg);
+// Read a text/event-stream response body and dispatch each event
+async function readServerSentEvents(response, onEvent) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = 'message';
+      const dataLines = [];
+      rawEvent.split('\n').forEach(line => {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+      });
+      if (dataLines.length) onEvent(event, JSON.parse(dataLines.join('\n')));
+    }
+  }
+}
 
-    // Log assistant message
-    fetch(`${BACKEND_BASE_URL}/log_message`, {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({
-        customer_number: currentCustomerNumber,
-        invoice_number: currentInvoiceNumber,
-        message: data.response,
-        role: 'assistant',
-        timestamp: new Date().toISOString(),
-        topic: null,
-        session_id: null
-      })
-    }).catch(err => console.error('Assistant message log error:', err));
+// Apply session/invoice metadata from a chat response; returns true if the turn ends here
+function handleChatMeta(data) {
+  // Handle multiple invoice selection (shouldn't happen if validated properly)
+  if (data.needs_invoice_number && data.invoice_suggestions?.length > 0) {
+    displayInvoiceSelection(data.response, data.invoice_suggestions);
+    return true;
+  }
 
-    chatStarted = true;
+  // Update session information
+  if (data.session_customer_number) {
+    currentCustomerNumber = data.session_customer_number;
+    localStorage.setItem('customerNumber', currentCustomerNumber);
+  }
+  
+  if (data.session_invoice_number) {
+    currentInvoiceNumber = data.session_invoice_number;
+    localStorage.setItem('invoiceNumber', currentInvoiceNumber);
+  }
 
-  } catch (error) {
-    messageList.removeChild(typingMsg);
-    appendMessage(translations[currentLanguage].error, 'assistant error');
-    console.error('Chat error:', error);
+  // Update greeting with customer info
+  if (data.customer_greeting) {
+    const greeting = translations[currentLanguage].greeting(data.customer_greeting);
+    localStorage.setItem('customerGreeting', greeting);
   }
+  return false;
+}
+
+function finishAssistantMessage(userText, responseText, assistantMsg) {
+  // Add assistant response
+  conversationContext.push({ role: 'assistant', content: responseText });
+  addFeedbackButtons(assistantMsg);
+
+  // Log the whole turn in one request; the backend writes it to the database in the background
+  const timestamp = new Date().toISOString();
+  const logEntry = (message, role) => ({
+    customer_number: currentCustomerNumber,
+    invoice_number: currentInvoiceNumber,
+    message,
+    role,
+    timestamp,
+    topic: null,
+    session_id: sessionId
+  });
+  fetch(`${BACKEND_BASE_URL}/log_messages`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    keepalive: true,
+    body: JSON.stringify({
+      messages: [logEntry(userText, 'user'), logEntry(responseText, 'assistant')]
+    })
+  }).catch(err => console.error('Message log error:', err));
+
+  chatStarted = true;
 }
 
 // Initialize app